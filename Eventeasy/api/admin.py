@@ -1,5 +1,36 @@
 from django.contrib import admin
-from .models import Category, Service, Order, UserAccount, OrderItem
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import Category, Service, Order, UserAccount, OrderItem, OutboundEmail, PaymentCallback
+
+
+class EstimatedCountPaginator(Paginator):
+    # Unfiltered changelists of big PostgreSQL tables use the planner's row estimate
+    # instead of a COUNT(*) over the whole table; everything else is counted exactly
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.estimate_threshold:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the extra unfiltered COUNT(*) shown next to filtered results
+    show_full_result_count = False
+    list_per_page = 25
 
 # Category Admin
 @admin.register(Category)
@@ -13,26 +44,40 @@ class CategoryAdmin(admin.ModelAdmin):
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'price', 'category')
+    list_select_related = ('category',)
+    autocomplete_fields = ('category',)
+    search_fields = ('name',)
     list_per_page = 25
 
 # OrderItem Inline (to view in the Order page)
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 1
+    # A search box instead of a dropdown of every service
+    autocomplete_fields = ('service',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('order', 'service')
 
 # Order Admin
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'created_at', 'total_price', 'status')
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'created_at', 'total_price', 'item_count', 'status')
+    list_select_related = ('user',)
+    list_filter = ('status', 'paid')
+    readonly_fields = ('total_price', 'item_count')
+    raw_id_fields = ('user', 'provider')
     inlines = [OrderItemInline]
     ordering = ('-created_at',)
-    list_per_page = 25
+    # Drill-down by created_at, covered by order_created_idx
+    date_hierarchy = 'created_at'
 
 # UserAccount Admin
 @admin.register(UserAccount)
-class UserAccountAdmin(admin.ModelAdmin):
+class UserAccountAdmin(LargeTableAdmin):
     list_display = ('id', 'email', 'first_name', 'last_name', 'telephone', 'location', 'role')
-    list_per_page = 25
+    search_fields = ('email', 'first_name', 'last_name')
+    list_filter = ('role',)
 
 # CartItem Inline (to view in the Cart page)
 # class CartItemInline(admin.TabularInline):
@@ -55,6 +100,26 @@ class UserAccountAdmin(admin.ModelAdmin):
 
 # OrderItem Admin
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ('id', 'order', 'service', 'quantity')
-    list_per_page = 25
+    # Order.__str__ reads order.user.email, OrderItem.__str__ reads service.name
+    list_select_related = ('order__user', 'service')
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('service',)
+
+# Outbound email queue
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(LargeTableAdmin):
+    list_display = ('id', 'subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+
+# M-Pesa callback ledger
+@admin.register(PaymentCallback)
+class PaymentCallbackAdmin(LargeTableAdmin):
+    list_display = ('id', 'source', 'mpesa_code', 'amount', 'account_reference', 'status', 'order', 'received_at')
+    list_filter = ('status', 'source')
+    list_select_related = ('order__user',)
+    raw_id_fields = ('order',)
+    search_fields = ('mpesa_code', 'reference')
+    ordering = ('-received_at',)
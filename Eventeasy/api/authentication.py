@@ -0,0 +1,73 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings as drf_api_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+
+class UserCache:
+    # Per-process cache of active users by id; entries expire after AUTH_USER_CACHE_TTL seconds
+    # and are dropped by the UserAccount signals in models.py when this process saves a user
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        # Each request gets its own copy, so nothing it sets leaks into other requests
+        return copy.copy(entry[1])
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._users[user_id] = (time.monotonic() + settings.AUTH_USER_CACHE_TTL, copy.copy(user))
+            while len(self._users) > settings.AUTH_USER_CACHE_SIZE:
+                # Oldest insertion first
+                self._users.pop(next(iter(self._users)))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # Same checks as JWTAuthentication, but a warm cache means no query to load the user
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+        return user
+
+
+class TokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Lets clients route on role without another request
+        token['role'] = user.role
+        return token
+
+
+def endpoint_authentication_classes(endpoint):
+    # API_AUTHENTICATION_CLASSES can give an endpoint its own authenticator order
+    paths = settings.API_AUTHENTICATION_CLASSES.get(endpoint)
+    if paths is None:
+        return drf_api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    return [import_string(path) for path in paths]
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from .models import CalendarEntry
+
+
+def free_busy(provider_ids, start, end):
+    # {provider id: {'busy': [...], 'free': [...]}} over start..end (inclusive) from one range query
+    calendar = {provider_id: {'busy': [], 'free': []} for provider_id in provider_ids}
+    entries = (
+        CalendarEntry.objects.filter(provider_id__in=provider_ids).overlapping(start, end)
+        .order_by('provider_id', 'start').values_list('provider_id', 'start', 'end', 'kind')
+    )
+    for provider_id, entry_start, entry_end, kind in entries:
+        calendar[provider_id]['busy'].append({'start': max(entry_start, start), 'end': min(entry_end, end), 'kind': kind})
+
+    one_day = timedelta(days=1)
+    for days in calendar.values():
+        # Entries never overlap and are sorted, so the free ranges are the gaps between them
+        cursor = start
+        for busy in days['busy']:
+            if busy['start'] > cursor:
+                days['free'].append({'start': cursor, 'end': busy['start'] - one_day})
+            cursor = max(cursor, busy['end'] + one_day)
+        if cursor <= end:
+            days['free'].append({'start': cursor, 'end': end})
+    return calendar
@@ -0,0 +1,203 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import CalendarEntry, Category, Order, OrderItem, Service, UserAccount
+from .regions import PLACES, region_key
+
+PASSWORD = 'Bench-mark-2024'
+EVENT_TYPES = ['Wedding', 'Birthday', 'Corporate', 'Graduation', 'Funeral', 'Baby shower']
+# Latency metrics that can regress; query counts are compared exactly
+LATENCY_METRICS = ('p50', 'p95')
+# Slowdowns smaller than this are timer noise on the cached, sub-millisecond endpoints
+LATENCY_SLACK_MS = 1.0
+
+
+def seed_fixtures(clients=1000, providers=100, categories=20, services=2000, orders=10000, items=3, seed=0):
+    """
+    Bulk insert a deterministic data set: the same options and seed always give the same rows.
+
+    A fifth of the orders are claimed, by providers in turn and on different days each, with the
+    calendar bookings a claim would have made. Users share one password hash, since hashing is
+    the slow part of creating them.
+    """
+    rng = random.Random(seed)
+    places = sorted(PLACES)
+    password = make_password(PASSWORD)
+
+    def user(role, i):
+        location = rng.choice(places).title()
+        return UserAccount(
+            email=f'bench-{role.lower()}{i}@example.com', first_name='Bench', last_name=f'{role.title()} {i}',
+            password=password, role=role, location=location, region=region_key(location),
+        )
+
+    client_users = UserAccount.objects.bulk_create([user('CLIENT', i) for i in range(clients)])
+    provider_users = UserAccount.objects.bulk_create([user('PROVIDER', i) for i in range(providers)])
+    category_rows = Category.objects.bulk_create([Category(name=f'Category {i}') for i in range(categories)])
+    service_rows = Service.objects.bulk_create([
+        Service(
+            name=f'Service {i}', description='Benchmark service', category=rng.choice(category_rows),
+            price=Decimal(rng.randrange(500, 50000, 50)),
+        )
+        for i in range(services)
+    ])
+
+    today = date.today()
+    claimed = orders // 5
+    order_rows = []
+    for i in range(orders):
+        location = rng.choice(places).title()
+        order = Order(
+            user=rng.choice(client_users), telephone='0712345678', location=location, region=region_key(location),
+            event_type=rng.choice(EVENT_TYPES), date=today + timedelta(days=rng.randrange(1, 365)),
+        )
+        if i < claimed:
+            order.provider = provider_users[i % providers]
+            order.date = today + timedelta(days=i // providers + 1)
+            order.taken_by_provider = True
+            order.status = 'PROCESSING'
+        order_rows.append(order)
+    order_rows = Order.objects.bulk_create(order_rows, batch_size=2000)
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, service=service, quantity=rng.randint(1, 5), price=service.price)
+        for order in order_rows
+        for service in rng.sample(service_rows, rng.randint(1, 2 * items - 1))
+    ], batch_size=2000)
+    CalendarEntry.objects.bulk_create([
+        CalendarEntry(provider=order.provider, order=order, kind='BOOKING', start=order.date, end=order.date)
+        for order in order_rows[:claimed]
+    ], batch_size=2000)
+    Order.objects.filter(pk__in=[order.pk for order in order_rows]).refresh_totals()
+    return {
+        'clients': client_users, 'providers': provider_users,
+        'categories': category_rows, 'services': service_rows,
+    }
+
+
+def summarize(latencies, queries):
+    # Percentiles over the measured requests, in milliseconds
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(latencies),
+        'p50': round(cuts[49], 3), 'p90': round(cuts[89], 3), 'p95': round(cuts[94], 3),
+        'p99': round(cuts[98], 3), 'max': round(max(latencies), 3),
+        'throughput': round(len(latencies) / (sum(latencies) / 1000), 1),
+        'queries': statistics.median_low(queries), 'queries_max': max(queries),
+    }
+
+
+class ApiBenchmark:
+    """Drives the real URLconf in process with APIClient, one endpoint after another."""
+
+    def __init__(self, fixtures, requests=50, warmup=5):
+        self.fixtures = fixtures
+        self.requests = requests
+        self.warmup = warmup
+        self.clients = {}
+        self.created = []
+
+    def client_for(self, user):
+        # Real JWT headers, so authentication is part of what is measured
+        if user.pk not in self.clients:
+            client = APIClient()
+            header_type = settings.SIMPLE_JWT['AUTH_HEADER_TYPES'][0]
+            client.credentials(HTTP_AUTHORIZATION=f'{header_type} {AccessToken.for_user(user)}')
+            self.clients[user.pk] = client
+        return self.clients[user.pk]
+
+    def measure(self, name, expected_status, call):
+        latencies, queries = [], []
+        for i in range(self.warmup + self.requests):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                # The run never commits, so the on_commit work each request schedules (totals, stats,
+                # matches, events, emails) is run here, inside the timed section, as a commit would
+                with TestCase.captureOnCommitCallbacks(execute=True):
+                    response = call(i)
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != expected_status:
+                raise AssertionError(
+                    f"{name}: expected {expected_status}, got {response.status_code}: {response.content[:200]!r}"
+                )
+            if i >= self.warmup:
+                latencies.append(elapsed)
+                queries.append(len(ctx.captured_queries))
+        return summarize(latencies, queries)
+
+    def register(self, i):
+        return APIClient().post('/auth/register/', {
+            'email': f'bench-new{i}@example.com', 'first_name': 'Bench', 'last_name': 'New',
+            'password': PASSWORD, 'location': 'Nairobi',
+        }, format='json')
+
+    def login(self, i):
+        clients = self.fixtures['clients']
+        return APIClient().post('/auth/jwt/create/', {
+            'email': clients[i % len(clients)].email, 'password': PASSWORD,
+        }, format='json')
+
+    def catalog(self, i):
+        categories = self.fixtures['categories']
+        return APIClient().get(f'/services/?category={categories[i % len(categories)].pk}')
+
+    def order_create(self, i):
+        clients, services = self.fixtures['clients'], self.fixtures['services']
+        # Days past the seeded bookings, one per order, so any provider can claim any of them
+        day = date.today() + timedelta(days=1000 + i)
+        response = self.client_for(clients[i % len(clients)]).post('/orders/', {
+            'event_type': 'Wedding', 'telephone': '0712345678', 'location': 'Westlands, Nairobi', 'date': day,
+            'items': [
+                {'service': service.pk, 'quantity': 2, 'price': str(service.price)}
+                for service in (services[(i + k) % len(services)] for k in range(3))
+            ],
+        }, format='json')
+        if response.status_code == 201:
+            self.created.append(response.data['id'])
+        return response
+
+    def claim(self, i):
+        providers = self.fixtures['providers']
+        return self.client_for(providers[i % len(providers)]).post(f'/orders/{self.created[i]}/claim_order/')
+
+    def my_gigs(self, i):
+        providers = self.fixtures['providers']
+        return self.client_for(providers[i % len(providers)]).get('/orders/my_gigs/')
+
+    def run(self):
+        # claim takes the orders made by order_create, so the order of the steps matters
+        steps = [
+            ('register', 201, self.register),
+            ('login', 200, self.login),
+            ('catalog', 200, self.catalog),
+            ('order_create', 201, self.order_create),
+            ('claim', 200, self.claim),
+            ('my_gigs', 200, self.my_gigs),
+        ]
+        return {name: self.measure(name, expected, call) for name, expected, call in steps}
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as messages; empty when there are none."""
+    regressions = []
+    for name, before in baseline['endpoints'].items():
+        after = results['endpoints'].get(name)
+        if after is None:
+            regressions.append(f"{name}: missing from this run")
+            continue
+        for metric in LATENCY_METRICS:
+            if after[metric] > before[metric] * (1 + tolerance) + LATENCY_SLACK_MS:
+                regressions.append(f"{name}: {metric} {after[metric]:.2f}ms, baseline {before[metric]:.2f}ms")
+        if after['queries'] > before['queries']:
+            regressions.append(f"{name}: {after['queries']} queries per request, baseline {before['queries']}")
+    return regressions
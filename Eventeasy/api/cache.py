@@ -0,0 +1,145 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+GENERATION_KEY = 'catalog:generation'
+MODIFIED_KEY = 'catalog:modified'
+STATS_KEYS = ('catalog:hits', 'catalog:misses', 'catalog:not_modified')
+
+
+def initial_generation():
+    # Seeded from the clock: a generation key lost to eviction or a restart starts above every
+    # earlier value, so it never lines up with responses still cached under an old generation
+    return int(time.time() * 1000)
+
+
+def catalog_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = initial_generation()
+        cache.add(GENERATION_KEY, generation, timeout=None)
+        generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+async def acatalog_generation():
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        generation = initial_generation()
+        await cache.aadd(GENERATION_KEY, generation, timeout=None)
+        generation = await cache.aget(GENERATION_KEY, generation)
+    return generation
+
+
+def bump_catalog_generation():
+    # Every cached catalog response is keyed on the generation, so bumping it invalidates them all
+    cache.set(MODIFIED_KEY, int(time.time()), timeout=None)
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, initial_generation(), timeout=None)
+        return cache.incr(GENERATION_KEY)
+
+
+def record(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def catalog_cache_stats():
+    hits, misses, not_modified = (cache.get(key, 0) for key in STATS_KEYS)
+    return {
+        'generation': catalog_generation(),
+        'hits': hits,
+        'misses': misses,
+        'not_modified': not_modified,
+    }
+
+
+class CatalogCacheMixin:
+    # Read-through cache for list/retrieve, invalidated by the Service/Category signals in models.py
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, render, *args, **kwargs):
+        generation = catalog_generation()
+        url_hash = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        etag = f'"{generation}-{url_hash}"'
+        last_modified = cache.get(MODIFIED_KEY)
+
+        # Matches weakly, so the W/ ETags of compressed responses revalidate too
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            record('catalog:not_modified')
+            not_modified['ETag'] = etag
+            return not_modified
+
+        key = f'catalog:{generation}:{url_hash}'
+        data = cache.get(key)
+        if data is not None:
+            record('catalog:hits')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+        else:
+            record('catalog:misses')
+            response = render(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, response.data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        # Shared caches may keep the catalog but must revalidate it with the ETag
+        patch_cache_control(response, public=True, max_age=settings.CATALOG_MAX_AGE, must_revalidate=True)
+        return response
+
+
+class OrderConditionalMixin:
+    # ETag for order reads from the newest Order.updated_at, the row count and the catalog
+    # generation (items embed services). One aggregate query answers a revalidation with 304
+    # before the page is fetched or serialized. Only a single order also gets Last-Modified: a
+    # list's newest updated_at goes backwards when that order leaves the list, so If-Modified-Since
+    # alone would get a 304 for a list that changed.
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(request, queryset, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = self.get_queryset().filter(pk=kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return self.conditional_response(request, queryset, super().retrieve, *args, **kwargs)
+
+    def conditional_response(self, request, queryset, render, *args, **kwargs):
+        state = queryset.order_by().aggregate(updated_at=Max('updated_at'), count=Count('pk'))
+        updated_at = state['updated_at']
+        version = f"{request.build_absolute_uri()}|{request.user.pk}|{catalog_generation()}|{state['count']}|{updated_at and updated_at.isoformat()}"
+        etag = f'"{hashlib.md5(version.encode()).hexdigest()}"'
+        last_modified = None
+        if self.action == 'retrieve' and updated_at:
+            # The order's own changes only move forward; embedded services change with the catalog
+            last_modified = max(int(updated_at.timestamp()), cache.get(MODIFIED_KEY) or 0)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            response['ETag'] = etag
+        else:
+            response = render(request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+        # Per-user data: browsers may keep it, shared caches may not, and both revalidate
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,235 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .cache import bump_catalog_generation
+from .models import Category, Service
+
+# Columns per model, in file order; 'category' is a Category id on export and an id or name on import
+COLUMNS = {
+    'services': ('id', 'name', 'description', 'price', 'category'),
+    'categories': ('id', 'name', 'description'),
+}
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/jsonl'}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def export_rows(kind, file_format, chunk_size=2000):
+    # Yields the catalog a line at a time; iterator() keeps memory flat however many rows there are
+    columns = COLUMNS[kind]
+    if kind == 'services':
+        rows = Service.objects.order_by('id').values_list('id', 'name', 'description', 'price', 'category_id')
+    else:
+        rows = Category.objects.order_by('id').values_list(*columns)
+
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield writer.writerow(row)
+    else:
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield json.dumps(dict(zip(columns, row)), default=str) + '\n'
+
+
+def read_rows(stream, file_format):
+    # stream is a binary file object; rows are decoded lazily. A row that cannot be parsed is
+    # yielded as a ValueError, so import_rows reports it with its row number like a bad value.
+    # Bytes that are not UTF-8 decode to surrogates and fail only their own row.
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='surrogateescape', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        while True:
+            try:
+                row = next(reader)
+                for value in row.values():
+                    if isinstance(value, str):
+                        value.encode()
+            except StopIteration:
+                return
+            except csv.Error as exc:
+                yield ValueError(f"invalid CSV: {exc}")
+            except UnicodeEncodeError:
+                yield ValueError("not UTF-8")
+            else:
+                yield row
+    else:
+        for line in text:
+            if line.strip():
+                try:
+                    line.encode()
+                    yield json.loads(line)
+                except UnicodeEncodeError:
+                    yield ValueError("not UTF-8")
+                except ValueError as exc:
+                    yield ValueError(f"invalid JSON: {exc}")
+
+
+def clean_id(value, model):
+    if value in (None, ''):
+        return None
+    pk = int(value)
+    low, high = connection.ops.integer_field_range(model._meta.pk.get_internal_type())
+    if pk < 1 or (high is not None and pk > high):
+        raise ValueError(f"id {value!r} out of range")
+    return pk
+
+
+def resolve_categories(rows):
+    # Every category a chunk mentions, by id or by name, in at most two queries
+    refs = {str(row.get('category', '')).strip() for row in rows}
+    ids = {int(ref) for ref in refs if ref.isdigit()}
+    names = {ref for ref in refs if ref and not ref.isdigit()}
+    found = {str(pk): pk for pk in Category.objects.filter(pk__in=ids).values_list('pk', flat=True)}
+    if names:
+        found.update(Category.objects.filter(name__in=names).order_by('-id').values_list('name', 'pk'))
+    return found
+
+
+def build_service(row, categories):
+    category = categories.get(str(row.get('category', '')).strip())
+    if category is None:
+        raise ValueError(f"unknown category {row.get('category')!r}")
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise ValueError("name is required")
+    try:
+        price = Decimal(str(row.get('price')))
+        # The column's own checks: finite, at most max_digits digits and decimal_places places
+        for validator in Service._meta.get_field('price').validators:
+            validator(price)
+    except (InvalidOperation, ValidationError):
+        raise ValueError(f"invalid price {row.get('price')!r}")
+    return Service(
+        id=clean_id(row.get('id'), Service), name=name[:200], description=row.get('description') or '',
+        price=price, category_id=category,
+    )
+
+
+def build_category(row, categories):
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise ValueError("name is required")
+    return Category(id=clean_id(row.get('id'), Category), name=name[:100], description=row.get('description') or '')
+
+
+def upsert(model, objects, update_fields):
+    model.objects.bulk_create(objects, update_conflicts=True, unique_fields=['id'], update_fields=update_fields)
+
+
+def import_rows(kind, rows, chunk_size=500):
+    # Upserts on id: rows with an existing id are updated, the rest inserted.
+    # Bad rows are skipped and reported as (row number, message); each chunk commits on its own.
+    model, build = (Service, build_service) if kind == 'services' else (Category, build_category)
+    update_fields = [column if column != 'category' else 'category_id' for column in COLUMNS[kind][1:]]
+    rows = iter(rows)
+    imported, errors, number, explicit_ids = 0, [], 0, False
+    try:
+        while chunk := list(islice(rows, chunk_size)):
+            valid = [row for row in chunk if isinstance(row, dict)]
+            categories = resolve_categories(valid) if kind == 'services' else None
+            built, by_id = [], {}
+            for row in chunk:
+                number += 1
+                try:
+                    if isinstance(row, Exception):
+                        raise row
+                    if not isinstance(row, dict):
+                        raise ValueError("row must be an object")
+                    obj = build(row, categories)
+                except (TypeError, ValueError) as exc:
+                    errors.append((number, str(exc)))
+                    continue
+                if obj.id is not None:
+                    # One statement cannot upsert the same id twice (PostgreSQL refuses); the last row wins
+                    if obj.id in by_id:
+                        errors.append((by_id[obj.id], f"id {obj.id} repeated in row {number}"))
+                    by_id[obj.id] = number
+                built.append((number, obj))
+            built = [(n, obj) for n, obj in built if obj.id is None or by_id[obj.id] == n]
+            objects = [obj for _, obj in built]
+            try:
+                with transaction.atomic():
+                    upsert(model, objects, update_fields)
+            except DatabaseError:
+                # Some row the database refused: retry the chunk row by row, so only those rows are skipped
+                objects = []
+                for n, obj in built:
+                    try:
+                        with transaction.atomic():
+                            upsert(model, [obj], update_fields)
+                    except DatabaseError as exc:
+                        errors.append((n, f"rejected by the database: {exc}"))
+                    else:
+                        objects.append(obj)
+            imported += len(objects)
+            explicit_ids = explicit_ids or any(obj.id is not None for obj in objects)
+    finally:
+        # Earlier chunks are committed whatever stopped this one
+        if explicit_ids:
+            # Rows inserted with their own ids leave PostgreSQL's sequence behind
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                    cursor.execute(sql)
+        if imported:
+            # bulk_create sends no post_save, so invalidate the catalog cache once here
+            transaction.on_commit(bump_catalog_generation)
+    # Duplicates are reported when the later row is seen, so put them back in file order
+    errors.sort()
+    return imported, errors
+
+
+class CatalogTransferMixin:
+    # Staff-only bulk export/import actions for the catalog viewsets
+    transfer_kind = None
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in FORMATS:
+            return Response(
+                {"error": f"file_format must be one of {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        response = StreamingHttpResponse(
+            export_rows(self.transfer_kind, file_format), content_type=CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.transfer_kind}.{file_format}"'
+        return response
+
+    @action(detail=False, methods=['POST'], permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "Upload the file as 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('file_format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in FORMATS:
+            return Response(
+                {"error": f"file_format must be one of {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Unreadable lines are reported per row too, so the committed chunks are always counted
+        imported, errors = import_rows(self.transfer_kind, read_rows(upload, file_format))
+        return Response({
+            'imported': imported,
+            'skipped': len(errors),
+            # Enough to fix a file without echoing back every bad row
+            'errors': [{'row': number, 'error': message} for number, message in errors[:100]],
+        })
@@ -0,0 +1,51 @@
+from ipaddress import ip_network
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.utils.module_loading import import_string
+
+UNCONFIGURED = "Neither MPESA_CALLBACK_TOKEN nor MPESA_ALLOWED_IPS is set; M-Pesa callbacks will be refused"
+HINT = "Set MPESA_CALLBACK_TOKEN and/or MPESA_ALLOWED_IPS (Safaricom's callback addresses)."
+
+
+def mpesa_allowlist_errors():
+    errors = []
+    for network in settings.MPESA_ALLOWED_IPS:
+        try:
+            ip_network(network)
+        except ValueError:
+            errors.append(Error(f"MPESA_ALLOWED_IPS has an invalid address {network!r}", id='api.E002'))
+    return errors
+
+
+@register(Tags.security)
+def check_mpesa_callback(app_configs, **kwargs):
+    # The callback refuses everything until it is configured; say so on every run
+    errors = mpesa_allowlist_errors()
+    if not settings.MPESA_CALLBACK_TOKEN and not settings.MPESA_ALLOWED_IPS:
+        errors.append(Warning(UNCONFIGURED, hint=HINT, id='api.W001'))
+    return errors
+
+
+@register(Tags.security, deploy=True)
+def check_mpesa_callback_deploy(app_configs, **kwargs):
+    # `manage.py check --deploy` fails outright: a deployment without either takes no payments
+    if not settings.MPESA_CALLBACK_TOKEN and not settings.MPESA_ALLOWED_IPS:
+        return [Error(UNCONFIGURED, hint=HINT, id='api.E001')]
+    return []
+
+
+@register(Tags.caches)
+def check_throttle_store(app_configs, **kwargs):
+    # CacheBucketStore counts with cache.incr(), which only redis, memcached and locmem do atomically
+    from .throttling import ATOMIC_CACHES, CacheBucketStore
+
+    store = import_string(settings.THROTTLE_STORE)
+    backend = settings.CACHES['default']['BACKEND']
+    if issubclass(store, CacheBucketStore) and backend not in ATOMIC_CACHES:
+        return [Error(
+            f"THROTTLE_STORE needs a cache with an atomic incr(), and {backend} has none",
+            hint="Use redis or memcached for CACHES, or THROTTLE_STORE=api.throttling.MemoryBucketStore.",
+            id='api.E003',
+        )]
+    return []
@@ -1,10 +1,133 @@
+import asyncio
+from datetime import timedelta
+from asgiref.sync import sync_to_async
 from templated_mail.mail import BaseEmailMessage
+from django.conf import settings as django_settings
 from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
 from djoser import utils
 from djoser.conf import settings
 from .constants import ReactUrl, SiteName
+from .models import OutboundEmail
 
-class ActivationEmail(BaseEmailMessage):
+
+class QueuedEmailMessage(BaseEmailMessage):
+    # Rendered during the request (the context needs it), delivered later by send_queued_emails
+    def send(self, to, *args, **kwargs):
+        if not django_settings.EMAIL_QUEUE_ENABLED:
+            return super().send(to, *args, **kwargs)
+
+        self.render()
+        OutboundEmail.objects.create(**self.outbound_fields(to, kwargs))
+
+    def outbound_fields(self, to, kwargs):
+        # OutboundEmail columns for a rendered message, with send()'s keyword arguments
+        return {
+            'subject': self.subject,
+            'body': self.body,
+            'html': self.html or '',
+            'from_email': kwargs.get('from_email', django_settings.DEFAULT_FROM_EMAIL),
+            'to': list(to),
+            'cc': kwargs.get('cc', []),
+            'bcc': kwargs.get('bcc', []),
+            'reply_to': kwargs.get('reply_to', []),
+        }
+
+
+def claim_due_emails(batch_size):
+    # Push the batch's next attempt out by the lease so concurrent workers skip it
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='PENDING', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=ids).update(
+            next_attempt_at=now + timedelta(seconds=django_settings.EMAIL_QUEUE_LEASE)
+        )
+    return list(OutboundEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def deliver(emails):
+    # Sends emails over a single SMTP connection and returns (sent, failed); touches no database
+    sent, failed = [], []
+    connection = get_connection()
+    try:
+        connection.open()
+        for email in emails:
+            message = EmailMultiAlternatives(
+                subject=email.subject, body=email.body or email.html, from_email=email.from_email,
+                to=email.to, cc=email.cc, bcc=email.bcc, reply_to=email.reply_to, connection=connection,
+            )
+            if email.body and email.html:
+                message.attach_alternative(email.html, 'text/html')
+            elif email.html:
+                message.content_subtype = 'html'
+            try:
+                message.send()
+            except Exception as exc:
+                email.last_error = repr(exc)
+                failed.append(email)
+            else:
+                sent.append(email)
+    except Exception as exc:
+        # Could not even connect: the whole batch is retried
+        failed = [email for email in emails if email not in sent]
+        for email in failed:
+            email.last_error = repr(exc)
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def mark_delivered(sent, failed):
+    now = timezone.now()
+    for email in sent:
+        email.status = 'SENT'
+        email.sent_at = now
+        email.attempts += 1
+    for email in failed:
+        email.attempts += 1
+        if email.attempts >= django_settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+            email.status = 'FAILED'
+        else:
+            # Exponential backoff: 30s, 60s, 120s, ... capped at an hour
+            delay = min(django_settings.EMAIL_QUEUE_RETRY_DELAY * 2 ** (email.attempts - 1), 3600)
+            email.next_attempt_at = now + timedelta(seconds=delay)
+    return sent + failed
+
+
+UPDATE_FIELDS = ['status', 'sent_at', 'attempts', 'next_attempt_at', 'last_error']
+
+
+def send_queued_emails(batch_size=None):
+    # Sends one batch over a single SMTP connection and returns (sent, failed)
+    emails = claim_due_emails(batch_size or django_settings.EMAIL_QUEUE_BATCH_SIZE)
+    if not emails:
+        return 0, 0
+    sent, failed = deliver(emails)
+    OutboundEmail.objects.bulk_update(mark_delivered(sent, failed), UPDATE_FIELDS)
+    return len(sent), len(failed)
+
+
+async def asend_queued_emails(batch_size=None, connections=4):
+    # Like send_queued_emails, but the batch is split over several SMTP connections used at
+    # once. smtplib blocks, so each connection runs in its own thread while the loop waits.
+    emails = await sync_to_async(claim_due_emails)(batch_size or django_settings.EMAIL_QUEUE_BATCH_SIZE)
+    if not emails:
+        return 0, 0
+    chunks = [emails[i::connections] for i in range(min(connections, len(emails)))]
+    results = await asyncio.gather(*(sync_to_async(deliver, thread_sensitive=False)(chunk) for chunk in chunks))
+    sent = [email for chunk_sent, _ in results for email in chunk_sent]
+    failed = [email for _, chunk_failed in results for email in chunk_failed]
+    await OutboundEmail.objects.abulk_update(mark_delivered(sent, failed), UPDATE_FIELDS)
+    return len(sent), len(failed)
+
+class ActivationEmail(QueuedEmailMessage):
     template_name = "email/activation.html"
 
     def get_context_data(self):
@@ -20,7 +143,7 @@ class ActivationEmail(BaseEmailMessage):
         context["site_name"] = SiteName.SITE_NAME
         return context
     
-class PasswordResetEmail(BaseEmailMessage):
+class PasswordResetEmail(QueuedEmailMessage):
     template_name = "email/password_reset.html"
 
     def get_context_data(self):
@@ -36,7 +159,7 @@ class PasswordResetEmail(BaseEmailMessage):
         context["site_name"] = SiteName.SITE_NAME # Your site protocol e.g. ("http", "https")
         return context
     
-class PasswordChangedConfirmationEmail(BaseEmailMessage):
+class PasswordChangedConfirmationEmail(QueuedEmailMessage):
     template_name = "email/password_changed_confirmation.html"
 
     def get_context_data(self):
@@ -52,7 +175,7 @@ class PasswordChangedConfirmationEmail(BaseEmailMessage):
         context["site_name"] = SiteName.SITE_NAME # Your site protocol e.g. ("http", "https")
         return context
     
-class ConfirmationEmail(BaseEmailMessage):
+class ConfirmationEmail(QueuedEmailMessage):
     template_name = "email/confirmation.html"
 
     def get_context_data(self):
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class LocalBackend:
+    # Fan-out to subscribers in this process only; run a single ASGI worker or use RedisBackend
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            # Publishers are sync views on other threads
+            try:
+                loop.call_soon_threadsafe(self._put, queue, message)
+            except RuntimeError:
+                # The subscriber's event loop is gone
+                with self._lock:
+                    self._subscribers.discard((loop, queue))
+
+    @staticmethod
+    def _put(queue, message):
+        if queue.full():
+            # A slow consumer loses its oldest event rather than holding up everyone else
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def subscribe(self):
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=settings.ORDER_EVENTS_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.add(entry)
+        try:
+            while True:
+                yield await entry[1].get()
+        finally:
+            with self._lock:
+                self._subscribers.discard(entry)
+
+
+class RedisBackend:
+    # Shares events between workers through Redis pub/sub; needs the redis package
+    channel = 'eventeasy:orders'
+
+    def __init__(self):
+        import redis
+
+        self._client = redis.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL)
+
+    def publish(self, message):
+        self._client.publish(self.channel, json.dumps(message))
+
+    async def subscribe(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(self.channel)
+        try:
+            async for item in pubsub.listen():
+                if item['type'] == 'message':
+                    yield json.loads(item['data'])
+        finally:
+            await pubsub.unsubscribe(self.channel)
+            await client.aclose()
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.ORDER_EVENTS_BACKEND)()
+
+
+def publish_order_event(event, order_id, **data):
+    # Sent once the surrounding transaction commits, so listeners never see rolled back orders
+    message = {'event': event, 'id': order_id, **data}
+    transaction.on_commit(lambda: get_backend().publish(message))
+
+
+def order_created_event(order):
+    publish_order_event(
+        'order.created', order.id, status=order.status, event_type=order.event_type,
+        location=order.location, date=order.date.isoformat(), total_price=str(order.total_price),
+    )
@@ -0,0 +1,36 @@
+from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
+
+from .models import Service, Order
+
+
+class ServiceFilter(filters.FilterSet):
+    min_price = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = filters.NumberFilter(field_name='price', lookup_expr='lte')
+
+    class Meta:
+        model = Service
+        fields = ('category', 'min_price', 'max_price')
+
+
+class OrderFilter(filters.FilterSet):
+    # On PostgreSQL iexact compiles to UPPER(location) = UPPER(%s), which the order_location_upper_idx
+    # expression index covers; SQLite and MySQL compare with LIKE or a case-insensitive collation instead
+    location = filters.CharFilter(lookup_expr='iexact')
+    date = filters.DateFromToRangeFilter()
+    min_total = filters.NumberFilter(field_name='total_price', lookup_expr='gte')
+    max_total = filters.NumberFilter(field_name='total_price', lookup_expr='lte')
+
+    class Meta:
+        model = Order
+        fields = ('location', 'date', 'event_type', 'status', 'min_total', 'max_total')
+
+
+class TiebreakOrderingFilter(OrderingFilter):
+    # ?ordering= on price, total_price, date... has ties; id makes the order total, which the cursor
+    # paginators need so a row is never repeated or skipped between pages
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering = [*ordering, '-id' if ordering[0].startswith('-') else 'id']
+        return ordering
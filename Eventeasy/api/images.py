@@ -0,0 +1,90 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .cache import bump_catalog_generation
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='service-images')
+
+
+def render_variant(image, width, fmt):
+    variant = image.copy()
+    # thumbnail() keeps the aspect ratio and never upscales; `width` bounds the longest edge,
+    # as SERVICE_IMAGE_SIZES says, so tall images are no taller than wide ones are wide
+    variant.thumbnail((width, width), Image.LANCZOS)
+    buffer = BytesIO()
+    variant.save(buffer, FORMATS[fmt], quality=settings.SERVICE_IMAGE_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def build_variants(source_name):
+    # Returns {'source': name, '<size>': {'webp': path, 'jpeg': path}} with content-hashed paths
+    with default_storage.open(source_name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert('RGB')
+
+    variants = {'source': source_name}
+    for size, width in settings.SERVICE_IMAGE_SIZES.items():
+        variants[size] = {}
+        for fmt in FORMATS:
+            data = render_variant(image, width, fmt)
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            name = f'service_images/variants/{digest}-{width}.{fmt}'
+            # Same content, same name: existing files never change and can be cached forever
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(data))
+            variants[size][fmt] = name
+    return variants
+
+
+def process_service_image(service_id):
+    from .models import Service
+
+    service = Service.objects.filter(pk=service_id).only('image').first()
+    if service is None or not service.image:
+        return None
+    variants = build_variants(service.image.name)
+    # Guarded on the image name so a newer upload is never overwritten with stale variants
+    if Service.objects.filter(pk=service_id, image=service.image.name).update(image_variants=variants):
+        transaction.on_commit(bump_catalog_generation)
+    return variants
+
+
+def _process_in_background(service_id):
+    # Nobody waits on the executor's future, so an error would otherwise vanish with it
+    try:
+        process_service_image(service_id)
+    except Exception:
+        logger.exception("Building image variants for service %s failed", service_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_service_image(service_id):
+    if settings.SERVICE_IMAGE_ASYNC:
+        _executor.submit(_process_in_background, service_id)
+    else:
+        process_service_image(service_id)
+
+
+def variant_urls(service, request=None):
+    urls = {}
+    for size, formats in (service.image_variants or {}).items():
+        if size == 'source':
+            continue
+        urls[size] = {
+            fmt: request.build_absolute_uri(default_storage.url(name)) if request else default_storage.url(name)
+            for fmt, name in formats.items()
+        }
+    return urls
@@ -0,0 +1,110 @@
+import json
+import logging
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from api.authentication import user_cache
+from api.benchmarks import ApiBenchmark, compare, seed_fixtures
+
+SEED_OPTIONS = ('clients', 'providers', 'categories', 'services', 'orders', 'items', 'seed')
+# Runs are only comparable when all of these match
+FIXTURE_OPTIONS = SEED_OPTIONS + ('requests', 'warmup')
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a fixed data set, time registration, login, catalog, order create, claim and my_gigs through "
+        "the URLconf, and fail when a run is slower or makes more queries than a saved baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--providers', type=int, default=100)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--services', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--items', type=int, default=3, help="Average items per order")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=50, help="Measured requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=5, help="Unmeasured requests per endpoint")
+        parser.add_argument('--save', help="Write the results as JSON to this file")
+        parser.add_argument('--baseline', help="Results file of an earlier run to compare against")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25, help="Allowed p50/p95 slowdown against the baseline (0.25 = 25%%)"
+        )
+
+    def handle(self, *args, **options):
+        if any(alias.startswith('replica_') for alias in settings.DATABASES):
+            raise CommandError("The seeded rows are never committed, so replicas would not see them; unset DB_REPLICAS")
+        if options['requests'] < 2:
+            raise CommandError("--requests must be at least 2")
+        fixture_options = {name: options[name] for name in FIXTURE_OPTIONS}
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if baseline['options'] != fixture_options:
+                raise CommandError(f"Baseline was recorded with different options: {baseline['options']}")
+
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        # A private cache keeps benchmark responses and counters out of the shared one, one client
+        # per role would otherwise run into the throttles, and activation emails stay in memory
+        isolated = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+            THROTTLE_ENABLED=False,
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        )
+        with isolated, transaction.atomic():
+            started = time.perf_counter()
+            fixtures = seed_fixtures(**{name: options[name] for name in SEED_OPTIONS})
+            self.stdout.write(f"Seeded fixtures in {time.perf_counter() - started:.1f}s")
+            try:
+                endpoints = ApiBenchmark(fixtures, options['requests'], options['warmup']).run()
+            except AssertionError as e:
+                raise CommandError(str(e))
+            finally:
+                # Everything the run wrote is rolled back, including the users this process cached
+                transaction.set_rollback(True)
+                user_cache.clear()
+
+        results = {
+            'commit': self.commit(), 'database': connection.vendor,
+            'options': fixture_options, 'endpoints': endpoints,
+        }
+        self.report(endpoints, baseline)
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['save']}")
+        if baseline:
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError(
+                    f"Regressions against {baseline.get('commit') or options['baseline']}:\n" + "\n".join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def report(self, endpoints, baseline):
+        self.stdout.write(f"{'endpoint':<14}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'req/s':>9}{'queries':>9}")
+        for name, stats in endpoints.items():
+            line = (
+                f"{name:<14}{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['p99']:>9.2f}"
+                f"{stats['max']:>9.2f}{stats['throughput']:>9.1f}{stats['queries']:>9}"
+            )
+            before = baseline and baseline['endpoints'].get(name)
+            if before:
+                line += f"  (p50 {stats['p50'] / before['p50'] - 1:+.0%})"
+            self.stdout.write(line)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,66 @@
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Category, Order, OrderItem, Service, UserAccount
+from api.serializers import OrderReadSerializer, OrderSerializer, ServiceReadSerializer, ServiceSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare serialization throughput of the read serializers against the model serializers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=1000)
+        parser.add_argument('--items', type=int, default=3, help="Items per order")
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Fixtures live in a transaction that is rolled back at the end
+        with transaction.atomic():
+            services, orders = self.make_fixtures(options['objects'], options['items'])
+            pairs = [
+                ('services', services, ServiceSerializer, ServiceReadSerializer),
+                ('orders', orders, OrderSerializer, OrderReadSerializer),
+            ]
+            for name, objects, model_serializer, read_serializer in pairs:
+                slow = self.throughput(model_serializer, objects, options['rounds'])
+                fast = self.throughput(read_serializer, objects, options['rounds'])
+                self.stdout.write(
+                    f"{name}: {model_serializer.__name__} {slow:,.0f}/s, "
+                    f"{read_serializer.__name__} {fast:,.0f}/s ({fast / slow:.1f}x)"
+                )
+            transaction.set_rollback(True)
+
+    def make_fixtures(self, count, items):
+        user = UserAccount.objects.create_user(email='benchmark@example.com', first_name='Bench', last_name='Mark')
+        category = Category.objects.create(name='Benchmark')
+        Service.objects.bulk_create([
+            Service(name=f'Service {i}', description='desc', price=Decimal('100.00'), category=category)
+            for i in range(count)
+        ])
+        services = list(Service.objects.filter(category=category))
+        orders = Order.objects.bulk_create([
+            Order(user=user, telephone='0700000000', location='Nairobi', date=date.today())
+            for _ in range(count)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, service=services[(i + j) % count], quantity=1, price=Decimal('100.00'))
+            for i, order in enumerate(orders)
+            for j in range(items)
+        ])
+        created = Order.objects.filter(user=user)
+        created.refresh_totals()
+        # Query time is the same for both serializers; only rendering is timed
+        return services, list(created.with_related())
+
+    def throughput(self, serializer_class, objects, rounds):
+        best = None
+        for _ in range(rounds):
+            started = time.perf_counter()
+            serializer_class(objects, many=True).data
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return len(objects) / best
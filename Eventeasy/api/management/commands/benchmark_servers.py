@@ -0,0 +1,137 @@
+import importlib.util
+import os
+import statistics
+import subprocess
+from contextlib import contextmanager
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import Category, Order, OrderItem, Service, UserAccount
+
+SERVERS = {
+    # Sync DRF views behind gunicorn sync workers: one request per worker at a time
+    'wsgi': {
+        'module': 'gunicorn',
+        'command': ['-m', 'gunicorn', 'backend.wsgi:application', '--workers', '{workers}', '--bind', '127.0.0.1:{port}', '--log-level', 'warning'],
+        'paths': {'catalog': '/services/', 'order': '/orders/{order}/', 'gigs': '/orders/my_gigs/'},
+    },
+    # Async views behind uvicorn: requests share the event loop while they wait on I/O
+    'asgi': {
+        'module': 'uvicorn',
+        'command': ['-m', 'uvicorn', 'backend.asgi:application', '--workers', '{workers}', '--port', '{port}', '--log-level', 'warning'],
+        'paths': {'catalog': '/async/services/', 'order': '/async/orders/{order}/', 'gigs': '/async/orders/my_gigs/'},
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent throughput of the sync views under gunicorn (WSGI) and the async views under uvicorn (ASGI)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint")
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=2, help="Server processes, the same for both servers")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--servers', default='wsgi,asgi')
+
+    def handle(self, *args, **options):
+        servers = options['servers'].split(',')
+        for name in servers:
+            if name not in SERVERS:
+                raise CommandError(f"Unknown server {name!r}; choose from {', '.join(SERVERS)}")
+            if importlib.util.find_spec(SERVERS[name]['module']) is None:
+                raise CommandError(f"{SERVERS[name]['module']} is not installed")
+
+        tag = f"bench-{int(time.time() * 1000)}"
+        provider, order = self.make_fixtures(tag)
+        headers = {'Authorization': f"{settings.SIMPLE_JWT['AUTH_HEADER_TYPES'][0]} {AccessToken.for_user(provider)}"}
+        try:
+            for name in servers:
+                with self.server(name, options) as base_url:
+                    for endpoint, path in SERVERS[name]['paths'].items():
+                        url = base_url + path.format(order=order.id)
+                        self.report(name, endpoint, self.load(url, headers, options['requests'], options['concurrency']))
+        finally:
+            UserAccount.objects.filter(email__startswith=tag).delete()
+            Category.objects.filter(name=tag).delete()
+
+    def make_fixtures(self, tag):
+        client = UserAccount.objects.create_user(email=f"{tag}-client@example.com", first_name='Bench', last_name='Client')
+        provider = UserAccount.objects.create_user(
+            email=f"{tag}-provider@example.com", first_name='Bench', last_name='Provider', role='PROVIDER'
+        )
+        category = Category.objects.create(name=tag)
+        services = Service.objects.bulk_create([
+            Service(name=f'Service {i}', description='Bench service', price=100, category=category) for i in range(20)
+        ])
+        orders = Order.objects.bulk_create([
+            Order(user=client, provider=provider, status='PROCESSING', telephone='0700000000', location='Nairobi', date=date.today())
+            for _ in range(20)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, service=service, quantity=1, price=100) for order in orders for service in services[:3]
+        ])
+        Order.objects.filter(user=client).refresh_totals()
+        # Providers read unclaimed orders in detail and their claimed ones through my_gigs
+        unclaimed = Order.objects.create(user=client, telephone='0700000000', location='Nairobi', date=date.today())
+        return provider, unclaimed
+
+    @contextmanager
+    def server(self, name, options):
+        args = [part.format(workers=options['workers'], port=options['port']) for part in SERVERS[name]['command']]
+        # One token drives every request, so the per-user throttle would cut the run short
+        env = {**os.environ, 'THROTTLE_ENABLED': 'false'}
+        process = subprocess.Popen([sys.executable] + args, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{options['port']}"
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    # The first request also loads the app, which can take a few seconds
+                    requests.get(base_url + '/services/', timeout=10)
+                    break
+                except requests.RequestException:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise CommandError(f"{name} server did not start")
+                    time.sleep(0.2)
+            yield base_url
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    def load(self, url, headers, total, concurrency):
+        def worker(count):
+            session = requests.Session()
+            latencies, errors = [], 0
+            for _ in range(count):
+                started = time.perf_counter()
+                response = session.get(url, headers=headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code != 200
+            return latencies, errors
+
+        shares = [total // concurrency + (i < total % concurrency) for i in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(worker, [share for share in shares if share]))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency for chunk, _ in results for latency in chunk)
+        return {
+            'throughput': len(latencies) / elapsed,
+            'p50': statistics.median(latencies),
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'errors': sum(errors for _, errors in results),
+        }
+
+    def report(self, server, endpoint, result):
+        self.stdout.write(
+            f"{server:5} {endpoint:8} {result['throughput']:8.1f} req/s  "
+            f"p50={result['p50']:.1f}ms p99={result['p99']:.1f}ms errors={result['errors']}"
+        )
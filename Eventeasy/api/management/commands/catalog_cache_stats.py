@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import catalog_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show catalog cache generation and hit/miss counters (needs a shared cache backend)"
+
+    def handle(self, *args, **options):
+        stats = catalog_cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / lookups if lookups else 0
+        for name, value in stats.items():
+            self.stdout.write(f"{name}: {value}")
+        self.stdout.write(f"hit ratio: {ratio:.1%}")
@@ -0,0 +1,60 @@
+import re
+from types import SimpleNamespace
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import Order, UserAccount
+from api.views import OrderViewSet
+
+# A plan line that reads the whole table instead of an index
+FULL_SCAN = {
+    'sqlite': re.compile(r'\bSCAN (api_order|"api_order")\b(?! USING (COVERING )?INDEX)'),
+    'postgresql': re.compile(r'Seq Scan on api_order\b'),
+}
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the Order querysets behind the API and admin, failing on any full table scan"
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"No full scan pattern for the {connection.vendor} backend")
+
+        failures = []
+        for name, queryset in self.querysets():
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    # Small dev tables make the planner prefer seq scans; ask what it would do at scale
+                    with connection.cursor() as cursor:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+            if pattern.search(plan):
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: full scan\n{plan}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: ok\n{plan}"))
+
+        if failures:
+            raise CommandError(f"Full table scans in: {', '.join(failures)}")
+
+    def querysets(self):
+        # Unsaved users with a pk are enough to build the filters
+        client = UserAccount(pk=1, role='CLIENT')
+        provider = UserAccount(pk=1, role='PROVIDER')
+        ordering = OrderViewSet.pagination_class.ordering
+
+        yield 'orders (client)', self.view_queryset(client).order_by(*ordering)
+        yield 'orders (provider feed)', self.view_queryset(provider).order_by(*ordering)
+        yield 'orders (provider feed by event type)', (
+            self.view_queryset(provider).filter(event_type='Wedding').order_by(*ordering)
+        )
+        yield 'my_gigs', Order.objects.filter(provider=provider).order_by(*ordering)
+        yield 'orders by status', Order.objects.filter(status='PENDING').order_by('-created_at')
+        yield 'admin changelist', Order.objects.order_by(*admin.site._registry[Order].get_ordering(None))
+
+    def view_queryset(self, user):
+        view = OrderViewSet(request=SimpleNamespace(user=user), action='list', format_kwarg=None)
+        return view.get_queryset()
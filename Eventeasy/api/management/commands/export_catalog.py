@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.catalog_io import COLUMNS, FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = "Stream services or categories as CSV or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=COLUMNS)
+        parser.add_argument('--format', dest='file_format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help="File to write; default stdout")
+
+    def handle(self, *args, **options):
+        lines = export_rows(options['kind'], options['file_format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(lines)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from api.catalog_io import FORMATS
+from api.models import Order
+from api.order_export import export_orders
+
+
+class Command(BaseCommand):
+    help = "Stream orders and their items as CSV or JSONL for reconciliation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=parse_date, help="First creation day (YYYY-MM-DD)")
+        parser.add_argument('--end', type=parse_date, help="Last creation day, inclusive")
+        parser.add_argument('--status', choices=[choice for choice, _ in Order.ORDER_STATUS_CHOICES])
+        parser.add_argument('--format', dest='file_format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help="File to write; default stdout")
+
+    def handle(self, *args, **options):
+        lines = export_orders(
+            options['file_format'], start=options['start'], end=options['end'], status=options['status'],
+        )
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(lines)
@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_io import COLUMNS, FORMATS, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = "Upsert services or categories from a CSV or JSONL file, streamed in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=COLUMNS)
+        parser.add_argument('path', type=Path)
+        parser.add_argument('--format', dest='file_format', choices=FORMATS, help="Default: from the file extension")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or path.suffix.lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format")
+
+        with path.open('rb') as stream:
+            imported, errors = import_rows(options['kind'], read_rows(stream, file_format), options['chunk_size'])
+        for number, message in errors:
+            self.stderr.write(f"row {number}: {message}")
+        self.stdout.write(f"imported {imported} {options['kind']}, skipped {len(errors)}")
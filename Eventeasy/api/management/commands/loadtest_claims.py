@@ -0,0 +1,82 @@
+import logging
+import statistics
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+
+from api.models import Order, UserAccount
+
+
+class Command(BaseCommand):
+    help = "Fire N concurrent providers at one fresh order and check that exactly one claim wins"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--claimers', type=int, default=50)
+        parser.add_argument('--rounds', type=int, default=1)
+
+    def handle(self, *args, **options):
+        claimers = options['claimers']
+        tag = f"loadtest-{int(time.time() * 1000)}"
+        client_user = UserAccount.objects.create_user(
+            email=f"{tag}-client@example.com", first_name='Load', last_name='Test'
+        )
+        providers = [
+            UserAccount.objects.create_user(
+                email=f"{tag}-provider{i}@example.com", first_name='Load', last_name='Test', role='PROVIDER'
+            )
+            for i in range(claimers)
+        ]
+        latencies = []
+        # Losing claims are expected; keep django.request from logging each 400
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        try:
+            for _ in range(options['rounds']):
+                order = Order.objects.create(
+                    user=client_user, total_price=Decimal('0'), telephone='0700000000',
+                    location='Nairobi', date=date.today(),
+                )
+                codes, round_latencies = self.race(order, providers)
+                latencies.extend(round_latencies)
+                winners = codes.count(200)
+                if winners != 1:
+                    raise CommandError(f"Order {order.id}: {winners} winners, status codes {sorted(codes)}")
+                order.refresh_from_db()
+                if order.provider_id is None:
+                    raise CommandError(f"Order {order.id} reported a winner but is unclaimed")
+        finally:
+            UserAccount.objects.filter(email__startswith=tag).delete()
+
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['rounds']} round(s) x {claimers} claimers: exactly one winner each. "
+            f"p50={statistics.median(latencies):.1f}ms p99={p99:.1f}ms max={latencies[-1]:.1f}ms"
+        ))
+
+    def race(self, order, providers):
+        barrier = threading.Barrier(len(providers))
+        codes = [None] * len(providers)
+        latencies = [None] * len(providers)
+
+        def claim(i, provider):
+            client = APIClient()
+            client.force_authenticate(provider)
+            try:
+                barrier.wait()
+                started = time.perf_counter()
+                codes[i] = client.post(f'/orders/{order.id}/claim_order/').status_code
+                latencies[i] = (time.perf_counter() - started) * 1000
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim, args=(i, p)) for i, p in enumerate(providers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return codes, latencies
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.mpesa import process_payment_callbacks
+
+
+class Command(BaseCommand):
+    help = "Match pending M-Pesa callbacks to orders in batches and mark the orders paid"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of draining once")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to sleep when nothing is pending")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = process_payment_callbacks(options['batch_size'])
+            if counts:
+                self.stdout.write(", ".join(f"{status.lower()} {count}" for status, count in sorted(counts.items())))
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
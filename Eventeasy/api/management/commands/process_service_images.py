@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.images import process_service_image
+from api.models import Service
+
+
+class Command(BaseCommand):
+    help = "Build missing or outdated Service.image variants (backfill, or after a crashed worker)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rebuild variants for every service with an image")
+
+    def handle(self, *args, **options):
+        services = Service.objects.exclude(image='').exclude(image__isnull=True).only('image', 'image_variants')
+        processed = 0
+        for service in services.iterator():
+            if options['all'] or service.image_variants.get('source') != service.image.name:
+                process_service_image(service.pk)
+                processed += 1
+        self.stdout.write(f"processed {processed} service image(s)")
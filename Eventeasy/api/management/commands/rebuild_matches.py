@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.matching import active_providers, match_providers
+from api.models import OrderMatch
+
+
+class Command(BaseCommand):
+    help = "Rebuild every provider's ranked order candidates, e.g. nightly so urgency scores follow the calendar"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100, help="Providers rebuilt per transaction")
+
+    def handle(self, *args, **options):
+        # Providers who are no longer active or located keep no candidates
+        OrderMatch.objects.exclude(provider__in=active_providers()).delete()
+        provider_ids = list(active_providers().order_by('id').values_list('id', flat=True))
+        chunk = options['chunk_size']
+        for start in range(0, len(provider_ids), chunk):
+            match_providers(provider_ids[start:start + chunk])
+        self.stdout.write(f"rebuilt candidates for {len(provider_ids)} provider(s), {OrderMatch.objects.count()} match(es)")
@@ -0,0 +1,34 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api.models import Order, OrderDailyStat
+
+
+class Command(BaseCommand):
+    help = "Rebuild the OrderDailyStat rollup from orders, e.g. after raw SQL edits or a restore"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=parse_date, help="First day to rebuild (YYYY-MM-DD); default all")
+        parser.add_argument('--chunk-days', type=int, default=31)
+
+    def handle(self, *args, **options):
+        # No upfront delete: rebuild() replaces each chunk's days atomically, so analytics keep
+        # serving the old rows of a day until its new ones are committed
+        orders = Order.objects.order_by()
+        stats = OrderDailyStat.objects.order_by()
+        if options['since']:
+            # A range on created_at, so its index is used
+            orders = orders.filter(created_at__gte=timezone.make_aware(datetime.combine(options['since'], time.min)))
+            stats = stats.filter(day__gte=options['since'])
+        days = sorted(orders.values_list(TruncDate('created_at'), flat=True).distinct())
+        # Days that lost all their orders still have rows; rebuilding them clears them, under the
+        # same lock as the rest, and counts any order created there in the meantime
+        days += sorted(set(stats.values_list('day', flat=True).distinct()) - set(days))
+        chunk = options['chunk_days']
+        for start in range(0, len(days), chunk):
+            OrderDailyStat.rebuild(days[start:start + chunk])
+        self.stdout.write(f"rebuilt {len(days)} day(s)")
@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.emails import asend_queued_emails, send_queued_emails
+
+
+class Command(BaseCommand):
+    help = "Deliver queued djoser emails in batches over one SMTP connection per batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of draining once")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument(
+            '--connections', type=int, default=1,
+            help="SMTP connections to spread each batch over; more than one sends them concurrently",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            if options['connections'] > 1:
+                sent, failed = asyncio.run(asend_queued_emails(options['batch_size'], options['connections']))
+            else:
+                sent, failed = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"sent {sent}, failed {failed}")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,88 @@
+import logging
+import secrets
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.models import Order, PaymentCallback, UserAccount
+from api.mpesa import c2b_confirmation_payload, process_payment_callbacks, random_receipt, stk_callback_payload
+
+
+class Command(BaseCommand):
+    help = "Replay a burst of stubbed M-Pesa callbacks (with retries) against the callback endpoint and reconcile them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--duplicates', type=int, default=3, help="Times Safaricom delivers each callback")
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        tag = f"mpesa-{int(time.time() * 1000)}"
+        user = UserAccount.objects.create_user(email=f"{tag}@example.com", first_name='Mpesa', last_name='Stub')
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        try:
+            orders = Order.objects.bulk_create([
+                Order(user=user, total_price=Decimal('1500'), telephone='0700000000', location='Nairobi', date=date.today())
+                for _ in range(options['orders'])
+            ])
+            client = APIClient()
+            # The stubbed callbacks come from the test client, not from Safaricom's addresses, and
+            # the STK pushes go to the stub backend instead of Daraja, unthrottled since they come in one burst
+            token = settings.MPESA_CALLBACK_TOKEN or secrets.token_urlsafe()
+            url = f"{reverse('mpesa-callback')}?token={token}"
+            stubbed = override_settings(
+                MPESA_CALLBACK_TOKEN=token, MPESA_ALLOWED_IPS=[], MPESA_STK_BACKEND='api.mpesa.StubBackend',
+                THROTTLE_ENABLED=False,
+            )
+            payloads = []
+            client.force_authenticate(user)
+            with stubbed:
+                for i, order in enumerate(orders):
+                    receipt = random_receipt()
+                    if i % 2:
+                        payloads.append((receipt, c2b_confirmation_payload(receipt, order.total_price, account_reference=order.id)))
+                        continue
+                    # STK results carry no account reference: the push stores the CheckoutRequestID they do carry
+                    response = client.post(reverse('order-pay', args=[order.pk]))
+                    if response.status_code != 200:
+                        raise CommandError(f"STK push for order {order.pk} failed: {response.status_code} {response.content!r}")
+                    checkout_request_id = response.data['checkout_request_id']
+                    payloads.append((receipt, stk_callback_payload(receipt, order.total_price, checkout_request_id=checkout_request_id)))
+            client.force_authenticate(None)
+
+            started = time.perf_counter()
+            with stubbed:
+                for _ in range(options['duplicates']):
+                    for receipt, payload in payloads:
+                        response = client.post(url, payload, format='json')
+                        if response.status_code != 200:
+                            raise CommandError(f"Callback {receipt} rejected: {response.status_code} {response.content!r}")
+            ingest = time.perf_counter() - started
+
+            started = time.perf_counter()
+            while process_payment_callbacks(options['batch_size']):
+                pass
+            reconcile = time.perf_counter() - started
+
+            receipts = [receipt for receipt, _ in payloads]
+            stored = PaymentCallback.objects.filter(mpesa_code__in=receipts).count()
+            if stored != len(payloads):
+                raise CommandError(f"{stored} callbacks stored for {len(payloads)} payments")
+            unpaid = Order.objects.filter(user=user, paid=False).count()
+            if unpaid:
+                raise CommandError(f"{unpaid} orders left unpaid")
+        finally:
+            PaymentCallback.objects.filter(order__user=user).delete()
+            user.delete()
+
+        sent = len(payloads) * options['duplicates']
+        self.stdout.write(self.style.SUCCESS(
+            f"{sent} callbacks ({len(payloads)} unique) ingested in {ingest:.2f}s ({sent / ingest:.0f}/s), "
+            f"reconciled in {reconcile:.2f}s; every order paid exactly once"
+        ))
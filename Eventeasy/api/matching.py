@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderCategorySubtotal, OrderMatch, UserAccount
+from .regions import area
+
+# Weights of the three ranking signals; each signal is in [0, 1]
+PROXIMITY_WEIGHT = 0.5
+URGENCY_WEIGHT = 0.3
+AFFINITY_WEIGHT = 0.2
+
+
+def match_score(order_region, provider_region, days_until, order_categories, provider_categories):
+    proximity = 1.0 if order_region == provider_region else 0.5
+    # Events this week outrank ones months away
+    urgency = 1 / (1 + max(days_until, 0) / 7)
+    affinity = len(order_categories & provider_categories) / len(order_categories) if order_categories else 0.0
+    return round(PROXIMITY_WEIGHT * proximity + URGENCY_WEIGHT * urgency + AFFINITY_WEIGHT * affinity, 4)
+
+
+def categories_by(field, ids):
+    # {order or provider id: {category ids}} from the per-order category subtotals, in one query
+    result = {}
+    rows = OrderCategorySubtotal.objects.filter(**{f'{field}__in': ids}).values_list(field, 'category_id').distinct()
+    for key, category in rows:
+        result.setdefault(key, set()).add(category)
+    return result
+
+
+def open_orders():
+    return Order.objects.filter(provider__isnull=True, status='PENDING', date__gte=timezone.localdate()).exclude(region='')
+
+
+def active_providers():
+    return UserAccount.objects.filter(role='PROVIDER', is_active=True).exclude(region='')
+
+
+def build_matches(orders, providers):
+    # orders: [(id, region, date)], providers: [(id, region)]; pairs in each other's area only
+    today = timezone.localdate()
+    order_categories = categories_by('order_id', [order_id for order_id, _, _ in orders])
+    provider_categories = categories_by('order__provider_id', [provider_id for provider_id, _ in providers])
+    by_region = {}
+    for provider_id, region in providers:
+        by_region.setdefault(region, []).append(provider_id)
+
+    matches = []
+    for order_id, order_region, date in orders:
+        for region in area(order_region):
+            for provider_id in by_region.get(region, ()):
+                matches.append(OrderMatch(
+                    provider_id=provider_id, order_id=order_id,
+                    score=match_score(
+                        order_region, region, (date - today).days,
+                        order_categories.get(order_id, set()), provider_categories.get(provider_id, set()),
+                    ),
+                ))
+    return matches
+
+
+def match_orders(order_ids):
+    # Rebuilds the candidates of these orders, after they were created, edited, claimed or released
+    if not order_ids:
+        return
+    orders = list(open_orders().filter(pk__in=order_ids).values_list('id', 'region', 'date'))
+    regions = set().union(*(area(region) for _, region, _ in orders))
+    providers = list(active_providers().filter(region__in=regions).values_list('id', 'region')) if regions else []
+    with transaction.atomic():
+        OrderMatch.objects.filter(order_id__in=order_ids).delete()
+        OrderMatch.objects.bulk_create(build_matches(orders, providers), batch_size=1000)
+
+
+def match_providers(provider_ids):
+    # Rebuilds the candidates of these providers, after their location or role changed
+    providers = list(active_providers().filter(pk__in=provider_ids).values_list('id', 'region'))
+    regions = set().union(*(area(region) for _, region in providers))
+    orders = list(open_orders().filter(region__in=regions).values_list('id', 'region', 'date')) if regions else []
+    with transaction.atomic():
+        OrderMatch.objects.filter(provider_id__in=provider_ids).delete()
+        OrderMatch.objects.bulk_create(build_matches(orders, providers), batch_size=1000)
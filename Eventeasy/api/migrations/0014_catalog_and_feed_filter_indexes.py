@@ -0,0 +1,64 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:20
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+# SearchFilter's icontains compiles to UPPER(col::text) LIKE UPPER(%s) on PostgreSQL,
+# which pg_trgm GIN indexes on the same expression can answer
+TRIGRAM_INDEXES = {
+    'service_name_trgm_idx': 'name',
+    'service_description_trgm_idx': 'description',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON api_service USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_service_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('provider__isnull', True)), fields=['date'], name='order_unclaimed_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('provider__isnull', True)), fields=['event_type', '-created_at'], name='order_unclaimed_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('provider__isnull', True)), fields=['total_price'], name='order_unclaimed_total_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(django.db.models.functions.text.Upper('location'), name='order_location_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['category', 'price'], name='service_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['price'], name='service_price_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
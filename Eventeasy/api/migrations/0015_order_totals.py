@@ -0,0 +1,63 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, F, OuterRef, Subquery, Sum
+
+
+def backfill_totals(apps, schema_editor):
+    # Only orders with items: a client-entered total on an empty order is all there is to keep
+    Order = apps.get_model('api', 'Order')
+    OrderItem = apps.get_model('api', 'OrderItem')
+    OrderCategorySubtotal = apps.get_model('api', 'OrderCategorySubtotal')
+    money = models.DecimalField(max_digits=10, decimal_places=2)
+
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    orders = Order.objects.filter(Exists(items))
+    orders.update(
+        total_price=Subquery(items.annotate(total=Sum(F('price') * F('quantity'), output_field=money)).values('total')),
+        item_count=Subquery(items.annotate(count=Sum('quantity')).values('count')),
+    )
+    OrderCategorySubtotal.objects.bulk_create([
+        OrderCategorySubtotal(
+            order_id=row['order_id'], category_id=row['category_id'],
+            quantity=row['total_quantity'], subtotal=row['total'],
+        )
+        for row in OrderItem.objects.order_by()
+        .values('order_id', category_id=F('service__category_id'))
+        .annotate(total_quantity=Sum('quantity'), total=Sum(F('price') * F('quantity'), output_field=money))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_catalog_and_feed_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='OrderCategorySubtotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.category')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_subtotals', to='api.order')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('order', 'category'), name='order_category_subtotal_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
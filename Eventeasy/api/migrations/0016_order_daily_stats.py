@@ -0,0 +1,51 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:25
+
+import django.db.models.deletion
+from django.conf import settings
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_daily_stats(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    OrderDailyStat = apps.get_model('api', 'OrderDailyStat')
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    rows = (
+        Order.objects.order_by()
+        .values('status', 'event_type', 'provider_id', day=TruncDate('created_at'))
+        .annotate(
+            order_count=Count('id'),
+            revenue=Sum('total_price', output_field=money),
+            paid_revenue=Coalesce(Sum('total_price', filter=Q(paid=True), output_field=money), Value(Decimal('0'))),
+        )
+    )
+    OrderDailyStat.objects.bulk_create((OrderDailyStat(**row) for row in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('event_type', models.CharField(max_length=100)),
+                ('order_count', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('paid_revenue', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('provider', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='order_stat_day_idx'), models.Index(fields=['provider', 'day'], name='order_stat_provider_day_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_order_daily_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('STK', 'STK push'), ('C2B', 'C2B confirmation')], max_length=3)),
+                ('reference', models.CharField(max_length=100, unique=True)),
+                ('mpesa_code', models.CharField(blank=True, max_length=20)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('phone', models.CharField(blank=True, max_length=20)),
+                ('account_reference', models.CharField(blank=True, max_length=100)),
+                ('result_code', models.IntegerField(default=0)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('MATCHED', 'Matched'), ('UNMATCHED', 'Unmatched'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['mpesa_code'], name='order_mpesa_code_idx'),
+        ),
+        migrations.AddField(
+            model_name='paymentcallback',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_callbacks', to='api.order'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentcallback',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['received_at'], name='payment_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentcallback',
+            index=models.Index(fields=['mpesa_code'], name='payment_code_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from api.regions import region_key
+
+
+def backfill_regions(apps, schema_editor):
+    # Candidates themselves are built afterwards by `manage.py rebuild_matches`
+    for model_name in ('Order', 'UserAccount'):
+        model = apps.get_model('api', model_name)
+        rows = list(model.objects.only('id', 'location').iterator(chunk_size=2000))
+        for row in rows:
+            row.region = region_key(row.location)
+        model.objects.bulk_update(rows, ['region'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_payment_callbacks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='region',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='useraccount',
+            name='region',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('provider__isnull', True)), fields=['region', 'date'], name='order_unclaimed_region_idx'),
+        ),
+        migrations.AddField(
+            model_name='ordermatch',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='api.order'),
+        ),
+        migrations.AddField(
+            model_name='ordermatch',
+            name='provider',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_matches', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='ordermatch',
+            index=models.Index(fields=['provider', '-score', '-order'], name='match_provider_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ordermatch',
+            constraint=models.UniqueConstraint(fields=('provider', 'order'), name='unique_provider_order_match'),
+        ),
+        migrations.RunPython(backfill_regions, migrations.RunPython.noop),
+    ]
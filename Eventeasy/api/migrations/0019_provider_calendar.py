@@ -0,0 +1,65 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_bookings(apps, schema_editor):
+    # Claimed orders become bookings; earlier double bookings keep only their first order
+    Order = apps.get_model('api', 'Order')
+    CalendarEntry = apps.get_model('api', 'CalendarEntry')
+    seen = set()
+    entries = []
+    claimed = Order.objects.filter(provider__isnull=False, status__in=['PROCESSING', 'COMPLETED']).order_by('id')
+    for order_id, provider_id, day in claimed.values_list('id', 'provider_id', 'date').iterator(chunk_size=2000):
+        if (provider_id, day) not in seen:
+            seen.add((provider_id, day))
+            entries.append(CalendarEntry(provider_id=provider_id, order_id=order_id, kind='BOOKING', start=day, end=day))
+    CalendarEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+def create_exclusion_constraint(apps, schema_editor):
+    # Overlapping entries of one provider are rejected by the database itself. SQLite runs
+    # one writer at a time, so the check in OrderQuerySet.claim() is enough there.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        'ALTER TABLE api_calendarentry ADD CONSTRAINT calendar_entry_no_overlap '
+        'EXCLUDE USING gist (provider_id WITH =, daterange("start", "end", \'[]\') WITH &&)'
+    )
+
+
+def drop_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE api_calendarentry DROP CONSTRAINT IF EXISTS calendar_entry_no_overlap')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_order_matching'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('BOOKING', 'Booking'), ('BLACKOUT', 'Blackout')], default='BLACKOUT', max_length=10)),
+                ('start', models.DateField()),
+                ('end', models.DateField()),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='api.order')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['provider', 'start', 'end'], name='calendar_provider_start_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('end__gte', models.F('start'))), name='calendar_entry_end_after_start'), models.UniqueConstraint(fields=('order',), name='unique_order_booking')],
+            },
+        ),
+        migrations.RunPython(backfill_bookings, migrations.RunPython.noop),
+        migrations.RunPython(create_exclusion_constraint, drop_exclusion_constraint),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:32
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def rebuild_daily_stats(apps, schema_editor):
+    # Concurrent rebuilds may have left duplicate groups behind; start over from api_order
+    Order = apps.get_model('api', 'Order')
+    OrderDailyStat = apps.get_model('api', 'OrderDailyStat')
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    rows = (
+        Order.objects.order_by()
+        .values('status', 'event_type', 'provider_id', day=TruncDate('created_at'))
+        .annotate(
+            order_count=Count('id'),
+            revenue=Sum('total_price', output_field=money),
+            paid_revenue=Coalesce(Sum('total_price', filter=Q(paid=True), output_field=money), Value(Decimal('0'))),
+        )
+    )
+    OrderDailyStat.objects.all().delete()
+    OrderDailyStat.objects.bulk_create((OrderDailyStat(**row) for row in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_provider_calendar'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_daily_stats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderdailystat',
+            constraint=models.UniqueConstraint(condition=models.Q(('provider__isnull', False)), fields=('day', 'status', 'event_type', 'provider'), name='unique_order_stat_provider'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderdailystat',
+            constraint=models.UniqueConstraint(condition=models.Q(('provider__isnull', True)), fields=('day', 'status', 'event_type'), name='unique_order_stat_unassigned'),
+        ),
+    ]
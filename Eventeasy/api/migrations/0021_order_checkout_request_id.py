@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_order_stat_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('checkout_request_id', ''), _negated=True), fields=['checkout_request_id'], name='order_checkout_idx'),
+        ),
+    ]
@@ -1,7 +1,18 @@
-from django.db import models
+import threading
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, models, transaction
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.db.models import Exists, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, Upper
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.utils import timezone
+from .cache import bump_catalog_generation
+from .events import publish_order_event
+from .images import schedule_service_image
+from .regions import region_key
 
 class UserAccountManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -34,6 +45,8 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
         ('CLIENT', 'Client'),
         ('PROVIDER', 'Provider'),
     ], default='CLIENT')
+    # County key derived from location (api.regions); providers are matched to orders by it
+    region = models.CharField(max_length=50, blank=True, editable=False)
 
     objects = UserAccountManager()
 
@@ -45,6 +58,10 @@ class UserAccount(AbstractBaseUser, PermissionsMixin):
 
     def get_short_name(self):
         return self.first_name
+
+    def save(self, *args, **kwargs):
+        self.region = region_key(self.location)
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return self.email
@@ -62,7 +79,14 @@ class Service(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='services')
     image = models.ImageField(upload_to='service_images/', blank=True, null=True)
-    
+    # Resized copies of image, filled in by api.images after upload
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'price'], name='service_category_price_idx'),
+            models.Index(fields=['price'], name='service_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -133,6 +157,98 @@ class Service(models.Model):
 #     def __str__(self):
 #         return self.name
 
+class OrderQuerySet(models.QuerySet):
+    def with_related(self):
+        # Everything OrderSerializer touches, loaded in a fixed number of queries
+        return self.select_related('user', 'provider').prefetch_related(
+            models.Prefetch('items', queryset=OrderItem.objects.select_related('service')),
+            'category_subtotals',
+        )
+
+    def visible_to(self, user):
+        if user.role == 'CLIENT':
+            return self.filter(user=user)
+        elif user.role == 'PROVIDER':
+            # Providers can see unclaimed orders and their own claimed orders
+            return self.filter(
+                models.Q(provider__isnull=True)
+                # |  # Unclaimed orders
+                # Q(provider=user)  # Orders claimed by this provider
+            )
+        return self.none()
+
+    def refresh_totals(self):
+        # total_price and item_count for every order in one UPDATE with correlated subqueries
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        money = models.DecimalField(max_digits=10, decimal_places=2)
+        order_ids = self.values('pk')
+        # One transaction, so readers never see the totals without their subtotals or an order with none
+        with transaction.atomic():
+            self.update(
+                total_price=Coalesce(
+                    Subquery(items.annotate(total=Sum(F('price') * F('quantity'), output_field=money)).values('total')),
+                    Value(Decimal('0')), output_field=money,
+                ),
+                item_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), Value(0)),
+                updated_at=timezone.now(),
+            )
+            # Per-category subtotals are rebuilt from one GROUP BY over the same items
+            OrderCategorySubtotal.objects.filter(order__in=order_ids).delete()
+            OrderCategorySubtotal.objects.bulk_create([
+                OrderCategorySubtotal(
+                    order_id=row['order_id'], category_id=row['category_id'],
+                    quantity=row['total_quantity'], subtotal=row['total'],
+                )
+                for row in OrderItem.objects.filter(order__in=order_ids).order_by()
+                .values('order_id', category_id=F('service__category_id'))
+                .annotate(total_quantity=Sum('quantity'), total=Sum(F('price') * F('quantity'), output_field=money))
+            ])
+        self.refresh_daily_stats()
+        self.refresh_matches()
+
+    def refresh_daily_stats(self):
+        OrderDailyStat.rebuild(self.order_by().values_list(TruncDate('created_at'), flat=True).distinct())
+
+    def refresh_matches(self):
+        # Imported here: api.matching builds on these models
+        from .matching import match_orders
+
+        match_orders(list(self.values_list('pk', flat=True)))
+
+    def claim(self, pk, provider):
+        # Single conditional UPDATE: of many racing providers exactly one gets a row back.
+        # The same statement refuses orders on a day the provider is already booked or blacked out.
+        try:
+            with transaction.atomic():
+                claimed = self.filter(pk=pk, provider__isnull=True, status='PENDING').exclude(
+                    Exists(CalendarEntry.objects.filter(provider=provider).covering(OuterRef('date')))
+                ).update(
+                    provider=provider, taken_by_provider=True, status='PROCESSING', updated_at=timezone.now()
+                ) == 1
+                if claimed:
+                    day = Order.objects.values_list('date', flat=True).get(pk=pk)
+                    CalendarEntry.objects.create(provider=provider, order_id=pk, kind='BOOKING', start=day, end=day)
+        except IntegrityError:
+            # A concurrent claim by the same provider booked that day first (exclusion constraint on PostgreSQL)
+            claimed = False
+        if claimed:
+            publish_order_event('order.claimed', int(pk), status='PROCESSING', provider=provider.pk)
+            transaction.on_commit(lambda: self.filter(pk=pk).refresh_daily_stats())
+            # Claimed orders drop out of every provider's candidates
+            OrderMatch.objects.filter(order_id=pk).delete()
+        return claimed
+
+    def release(self, pk, provider):
+        released = self.filter(pk=pk, provider=provider).update(
+            provider=None, taken_by_provider=False, status='PENDING', updated_at=timezone.now()
+        ) == 1
+        if released:
+            CalendarEntry.objects.filter(order_id=pk).delete()
+            publish_order_event('order.released', int(pk), status='PENDING')
+            transaction.on_commit(lambda: self.filter(pk=pk).refresh_daily_stats())
+            transaction.on_commit(lambda: self.filter(pk=pk).refresh_matches())
+        return released
+
 class Order(models.Model):
     ORDER_STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -143,17 +259,60 @@ class Order(models.Model):
     event_type = models.CharField(max_length=100, default="Others")
     user = models.ForeignKey(UserAccount, on_delete=models.CASCADE, related_name='orders')
     provider = models.ForeignKey(UserAccount, on_delete=models.SET_NULL, null=True, blank=True, related_name='claimed_orders')
-    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Sum of the items, maintained by OrderQuerySet.refresh_totals()
+    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
     paid = models.BooleanField(default=False)
     mpesa_code = models.CharField(max_length=10, blank=True)
+    # CheckoutRequestID of the latest STK push (api.mpesa.start_stk_push); its callback is matched on it
+    checkout_request_id = models.CharField(max_length=100, blank=True, editable=False)
     taken_by_provider = models.BooleanField(default=False)
     telephone = models.CharField(max_length=15)
     location = models.CharField(max_length=255)
+    # County key derived from location (api.regions)
+    region = models.CharField(max_length=50, blank=True, editable=False)
     date = models.DateField()
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # Each index matches a filter + the (-created_at, -id) cursor ordering of a hot path
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_unclaimed_idx', condition=models.Q(provider__isnull=True)),
+            models.Index(fields=['provider', '-created_at', '-id'], name='order_provider_created_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+            # Filters on the provider feed (api.filters.OrderFilter)
+            models.Index(fields=['date'], name='order_unclaimed_date_idx', condition=models.Q(provider__isnull=True)),
+            models.Index(fields=['event_type', '-created_at'], name='order_unclaimed_type_idx', condition=models.Q(provider__isnull=True)),
+            models.Index(fields=['total_price'], name='order_unclaimed_total_idx', condition=models.Q(provider__isnull=True)),
+            models.Index(Upper('location'), name='order_location_upper_idx'),
+            # Payment reconciliation (api.mpesa) looks orders up by receipt and by STK push
+            models.Index(fields=['mpesa_code'], name='order_mpesa_code_idx'),
+            models.Index(fields=['checkout_request_id'], name='order_checkout_idx', condition=~models.Q(checkout_request_id='')),
+            # Candidate generation (api.matching) reads the open orders of a few regions
+            models.Index(fields=['region', 'date'], name='order_unclaimed_region_idx', condition=models.Q(provider__isnull=True)),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.region = region_key(self.location)
+        super().save(*args, **kwargs)
+
+    def booking_conflicts(self, day):
+        # Whether the provider's calendar has something else on `day`, where this order's booking would move
+        if self.provider_id is None or self.status == 'CANCELLED':
+            return False
+        return CalendarEntry.objects.filter(provider_id=self.provider_id).exclude(order=self).covering(day).exists()
+
+    def clean(self):
+        # The admin's check; the API checks in OrderSerializer.validate
+        if self.pk and self.booking_conflicts(self.date):
+            raise ValidationError({'date': "The provider is not available on this day."})
+
     def __str__(self):
         return f"Order {self.id} - {self.user.email}"
 
@@ -165,3 +324,285 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} x {self.service.name} for Order {self.order.id}"
+
+    @property
+    def total_price(self):
+        return self.price * self.quantity
+
+
+class OrderCategorySubtotal(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='category_subtotals')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'category'], name='order_category_subtotal_unique'),
+        ]
+
+
+# First key of the per-day advisory locks taken by OrderDailyStat.rebuild
+STATS_LOCK = 1201
+
+
+class OrderDailyStat(models.Model):
+    # Orders rolled up per creation day, so analytics never scan api_order.
+    # Rebuilt a day at a time whenever an order from that day changes.
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    event_type = models.CharField(max_length=100)
+    provider = models.ForeignKey(UserAccount, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    order_count = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+    paid_revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            # One row per group; two partial constraints because NULL providers never collide otherwise
+            models.UniqueConstraint(
+                fields=['day', 'status', 'event_type', 'provider'], name='unique_order_stat_provider',
+                condition=models.Q(provider__isnull=False),
+            ),
+            models.UniqueConstraint(
+                fields=['day', 'status', 'event_type'], name='unique_order_stat_unassigned',
+                condition=models.Q(provider__isnull=True),
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='order_stat_day_idx'),
+            models.Index(fields=['provider', 'day'], name='order_stat_provider_day_idx'),
+        ]
+
+    @classmethod
+    def rebuild(cls, days):
+        days = sorted(set(days))
+        if not days:
+            return
+        # Range filters so the created_at index is used, one per day
+        created = models.Q()
+        for day in days:
+            start = timezone.make_aware(datetime.combine(day, time.min))
+            created |= models.Q(created_at__gte=start, created_at__lt=start + timedelta(days=1))
+        money = models.DecimalField(max_digits=14, decimal_places=2)
+        rows = (
+            Order.objects.filter(created).order_by()
+            .values('status', 'event_type', 'provider_id', day=TruncDate('created_at'))
+            .annotate(
+                order_count=models.Count('id'),
+                revenue=Sum('total_price', output_field=money),
+                paid_revenue=Coalesce(Sum('total_price', filter=models.Q(paid=True), output_field=money), Value(Decimal('0'))),
+            )
+        )
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Two rebuilds of one day would otherwise both delete and both insert; in day order, so
+                # overlapping rebuilds cannot deadlock. SQLite already runs one writer at a time.
+                with connection.cursor() as cursor:
+                    for day in days:
+                        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [STATS_LOCK, day.toordinal()])
+            cls.objects.filter(day__in=days).delete()
+            # `rows` is evaluated here, after the locks, so it sees every committed change
+            cls.objects.bulk_create(cls(**row) for row in rows)
+
+
+class OrderMatch(models.Model):
+    # Precomputed candidates: the open orders near each provider, ranked by api.matching
+    provider = models.ForeignKey(UserAccount, on_delete=models.CASCADE, related_name='order_matches')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='matches')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'order'], name='unique_provider_order_match'),
+        ]
+        indexes = [
+            # The ranked feed: one provider, best first (matches the MatchCursorPagination ordering)
+            models.Index(fields=['provider', '-score', '-order'], name='match_provider_score_idx'),
+        ]
+
+
+class CalendarEntryQuerySet(models.QuerySet):
+    def covering(self, day):
+        return self.filter(start__lte=day, end__gte=day)
+
+    def overlapping(self, start, end):
+        return self.filter(start__lte=end, end__gte=start)
+
+
+class CalendarEntry(models.Model):
+    # A provider's busy days: one BOOKING per claimed order, or a BLACKOUT range they set.
+    # Days are inclusive; entries of one provider never overlap (exclusion constraint on PostgreSQL).
+    KIND_CHOICES = [
+        ('BOOKING', 'Booking'),
+        ('BLACKOUT', 'Blackout'),
+    ]
+    provider = models.ForeignKey(UserAccount, on_delete=models.CASCADE, related_name='calendar_entries')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='BLACKOUT')
+    start = models.DateField()
+    end = models.DateField()
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='bookings')
+    note = models.CharField(max_length=255, blank=True)
+
+    objects = CalendarEntryQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(condition=models.Q(end__gte=F('start')), name='calendar_entry_end_after_start'),
+            models.UniqueConstraint(fields=['order'], name='unique_order_booking'),
+        ]
+        indexes = [
+            # Intervals sorted by start per provider: conflict checks and free/busy are range scans
+            models.Index(fields=['provider', 'start', 'end'], name='calendar_provider_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.kind.lower()} {self.start}..{self.end}"
+
+
+class PaymentCallback(models.Model):
+    # Append-only ledger of M-Pesa confirmations; api.mpesa matches them to orders in batches
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('MATCHED', 'Matched'),
+        ('UNMATCHED', 'Unmatched'),
+        ('FAILED', 'Failed'),
+    ]
+    SOURCE_CHOICES = [
+        ('STK', 'STK push'),
+        ('C2B', 'C2B confirmation'),
+    ]
+    source = models.CharField(max_length=3, choices=SOURCE_CHOICES)
+    # CheckoutRequestID (STK) or TransID (C2B): Safaricom retries reuse it, so it dedupes the ledger
+    reference = models.CharField(max_length=100, unique=True)
+    mpesa_code = models.CharField(max_length=20, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    phone = models.CharField(max_length=20, blank=True)
+    account_reference = models.CharField(max_length=100, blank=True)
+    result_code = models.IntegerField(default=0)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_callbacks')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['received_at'], name='payment_pending_idx', condition=models.Q(status='PENDING')),
+            models.Index(fields=['mpesa_code'], name='payment_code_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} {self.mpesa_code or self.reference} ({self.status})"
+
+
+class OutboundEmail(models.Model):
+    # Outbox for djoser emails; api.emails.send_queued_emails delivers them in batches
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    ]
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    html = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list)
+    bcc = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    # Also serves as the lease while a worker is sending, so a crashed worker's batch is retried
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='outbox_due_idx', condition=models.Q(status='PENDING')),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}"
+
+
+@receiver([post_save, post_delete], sender=Service)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    # After commit: a read between the bump and the commit would cache the old rows under the new generation
+    transaction.on_commit(bump_catalog_generation)
+
+
+@receiver(post_save, sender=Service)
+def build_service_image_variants(sender, instance, **kwargs):
+    # Only when the upload changed since the variants were last built
+    if instance.image and instance.image_variants.get('source') != instance.image.name:
+        transaction.on_commit(lambda: schedule_service_image(instance.pk))
+
+
+# Orders whose items changed in this thread's transaction, refreshed together on commit
+pending_totals = threading.local()
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def refresh_order_totals(sender, instance, **kwargs):
+    # After commit, so cascading deletes of the order itself are finished first. Every save
+    # registers a callback (one in a rolled-back savepoint is dropped), but the first to run
+    # refreshes all the pending orders at once and the rest find nothing left, so saving N items
+    # is one refresh instead of N. Ids left by a rolled-back transaction only cost a spare refresh.
+    if not hasattr(pending_totals, 'order_ids'):
+        pending_totals.order_ids = set()
+    pending_totals.order_ids.add(instance.order_id)
+    transaction.on_commit(flush_order_totals)
+
+
+def flush_order_totals():
+    order_ids, pending_totals.order_ids = pending_totals.order_ids, set()
+    if order_ids:
+        Order.objects.filter(pk__in=order_ids).refresh_totals()
+
+
+@receiver([post_save, post_delete], sender=Order)
+def refresh_order_daily_stats(sender, instance, **kwargs):
+    # Saves through the ORM (admin, serializer updates); bulk paths refresh explicitly
+    day = timezone.localtime(instance.created_at).date()
+    transaction.on_commit(lambda: OrderDailyStat.rebuild([day]))
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_matches(sender, instance, **kwargs):
+    transaction.on_commit(lambda: Order.objects.filter(pk=instance.pk).refresh_matches())
+
+
+@receiver(post_save, sender=Order)
+def sync_order_booking(sender, instance, created, **kwargs):
+    # Edits through the ORM: a cancelled or unassigned order frees the day, a moved one moves its booking.
+    # Moving it onto a blacked-out day raises IntegrityError on PostgreSQL; callers check
+    # Order.booking_conflicts first and turn the race into a 400 (OrderViewSet.perform_update)
+    if created:
+        return
+    bookings = CalendarEntry.objects.filter(order=instance)
+    if instance.provider_id is None or instance.status == 'CANCELLED':
+        bookings.delete()
+    else:
+        bookings.exclude(start=instance.date, end=instance.date).update(start=instance.date, end=instance.date)
+
+
+@receiver(post_save, sender=UserAccount)
+def refresh_provider_matches(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only; candidates depend on role, location and is_active
+    if update_fields and not {'role', 'location', 'is_active'} & set(update_fields):
+        return
+    from .matching import match_providers
+
+    transaction.on_commit(lambda: match_providers([instance.pk]))
+
+
+@receiver([post_save, post_delete], sender=UserAccount)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Imported here: api.authentication pulls in simplejwt, which needs the user model loaded
+    from .authentication import user_cache
+
+    user_cache.invalidate(instance.pk)
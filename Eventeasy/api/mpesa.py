@@ -0,0 +1,313 @@
+import hmac
+import random
+import string
+from base64 import b64encode
+from datetime import datetime
+from decimal import ROUND_CEILING, Decimal, InvalidOperation
+from ipaddress import ip_address, ip_network
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+
+from .models import Order, PaymentCallback
+
+# Receipts are copied onto Order.mpesa_code when matched, the narrower of the two columns
+RECEIPT_LENGTH = Order._meta.get_field('mpesa_code').max_length
+
+
+def parse_callback(payload):
+    # Flattens an STK push callback or a C2B confirmation into PaymentCallback fields
+    if not isinstance(payload, dict):
+        raise ValueError("Payload must be a JSON object")
+
+    body = payload.get('Body')
+    if body is not None:
+        stk = mapping(mapping(body, 'Body').get('stkCallback'), 'stkCallback')
+        if not stk.get('CheckoutRequestID'):
+            raise ValueError("CheckoutRequestID is missing")
+        metadata = mapping(stk.get('CallbackMetadata') or {}, 'CallbackMetadata')
+        entries = metadata.get('Item') or []
+        if not isinstance(entries, list) or not all(isinstance(item, dict) for item in entries):
+            raise ValueError("CallbackMetadata.Item must be a list of objects")
+        items = {item.get('Name'): item.get('Value') for item in entries}
+        return {
+            'source': 'STK',
+            'reference': text(stk['CheckoutRequestID'], 'CheckoutRequestID', 100),
+            'mpesa_code': text(items.get('MpesaReceiptNumber'), 'MpesaReceiptNumber', RECEIPT_LENGTH).upper(),
+            'amount': parse_amount(items.get('Amount')),
+            'phone': text(items.get('PhoneNumber'), 'PhoneNumber', 20),
+            'account_reference': text(items.get('AccountReference'), 'AccountReference', 100),
+            'result_code': parse_result_code(stk.get('ResultCode', 0)),
+        }
+
+    if payload.get('TransID'):
+        return {
+            'source': 'C2B',
+            'reference': text(payload['TransID'], 'TransID', 100),
+            'mpesa_code': text(payload['TransID'], 'TransID', RECEIPT_LENGTH).upper(),
+            'amount': parse_amount(payload.get('TransAmount')),
+            'phone': text(payload.get('MSISDN'), 'MSISDN', 20),
+            'account_reference': text(payload.get('BillRefNumber'), 'BillRefNumber', 100).strip(),
+            'result_code': 0,
+        }
+
+    raise ValueError("Not an STK callback or C2B confirmation")
+
+
+def mapping(value, name):
+    if not isinstance(value, dict):
+        raise ValueError(f"{name} must be a JSON object")
+    return value
+
+
+def text(value, name, max_length):
+    # Scalars only, and no longer than the PaymentCallback column they end up in
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list, bool)):
+        raise ValueError(f"{name} must be a string or a number")
+    value = str(value)
+    if len(value) > max_length:
+        raise ValueError(f"{name} is longer than {max_length} characters")
+    return value
+
+
+def parse_amount(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, (dict, list, bool)):
+        raise ValueError(f"Invalid amount {value!r}")
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount {value!r}")
+    # PaymentCallback.amount is max_digits=10, decimal_places=2
+    if not amount.is_finite() or amount < 0 or amount >= 10 ** 8 or amount != amount.quantize(Decimal('0.01')):
+        raise ValueError(f"Invalid amount {value!r}")
+    return amount
+
+
+def parse_result_code(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"Invalid ResultCode {value!r}")
+    code = int(value)
+    if abs(code) >= 2 ** 31:
+        raise ValueError(f"Invalid ResultCode {value!r}")
+    return code
+
+
+def callback_allowed(request):
+    """
+    Fails closed: a callback needs the shared token, a source address on the allowlist, or both
+    when both are configured; with neither configured every callback is refused.
+    """
+    token, networks = settings.MPESA_CALLBACK_TOKEN, settings.MPESA_ALLOWED_IPS
+    if not token and not networks:
+        return False
+    if token and not hmac.compare_digest(request.query_params.get('token', ''), token):
+        return False
+    if networks:
+        try:
+            address = ip_address(client_address(request))
+        except ValueError:
+            return False
+        return any(address in ip_network(network) for network in networks)
+    return True
+
+
+def client_address(request):
+    # X-Forwarded-For is only trusted for the NUM_PROXIES hops our own proxies added
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    num_proxies = api_settings.NUM_PROXIES
+    if forwarded and num_proxies:
+        hops = [hop.strip() for hop in forwarded.split(',')]
+        return hops[-min(num_proxies, len(hops))]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class StkPushError(Exception):
+    pass
+
+
+class DarajaBackend:
+    # Safaricom's Lipa na M-Pesa Online API: asks the customer's phone to approve the payment
+    timeout = 10
+
+    def stk_push(self, order, phone):
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        shortcode = settings.MPESA_SHORTCODE
+        password = b64encode(f'{shortcode}{settings.MPESA_PASSKEY}{timestamp}'.encode()).decode()
+        try:
+            token = requests.get(
+                f'{settings.MPESA_API_URL}/oauth/v1/generate', params={'grant_type': 'client_credentials'},
+                auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET), timeout=self.timeout,
+            )
+            token.raise_for_status()
+            response = requests.post(
+                f'{settings.MPESA_API_URL}/mpesa/stkpush/v1/processrequest',
+                headers={'Authorization': f"Bearer {token.json()['access_token']}"},
+                json={
+                    'BusinessShortCode': shortcode,
+                    'Password': password,
+                    'Timestamp': timestamp,
+                    'TransactionType': 'CustomerPayBillOnline',
+                    # Whole shillings only
+                    'Amount': int(order.total_price.to_integral_value(ROUND_CEILING)),
+                    'PartyA': phone,
+                    'PartyB': shortcode,
+                    'PhoneNumber': phone,
+                    'CallBackURL': settings.MPESA_CALLBACK_URL,
+                    'AccountReference': str(order.pk),
+                    'TransactionDesc': f'Order {order.pk}',
+                },
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise StkPushError(f"STK push failed: {e}")
+        if str(data.get('ResponseCode')) != '0' or not data.get('CheckoutRequestID'):
+            raise StkPushError(data.get('errorMessage') or data.get('ResponseDescription') or "STK push refused")
+        return data['CheckoutRequestID']
+
+
+class StubBackend:
+    # Accepts every push without calling Safaricom, for local runs and `manage.py simulate_mpesa`
+    def stk_push(self, order, phone):
+        return f'ws_CO_{random_receipt()}'
+
+
+def msisdn(phone):
+    # 07XXXXXXXX, +2547XXXXXXXX and 2547XXXXXXXX, as Daraja's 2547XXXXXXXX
+    digits = str(phone).strip().replace(' ', '').lstrip('+')
+    if digits.startswith('0'):
+        digits = '254' + digits[1:]
+    if not (digits.isdigit() and digits.startswith('254') and len(digits) == 12):
+        raise ValueError(f"Invalid phone number {phone!r}")
+    return digits
+
+
+def start_stk_push(order, phone=None):
+    """
+    Asks the customer to pay `order` on their phone and stores the CheckoutRequestID, which is
+    how process_payment_callbacks finds the order again: STK results carry no account reference.
+    """
+    phone = msisdn(phone or order.telephone)
+    checkout_request_id = import_string(settings.MPESA_STK_BACKEND)().stk_push(order, phone)
+    Order.objects.filter(pk=order.pk).update(checkout_request_id=checkout_request_id, updated_at=timezone.now())
+    order.checkout_request_id = checkout_request_id
+    return checkout_request_id
+
+
+def ingest_callback(payload):
+    # One INSERT ... ON CONFLICT DO NOTHING: retried callbacks are dropped by the unique reference
+    callback = PaymentCallback(payload=payload, **parse_callback(payload))
+    PaymentCallback.objects.bulk_create([callback], ignore_conflicts=True)
+    return callback
+
+
+def process_payment_callbacks(batch_size=None):
+    # Matches one batch of pending callbacks to orders; returns a count per resulting status
+    batch_size = batch_size or settings.MPESA_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        callbacks = list(
+            PaymentCallback.objects.select_for_update(skip_locked=True)
+            .filter(status='PENDING').order_by('received_at')[:batch_size]
+        )
+        if not callbacks:
+            return {}
+
+        # STK results are matched on the CheckoutRequestID stored by start_stk_push, C2B payments on
+        # the account number the customer typed (the order id), and either on a receipt already recorded
+        checkouts = {callback.reference for callback in callbacks if callback.source == 'STK'}
+        codes = {callback.mpesa_code for callback in callbacks if callback.mpesa_code}
+        order_ids = {int(callback.account_reference) for callback in callbacks if callback.account_reference.isdigit()}
+        orders = list(
+            Order.objects.filter(Q(checkout_request_id__in=checkouts) | Q(mpesa_code__in=codes) | Q(pk__in=order_ids))
+            .only('id', 'mpesa_code', 'checkout_request_id', 'paid', 'total_price')
+        )
+        by_id = {order.id: order for order in orders}
+        by_checkout = {order.checkout_request_id: order for order in orders if order.checkout_request_id}
+        by_code = {order.mpesa_code.upper(): order for order in orders if order.mpesa_code}
+
+        paid = {}
+        for callback in callbacks:
+            callback.processed_at = now
+            if callback.result_code != 0:
+                callback.status = 'FAILED'
+                continue
+            order = by_checkout.get(callback.reference) if callback.source == 'STK' else None
+            order = order or by_code.get(callback.mpesa_code)
+            if order is None and callback.account_reference.isdigit():
+                order = by_id.get(int(callback.account_reference))
+            if order is None or not payment_settles(callback, order) or order.id in paid:
+                callback.status = 'UNMATCHED'
+                continue
+            callback.status = 'MATCHED'
+            callback.order = order
+            if not order.paid:
+                order.paid = True
+                order.mpesa_code = callback.mpesa_code[:10]
+                order.updated_at = now
+                paid[order.id] = order
+
+        Order.objects.bulk_update(paid.values(), ['paid', 'mpesa_code', 'updated_at'])
+        PaymentCallback.objects.bulk_update(callbacks, ['status', 'order', 'processed_at'])
+        if paid:
+            Order.objects.filter(pk__in=paid).refresh_daily_stats()
+
+    counts = {}
+    for callback in callbacks:
+        counts[callback.status] = counts.get(callback.status, 0) + 1
+    return counts
+
+
+def payment_settles(callback, order):
+    if order.paid:
+        # A replay of the receipt that already paid this order is fine; a second payment is not
+        return order.mpesa_code.upper() == callback.mpesa_code
+    return callback.amount is None or callback.amount >= order.total_price
+
+
+def random_receipt():
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+
+def stk_callback_payload(receipt, amount, phone='254712345678', result_code=0, checkout_request_id=None):
+    # Same shape as Safaricom's STK push result, for the local stub and tests
+    callback = {
+        'MerchantRequestID': f'{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1',
+        'CheckoutRequestID': checkout_request_id or f'ws_CO_{random_receipt()}',
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.' if result_code == 0 else 'Request cancelled by user',
+    }
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': float(amount)},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+            {'Name': 'PhoneNumber', 'Value': int(phone)},
+        ]}
+    return {'Body': {'stkCallback': callback}}
+
+
+def c2b_confirmation_payload(receipt, amount, account_reference='', phone='254712345678'):
+    return {
+        'TransactionType': 'Pay Bill',
+        'TransID': receipt,
+        'TransTime': datetime.now().strftime('%Y%m%d%H%M%S'),
+        'TransAmount': f'{Decimal(amount):.2f}',
+        'BusinessShortCode': '600000',
+        'BillRefNumber': str(account_reference),
+        'InvoiceNumber': '',
+        'OrgAccountBalance': '',
+        'ThirdPartyTransID': '',
+        'MSISDN': phone,
+        'FirstName': 'John',
+    }
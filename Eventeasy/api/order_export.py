@@ -0,0 +1,51 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .catalog_io import Echo
+from .models import Order
+
+# One row per order item; orders without items get a single row with empty item columns
+COLUMNS = {
+    'order_id': 'id',
+    'created_at': 'created_at',
+    'event_date': 'date',
+    'status': 'status',
+    'event_type': 'event_type',
+    'client_email': 'user__email',
+    'provider_email': 'provider__email',
+    'paid': 'paid',
+    'mpesa_code': 'mpesa_code',
+    'order_total': 'total_price',
+    'item_id': 'items__id',
+    'service_id': 'items__service_id',
+    'service_name': 'items__service__name',
+    'quantity': 'items__quantity',
+    'unit_price': 'items__price',
+}
+
+
+def order_rows(start=None, end=None, status=None):
+    # Plain values() tuples through iterator(): a server-side cursor on PostgreSQL, no model instances
+    orders = Order.objects.all()
+    if start:
+        orders = orders.filter(created_at__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        orders = orders.filter(created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    if status:
+        orders = orders.filter(status=status)
+    return orders.order_by('created_at', 'id', 'items__id').values_list(*COLUMNS.values())
+
+
+def export_orders(file_format, chunk_size=2000, **filters):
+    rows = order_rows(**filters).iterator(chunk_size=chunk_size)
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(COLUMNS, row)), default=str) + '\n'
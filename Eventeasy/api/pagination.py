@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    # Keyset pagination over the primary key, so deep pages cost the same as the first
+    ordering = ('id',)
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class OrderCursorPagination(IdCursorPagination):
+    # Newest first; id breaks ties between orders created in the same instant
+    ordering = ('-created_at', '-id')
+
+
+class MatchCursorPagination(IdCursorPagination):
+    # Best candidates first over OrderMatch rows (match_provider_score_idx)
+    ordering = ('-score', '-order_id')
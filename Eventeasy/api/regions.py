@@ -0,0 +1,69 @@
+import re
+
+from django.utils.text import slugify
+
+# Neighbourhoods and towns customers and providers type, mapped to their county
+PLACES = {
+    'nairobi': 'nairobi', 'nairobi cbd': 'nairobi', 'cbd': 'nairobi', 'westlands': 'nairobi',
+    'kilimani': 'nairobi', 'kileleshwa': 'nairobi', 'lavington': 'nairobi', 'karen': 'nairobi',
+    'langata': 'nairobi', 'south b': 'nairobi', 'south c': 'nairobi', 'parklands': 'nairobi',
+    'upper hill': 'nairobi', 'kasarani': 'nairobi', 'roysambu': 'nairobi', 'embakasi': 'nairobi',
+    'donholm': 'nairobi', 'buruburu': 'nairobi', 'eastleigh': 'nairobi', 'runda': 'nairobi',
+    'gigiri': 'nairobi', 'muthaiga': 'nairobi', 'kiambu': 'kiambu', 'thika': 'kiambu',
+    'ruiru': 'kiambu', 'juja': 'kiambu', 'kikuyu': 'kiambu', 'limuru': 'kiambu', 'ruaka': 'kiambu',
+    'kiambu road': 'kiambu', 'machakos': 'machakos', 'athi river': 'machakos', 'mlolongo': 'machakos',
+    'syokimau': 'machakos', 'kajiado': 'kajiado', 'kitengela': 'kajiado', 'ngong': 'kajiado',
+    'rongai': 'kajiado', 'ongata rongai': 'kajiado', 'mombasa': 'mombasa', 'nyali': 'mombasa',
+    'bamburi': 'mombasa', 'likoni': 'mombasa', 'kilifi': 'kilifi', 'malindi': 'kilifi',
+    'watamu': 'kilifi', 'mtwapa': 'kilifi', 'kwale': 'kwale', 'diani': 'kwale', 'ukunda': 'kwale',
+    'nakuru': 'nakuru', 'naivasha': 'nakuru', 'kisumu': 'kisumu', 'eldoret': 'uasin-gishu',
+    'uasin gishu': 'uasin-gishu', 'nyeri': 'nyeri', 'nanyuki': 'laikipia', 'laikipia': 'laikipia',
+    'muranga': 'muranga', "murang'a": 'muranga', 'meru': 'meru', 'embu': 'embu',
+    'kakamega': 'kakamega', 'kisii': 'kisii', 'kericho': 'kericho', 'nyandarua': 'nyandarua',
+    'kirinyaga': 'kirinyaga', 'makueni': 'makueni', 'bungoma': 'bungoma', 'vihiga': 'vihiga',
+}
+
+BORDERS = [
+    ('nairobi', 'kiambu'), ('nairobi', 'machakos'), ('nairobi', 'kajiado'),
+    ('kiambu', 'muranga'), ('kiambu', 'machakos'), ('kiambu', 'nakuru'), ('kiambu', 'nyandarua'),
+    ('machakos', 'kajiado'), ('machakos', 'makueni'), ('machakos', 'embu'), ('kajiado', 'nakuru'),
+    ('kajiado', 'makueni'), ('mombasa', 'kilifi'), ('mombasa', 'kwale'), ('kilifi', 'kwale'),
+    ('nakuru', 'nyandarua'), ('nakuru', 'laikipia'), ('nakuru', 'kericho'), ('nyeri', 'laikipia'),
+    ('nyeri', 'muranga'), ('nyeri', 'kirinyaga'), ('nyeri', 'nyandarua'), ('muranga', 'kirinyaga'),
+    ('kirinyaga', 'embu'), ('embu', 'meru'), ('meru', 'laikipia'), ('kisumu', 'kericho'),
+    ('kisumu', 'vihiga'), ('kisumu', 'kakamega'), ('kakamega', 'vihiga'), ('kakamega', 'bungoma'),
+    ('kakamega', 'uasin-gishu'), ('kisii', 'kericho'),
+]
+
+NEIGHBOURS = {}
+for a, b in BORDERS:
+    NEIGHBOURS.setdefault(a, set()).add(b)
+    NEIGHBOURS.setdefault(b, set()).add(a)
+
+
+def normalize(text):
+    return re.sub(r'[^a-z0-9\' ]+', ' ', text.lower()).split()
+
+
+def region_key(location):
+    # "Westlands, Nairobi" -> "nairobi"; unknown places keep a slug of their most specific part
+    parts = [normalize(part) for part in (location or '').split(',')]
+    parts = [words for words in parts if words]
+    if not parts:
+        return ''
+    # Counties and towns usually come last, so read the parts from the end
+    for words in reversed(parts):
+        if ' '.join(words) in PLACES:
+            return PLACES[' '.join(words)]
+    for words in reversed(parts):
+        for size in (2, 1):
+            for i in range(len(words) - size + 1):
+                phrase = ' '.join(words[i:i + size])
+                if phrase in PLACES:
+                    return PLACES[phrase]
+    return slugify(' '.join(parts[0]))[:50]
+
+
+def area(region):
+    # The region itself and the regions bordering it
+    return {region} | NEIGHBOURS.get(region, set()) if region else set()
@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from django.contrib.auth import get_user_model
-from .models import Category, Service, Order, OrderItem
-from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from .models import Category, Service, Order, OrderItem, OrderCategorySubtotal, CalendarEntry
+from .images import variant_urls
+from .events import order_created_event
+from .regions import region_key
 
 User = get_user_model()
 
@@ -22,12 +25,7 @@ class UserCreateSerializer(UserCreateSerializer):
         fields = ('id', 'email', 'first_name', 'last_name', 'password', 
                  'telephone', 'location', 'role')
 
-    def perform_create(self, validated_data):
-        print("Performing create with data:", validated_data)  # Debug print
-        return super().perform_create(validated_data)
-
     def create(self, validated_data):
-        print("Create method called with data:", validated_data)  # Debug print
         user = User.objects.create_user(
             email=validated_data['email'],
             password=validated_data['password'],
@@ -53,11 +51,15 @@ class CategorySerializer(serializers.ModelSerializer):
 
 class ServiceSerializer(serializers.ModelSerializer):
     # category = CategorySerializer()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Service
         fields = '__all__'
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
+
         
 # class CartItemSerializer(serializers.ModelSerializer):
 #     service = ServiceSerializer()
@@ -74,42 +76,218 @@ class ServiceSerializer(serializers.ModelSerializer):
 #         fields = ('id', 'items', 'total_price')
         
 class OrderItemSerializer(serializers.ModelSerializer):
-    service = serializers.PrimaryKeyRelatedField(queryset=Service.objects.all())
+    # Resolved to Service instances in bulk by OrderSerializer, not one query per item
+    service = serializers.IntegerField(source='service_id', min_value=1)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
 
     class Meta:
         model = OrderItem
         fields = ('id', 'service', 'quantity', 'price', 'total_price')
+        # Copied from the service by resolve_services; a client-sent price would set the order total
+        read_only_fields = ('price',)
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation['service'] = ServiceSerializer(instance.service).data
         return representation
 
+
+def resolve_services(orders_data):
+    # Swap the service ids of every item in every order for Service rows fetched in one query
+    items = [item for order_data in orders_data for item in order_data['items']]
+    service_ids = {item['service_id'] for item in items}
+    services = Service.objects.in_bulk(service_ids)
+    missing = sorted(service_ids - services.keys())
+    if missing:
+        raise serializers.ValidationError({'items': f"Invalid service id(s): {missing}"})
+    for item in items:
+        item['service'] = services[item.pop('service_id')]
+        item['price'] = item['service'].price
+    return orders_data
+
+
+def create_orders(orders_data):
+    # Orders and all their items are written together or not at all
+    with transaction.atomic():
+        orders = []
+        for order_data in orders_data:
+            order_data = dict(order_data)
+            items_data = order_data.pop('items')
+            order = Order(**order_data)
+            # bulk_create skips Order.save(), which derives the region
+            order.region = region_key(order.location)
+            orders.append((order, items_data))
+        Order.objects.bulk_create([order for order, _ in orders])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, **item_data)
+            for order, items_data in orders
+            for item_data in items_data
+        ])
+        created = Order.objects.filter(pk__in=[order.pk for order, _ in orders])
+        created.refresh_totals()
+        created = list(created.with_related().order_by('id'))
+        for order in created:
+            order_created_event(order)
+    return created
+
+
+class OrderCategorySubtotalSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderCategorySubtotal
+        fields = ('category', 'quantity', 'subtotal')
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        return resolve_services(attrs)
+
+    def create(self, validated_data):
+        return create_orders(validated_data)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    # Always the requesting user, set by OrderViewSet.perform_create
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
     provider = UserSerializer(read_only=True)
+    category_subtotals = OrderCategorySubtotalSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
         fields = ('id', 'user', 'provider', 'items', 'event_type', 'paid', 
-                 'mpesa_code', 'taken_by_provider', 'total_price', 'telephone', 
-                 'location', 'date', 'status')
+                 'mpesa_code', 'taken_by_provider', 'total_price', 'item_count',
+                 'category_subtotals', 'telephone', 'location', 'date', 'status')
+        # Totals are computed from the items by OrderQuerySet.refresh_totals(); payment fields are set
+        # by api.mpesa.process_payment_callbacks and the claim fields by claim_order/release_order
+        read_only_fields = ('total_price', 'item_count', 'paid', 'mpesa_code', 'status', 'taken_by_provider')
+        list_serializer_class = OrderListSerializer
+
+    def validate(self, attrs):
+        # A batch is resolved once for all orders by OrderListSerializer
+        if 'items' in attrs and not isinstance(self.parent, serializers.ListSerializer):
+            resolve_services([attrs])
+        order = self.instance
+        if order is not None and 'date' in attrs and order.booking_conflicts(attrs['date']):
+            raise serializers.ValidationError({'date': "The provider is not available on this day."})
+        return attrs
 
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
+        return create_orders([validated_data])[0]
+
+
+def decimal_str(value):
+    # Same output as a DecimalField with decimal_places=2 and COERCE_DECIMAL_TO_STRING
+    return None if value is None else f'{value:.2f}'
 
-        for item_data in items_data:
-            try:
-                # The service field now contains just the ID
-                service_id = item_data['service'].id
-                item_data['price'] = Decimal(item_data['price'])
 
-                OrderItem.objects.create(order=order, service_id=service_id, **item_data)
+def image_url(image, request=None):
+    if not image:
+        return None
+    return request.build_absolute_uri(image.url) if request else image.url
+
+
+class ReadSerializer(serializers.BaseSerializer):
+    # Read-only serializer for list endpoints: one plain function per field instead of
+    # DRF's per-field machinery, with ?fields=a,b to return only some of them.
+    # Subclasses map field names to functions of (instance, request) in `readers`.
+    readers = {}
+
+    def requested_readers(self):
+        if not hasattr(self, '_requested'):
+            request = self.context.get('request')
+            # GET rather than query_params: the async views pass a plain HttpRequest
+            fields = request.GET.get('fields') if request else None
+            if not fields:
+                self._requested = list(self.readers.items())
+            else:
+                names = [name.strip() for name in fields.split(',') if name.strip()]
+                unknown = [name for name in names if name not in self.readers]
+                if unknown:
+                    raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(unknown)}"})
+                self._requested = [(name, self.readers[name]) for name in names]
+        return self._requested
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        return {name: read(instance, request) for name, read in self.requested_readers()}
+
+
+class ServiceReadSerializer(ReadSerializer):
+    readers = {
+        'id': lambda service, request: service.id,
+        'image_variants': variant_urls,
+        'name': lambda service, request: service.name,
+        'description': lambda service, request: service.description,
+        'price': lambda service, request: decimal_str(service.price),
+        'image': lambda service, request: image_url(service.image, request),
+        'category': lambda service, request: service.category_id,
+    }
+
+
+def user_data(user):
+    if user is None:
+        return None
+    return {
+        'id': user.id,
+        'email': user.email,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'telephone': user.telephone,
+        'location': user.location,
+        'role': user.role,
+    }
+
+
+def order_item_data(item):
+    return {
+        'id': item.id,
+        # Nested services are rendered without the request, like OrderItemSerializer does
+        'service': {name: read(item.service, None) for name, read in ServiceReadSerializer.readers.items()},
+        'quantity': item.quantity,
+        'price': decimal_str(item.price),
+        'total_price': decimal_str(item.total_price),
+    }
+
+
+class OrderReadSerializer(ReadSerializer):
+    # Expects Order.objects.with_related(), like OrderSerializer
+    readers = {
+        'id': lambda order, request: order.id,
+        'user': lambda order, request: order.user_id,
+        'provider': lambda order, request: user_data(order.provider),
+        'items': lambda order, request: [order_item_data(item) for item in order.items.all()],
+        'event_type': lambda order, request: order.event_type,
+        'paid': lambda order, request: order.paid,
+        'mpesa_code': lambda order, request: order.mpesa_code,
+        'taken_by_provider': lambda order, request: order.taken_by_provider,
+        'total_price': lambda order, request: decimal_str(order.total_price),
+        'item_count': lambda order, request: order.item_count,
+        'category_subtotals': lambda order, request: [
+            {'category': subtotal.category_id, 'quantity': subtotal.quantity, 'subtotal': decimal_str(subtotal.subtotal)}
+            for subtotal in order.category_subtotals.all()
+        ],
+        'telephone': lambda order, request: order.telephone,
+        'location': lambda order, request: order.location,
+        'date': lambda order, request: order.date.isoformat(),
+        'status': lambda order, request: order.status,
+    }
+
+
+class CalendarEntrySerializer(serializers.ModelSerializer):
+    # Providers write blackouts; bookings are created and removed by claiming and releasing orders
+    class Meta:
+        model = CalendarEntry
+        fields = ('id', 'kind', 'start', 'end', 'order', 'note')
+        read_only_fields = ('kind', 'order')
 
-            except InvalidOperation:
-                raise serializers.ValidationError("Invalid price format.")
-            
-        return order
+    def validate(self, attrs):
+        start = attrs.get('start', getattr(self.instance, 'start', None))
+        end = attrs.get('end', getattr(self.instance, 'end', None))
+        if end < start:
+            raise serializers.ValidationError({'end': "End must be on or after start."})
+        clashes = CalendarEntry.objects.filter(provider=self.context['request'].user).overlapping(start, end)
+        if self.instance is not None:
+            clashes = clashes.exclude(pk=self.instance.pk)
+        if clashes.exists():
+            raise serializers.ValidationError("This overlaps a booking or blackout already in your calendar.")
+        return attrs
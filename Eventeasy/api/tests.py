@@ -1,3 +1,1561 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import threading
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.http import StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, SimpleTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from asgiref.sync import sync_to_async
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import user_cache
+from .checks import check_mpesa_callback, check_mpesa_callback_deploy
+from .benchmarks import compare, seed_fixtures
+from .regions import region_key
+from .middleware import CompressionMiddleware, brotli
+from .views import serve_media
+from .emails import ActivationEmail, asend_queued_emails, send_queued_emails
+from .events import LocalBackend, get_backend
+from . import catalog_io
+from .cache import GENERATION_KEY, catalog_generation
+from .models import CalendarEntry, Category, Service, Order, OrderDailyStat, OrderItem, OrderMatch, OutboundEmail, PaymentCallback, UserAccount
+from .models import OrderQuerySet
+from .images import _process_in_background
+from .serializers import OrderReadSerializer, OrderSerializer, ServiceReadSerializer, ServiceSerializer
+from .mpesa import c2b_confirmation_payload, process_payment_callbacks, stk_callback_payload
+from .routers import ReplicaRouter, _read_from_replica
+from .throttling import CacheBucketStore, MemoryBucketStore, UserBucketThrottle
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        # A fresh throttle store per test; the shared cache is left alone
+        patcher = mock.patch('api.throttling.get_store', return_value=MemoryBucketStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Catering')
+        self.services = [
+            Service.objects.create(
+                name=f'Service {i}', description='desc', price=Decimal('100.00'), category=self.category
+            )
+            for i in range(3)
+        ]
+        self.customer = UserAccount.objects.create_user(
+            email='client@example.com', password='pass', first_name='C', last_name='Lient'
+        )
+        self.provider = UserAccount.objects.create_user(
+            email='provider@example.com', password='pass', first_name='P', last_name='Rovider', role='PROVIDER'
+        )
+
+    def make_orders(self, count, items_per_order=2, provider=None):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.customer, provider=provider, total_price=Decimal('200.00'),
+                telephone='0712345678', location='Nairobi', date=date(2025, 1, 1),
+            )
+            for service in self.services[:items_per_order]:
+                OrderItem.objects.create(order=order, service=service, quantity=1, price=service.price)
+            orders.append(order)
+        return orders
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+
+class OrderQueryCountTests(ApiTestCase):
+    def test_client_order_list_is_constant(self):
+        self.client.force_authenticate(self.customer)
+        self.make_orders(1)
+        baseline = self.count_queries('/orders/')
+        self.make_orders(10, items_per_order=3)
+        self.assertEqual(self.count_queries('/orders/'), baseline)
+
+    def test_provider_feed_is_constant(self):
+        self.client.force_authenticate(self.provider)
+        self.make_orders(1)
+        baseline = self.count_queries('/orders/')
+        self.make_orders(10, items_per_order=3)
+        self.assertEqual(self.count_queries('/orders/'), baseline)
+
+    def test_my_gigs_is_constant(self):
+        self.client.force_authenticate(self.provider)
+        self.make_orders(1, provider=self.provider)
+        baseline = self.count_queries('/orders/my_gigs/')
+        self.make_orders(10, items_per_order=3, provider=self.provider)
+        self.assertEqual(self.count_queries('/orders/my_gigs/'), baseline)
+
+    def test_retrieve_is_constant(self):
+        self.client.force_authenticate(self.customer)
+        small = self.make_orders(1, items_per_order=1)[0]
+        large = self.make_orders(1, items_per_order=3)[0]
+        self.assertEqual(
+            self.count_queries(f'/orders/{small.id}/'),
+            self.count_queries(f'/orders/{large.id}/'),
+        )
+
+
+class CursorPaginationTests(ApiTestCase):
+    def collect(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_orders_walk_newest_first_without_gaps(self):
+        self.client.force_authenticate(self.customer)
+        orders = self.make_orders(7, items_per_order=1)
+        seen = self.collect('/orders/?page_size=3')
+        self.assertEqual(seen, [order.id for order in reversed(orders)])
+
+    def test_services_walk_by_id(self):
+        for i in range(5):
+            Service.objects.create(name=f'Extra {i}', description='desc', price=Decimal('1.00'), category=self.category)
+        seen = self.collect('/services/?page_size=2')
+        self.assertEqual(seen, list(Service.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_page_size_is_capped(self):
+        response = self.client.get('/services/?page_size=100000')
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.data['results']), 100)
+
+
+class OrderCreateTests(ApiTestCase):
+    def payload(self, services):
+        return {
+            'event_type': 'Wedding', 'total_price': '300.00', 'telephone': '0712345678',
+            'location': 'Nairobi', 'date': '2025-01-01',
+            'items': [{'service': s.id, 'quantity': 2, 'price': str(s.price)} for s in services],
+        }
+
+    def test_create_single_order(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/orders/', self.payload(self.services), format='json')
+        self.assertEqual(response.status_code, 201)
+        # Computed from the items, not the 300.00 the client sent
+        self.assertEqual(response.data['total_price'], '600.00')
+        self.assertEqual(response.data['item_count'], 6)
+        self.assertEqual(
+            [dict(row) for row in response.data['category_subtotals']],
+            [{'category': self.category.id, 'quantity': 6, 'subtotal': '600.00'}],
+        )
+        self.assertEqual(response.data['user'], self.customer.id)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['items'][0]['service']['id'], self.services[0].id)
+
+    def test_payment_and_claim_fields_are_read_only(self):
+        self.client.force_authenticate(self.customer)
+        payload = {
+            **self.payload(self.services), 'paid': True, 'mpesa_code': 'QWE123RTY0',
+            'status': 'COMPLETED', 'taken_by_provider': True,
+        }
+        response = self.client.post('/orders/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual((order.paid, order.mpesa_code, order.status, order.taken_by_provider), (False, '', 'PENDING', False))
+        response = self.client.patch(f'/orders/{order.id}/', {'paid': True, 'status': 'COMPLETED'}, format='json')
+        order.refresh_from_db()
+        self.assertEqual((order.paid, order.status), (False, 'PENDING'))
+
+    def test_item_prices_come_from_the_services(self):
+        self.client.force_authenticate(self.customer)
+        payload = self.payload(self.services)
+        for item in payload['items']:
+            item['price'] = '0.01'
+        response = self.client.post('/orders/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_price'], '600.00')
+        self.assertEqual({item['price'] for item in response.data['items']}, {'100.00'})
+
+    def test_create_batch_uses_constant_queries(self):
+        self.client.force_authenticate(self.customer)
+        with CaptureQueriesContext(connection) as small:
+            self.client.post('/orders/', [self.payload(self.services[:1])], format='json')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post('/orders/', [self.payload(self.services)] * 20, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 20)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        self.assertEqual(Order.objects.count(), 21)
+        self.assertEqual(OrderItem.objects.count(), 61)
+
+    def test_unknown_service_rejects_whole_batch(self):
+        self.client.force_authenticate(self.customer)
+        bad = self.payload(self.services)
+        bad['items'][1]['service'] = 999999
+        response = self.client.post('/orders/', [self.payload(self.services), bad], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class ClaimReleaseTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_provider = UserAccount.objects.create_user(
+            email='other@example.com', password='pass', first_name='O', last_name='Ther', role='PROVIDER'
+        )
+        self.order = self.make_orders(1)[0]
+
+    def claim(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(f'/orders/{self.order.id}/claim_order/')
+
+    def release(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(f'/orders/{self.order.id}/release_order/')
+
+    def test_only_first_claim_wins(self):
+        self.assertEqual(self.claim(self.provider).status_code, 200)
+        self.assertEqual(self.claim(self.other_provider).status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.provider, self.provider)
+        self.assertEqual(self.order.status, 'PROCESSING')
+        self.assertTrue(self.order.taken_by_provider)
+
+    def test_clients_cannot_claim(self):
+        self.assertEqual(self.claim(self.customer).status_code, 403)
+
+    def test_non_pending_orders_cannot_be_claimed(self):
+        Order.objects.filter(pk=self.order.pk).update(status='CANCELLED')
+        self.assertEqual(self.claim(self.provider).status_code, 400)
+
+    def test_missing_order_is_404(self):
+        self.client.force_authenticate(self.provider)
+        self.assertEqual(self.client.post('/orders/999999/claim_order/').status_code, 404)
+
+    def test_release_by_owner_only(self):
+        self.claim(self.provider)
+        self.assertEqual(self.release(self.other_provider).status_code, 403)
+        response = self.release(self.provider)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['provider'])
+        self.assertEqual(response.data['status'], 'PENDING')
+        self.assertEqual(self.claim(self.other_provider).status_code, 200)
+
+
+class QueryPlanTests(TestCase):
+    def test_order_querysets_use_indexes(self):
+        call_command('check_query_plans', stdout=StringIO())
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_use_primary_without_replicas(self):
+        token = _read_from_replica.set(True)
+        self.addCleanup(_read_from_replica.reset, token)
+        self.assertIsNone(self.router.db_for_read(Service))
+
+    def test_safe_catalog_reads_use_replicas(self):
+        with mock.patch.dict(settings.DATABASES, {'replica_0': {}}):
+            self.assertIsNone(self.router.db_for_read(Service))
+            token = _read_from_replica.set(True)
+            self.addCleanup(_read_from_replica.reset, token)
+            self.assertEqual(self.router.db_for_read(Service), 'replica_0')
+            self.assertEqual(self.router.db_for_write(Service), 'default')
+
+
+class CatalogCacheTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_second_read_is_a_hit(self):
+        self.assertEqual(self.client.get('/services/')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/services/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_writes_invalidate(self):
+        self.client.get('/services/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.create(name='New', description='desc', price=Decimal('5.00'), category=self.category)
+        response = self.client.get('/services/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 4)
+
+        self.client.get(f'/categories/{self.category.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.category.pk).first().save()
+        self.assertEqual(self.client.get(f'/categories/{self.category.id}/')['X-Cache'], 'MISS')
+
+    def test_generation_is_bumped_after_commit(self):
+        generation = catalog_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.create(name='New', description='desc', price=Decimal('5.00'), category=self.category)
+            # A read before the commit caches the old rows under the old generation only
+            self.assertEqual(catalog_generation(), generation)
+        self.assertEqual(catalog_generation(), generation + 1)
+
+    def test_evicted_generation_does_not_serve_stale_entries(self):
+        self.client.get('/services/')
+        Service.objects.create(name='New', description='desc', price=Decimal('5.00'), category=self.category)
+        self.client.get('/services/')
+        # The generation key is evicted while both responses are still cached
+        cache.delete(GENERATION_KEY)
+        response = self.client.get('/services/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get('/categories/')['ETag']
+        response = self.client.get('/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Decor')
+        self.assertEqual(self.client.get('/categories/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class EmailQueueTests(ApiTestCase):
+    def queue_activation(self, count=1):
+        for _ in range(count):
+            ActivationEmail(context={'user': self.customer}).send([self.customer.email])
+
+    def test_send_only_queues(self):
+        self.queue_activation()
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual(queued.to, [self.customer.email])
+        self.assertIn('activate/', queued.body + queued.html)
+
+    def test_worker_sends_batch_once(self):
+        self.queue_activation(3)
+        self.assertEqual(send_queued_emails(), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(send_queued_emails(), (0, 0))
+        self.assertFalse(OutboundEmail.objects.exclude(status='SENT').exists())
+
+    async def test_async_worker_spreads_batch_over_connections(self):
+        await sync_to_async(self.queue_activation)(5)
+        self.assertEqual(await asend_queued_emails(connections=2), (5, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(await OutboundEmail.objects.filter(status='SENT').acount(), 5)
+
+    def test_failures_back_off_then_give_up(self):
+        self.queue_activation()
+        with mock.patch('django.core.mail.EmailMultiAlternatives.send', side_effect=OSError('smtp down')):
+            self.assertEqual(send_queued_emails(), (0, 1))
+            queued = OutboundEmail.objects.get()
+            self.assertEqual(queued.status, 'PENDING')
+            self.assertGreater(queued.next_attempt_at, queued.created_at)
+            # Not due yet
+            self.assertEqual(send_queued_emails(), (0, 0))
+            for _ in range(settings.EMAIL_QUEUE_MAX_ATTEMPTS - 1):
+                OutboundEmail.objects.update(next_attempt_at=queued.created_at)
+                send_queued_emails()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'FAILED')
+        self.assertIn('smtp down', queued.last_error)
+
+
+class ServiceImageTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root, SERVICE_IMAGE_ASYNC=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, size=(2000, 1000)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def test_upload_builds_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            service = Service.objects.create(
+                name='Photo', description='desc', price=Decimal('1.00'), category=self.category, image=self.upload()
+            )
+        service.refresh_from_db()
+        self.assertEqual(service.image_variants['source'], service.image.name)
+        for size, width in settings.SERVICE_IMAGE_SIZES.items():
+            for fmt in ('webp', 'jpeg'):
+                name = service.image_variants[size][fmt]
+                with Image.open(f'{settings.MEDIA_ROOT}/{name}') as variant:
+                    self.assertEqual(variant.width, width)
+
+        response = self.client.get(f'/services/{service.id}/')
+        self.assertTrue(response.data['image_variants']['thumbnail']['webp'].startswith('http://testserver/media/'))
+
+    def test_longest_edge_is_bounded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            service = Service.objects.create(
+                name='Tall', description='desc', price=Decimal('1.00'), category=self.category,
+                image=self.upload(size=(1000, 2000)),
+            )
+        service.refresh_from_db()
+        with Image.open(f"{settings.MEDIA_ROOT}/{service.image_variants['thumbnail']['jpeg']}") as variant:
+            self.assertEqual(variant.size, (160, 320))
+
+    def test_background_failures_are_logged(self):
+        with mock.patch('api.images.process_service_image', side_effect=OSError('disk full')), \
+                self.assertLogs('api.images', 'ERROR') as logs:
+            _process_in_background(42)
+        self.assertIn('service 42', logs.output[0])
+
+    def test_variant_names_are_content_hashed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Service.objects.create(
+                name='A', description='desc', price=Decimal('1.00'), category=self.category, image=self.upload()
+            )
+            second = Service.objects.create(
+                name='B', description='desc', price=Decimal('1.00'), category=self.category, image=self.upload()
+            )
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image_variants['large'], second.image_variants['large'])
+
+    def test_services_without_images_have_no_variants(self):
+        response = self.client.get(f'/services/{self.services[0].id}/')
+        self.assertEqual(response.data['image_variants'], {})
+
+
+class FilterTests(ApiTestCase):
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_service_filters_and_search(self):
+        other = Category.objects.create(name='Decor')
+        cheap = Service.objects.create(name='Balloons', description='Party balloons', price=Decimal('10.00'), category=other)
+        Service.objects.create(name='Flowers', description='Fresh', price=Decimal('500.00'), category=other)
+        self.assertEqual(len(self.ids(f'/services/?category={other.id}')), 2)
+        self.assertEqual(self.ids(f'/services/?category={other.id}&max_price=50'), [cheap.id])
+        self.assertEqual(self.ids('/services/?search=balloon'), [cheap.id])
+        self.assertEqual(self.ids('/services/?ordering=price')[0], cheap.id)
+
+    def test_ordering_ties_page_by_id(self):
+        # All three services cost the same; every page has one, none repeated or skipped
+        ids, url = [], '/services/?ordering=-price&page_size=1'
+        while url:
+            response = self.client.get(url)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, sorted((service.id for service in self.services), reverse=True))
+
+    def test_provider_feed_filters(self):
+        self.client.force_authenticate(self.provider)
+        nairobi, mombasa = self.make_orders(2, items_per_order=1)
+        Order.objects.filter(pk=mombasa.pk).update(location='Mombasa', date=date(2025, 3, 1), event_type='Wedding')
+        self.assertEqual(self.ids('/orders/?location=mombasa'), [mombasa.id])
+        self.assertEqual(self.ids('/orders/?date_after=2025-02-01'), [mombasa.id])
+        self.assertEqual(self.ids('/orders/?event_type=Others'), [nairobi.id])
+        self.assertEqual(self.ids('/orders/?max_total=100'), [])
+
+
+class OrderEventTests(ApiTestCase):
+    def test_local_backend_delivers_across_threads(self):
+        backend = LocalBackend()
+
+        async def receive():
+            events = backend.subscribe()
+            waiting = asyncio.ensure_future(anext(events))
+            await asyncio.sleep(0)
+            threading.Thread(target=backend.publish, args=({'event': 'order.created', 'id': 1},)).start()
+            message = await asyncio.wait_for(waiting, timeout=5)
+            await events.aclose()
+            return message
+
+        self.assertEqual(asyncio.run(receive()), {'event': 'order.created', 'id': 1})
+        self.assertFalse(backend._subscribers)
+
+    def test_lifecycle_events_are_published_on_commit(self):
+        order = self.make_orders(1)[0]
+        self.client.force_authenticate(self.provider)
+        with mock.patch.object(get_backend(), 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/orders/{order.id}/claim_order/')
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/orders/{order.id}/release_order/')
+        self.assertEqual(
+            [call.args[0]['event'] for call in publish.call_args_list],
+            ['order.claimed', 'order.released'],
+        )
+
+    def test_stream_requires_a_provider(self):
+        self.assertEqual(self.client.get('/orders/stream/').status_code, 401)
+        token = AccessToken.for_user(self.customer)
+        self.assertEqual(self.client.get(f'/orders/stream/?token={token}').status_code, 403)
+        self.assertEqual(self.client.get('/orders/stream/?token=garbage').status_code, 401)
+
+    async def test_stream_pushes_events(self):
+        token = AccessToken.for_user(self.provider)
+        response = await self.async_client.get(f'/orders/stream/?token={token}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b': connected\n\n')
+        waiting = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0.01)
+        get_backend().publish({'event': 'order.created', 'id': 7})
+        chunk = await asyncio.wait_for(waiting, timeout=5)
+        self.assertTrue(chunk.startswith(b'event: order.created\ndata: '))
+
+
+class OrderTotalsTests(ApiTestCase):
+    def test_item_changes_refresh_totals(self):
+        order = self.make_orders(1, items_per_order=1)[0]
+        decor = Category.objects.create(name='Decor')
+        balloon = Service.objects.create(name='Balloon', description='desc', price=Decimal('2.50'), category=decor)
+        with self.captureOnCommitCallbacks(execute=True):
+            item = OrderItem.objects.create(order=order, service=balloon, quantity=4, price=balloon.price)
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('110.00'))
+        self.assertEqual(order.item_count, 5)
+        self.assertEqual(
+            sorted(order.category_subtotals.values_list('category', 'subtotal')),
+            sorted([(self.category.id, Decimal('100.00')), (decor.id, Decimal('10.00'))]),
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('100.00'))
+        self.assertEqual(order.category_subtotals.count(), 1)
+
+    def test_item_saves_refresh_each_order_once(self):
+        first, second = self.make_orders(2, items_per_order=1)
+        refresh_totals = OrderQuerySet.refresh_totals
+        with mock.patch.object(OrderQuerySet, 'refresh_totals', autospec=True, side_effect=refresh_totals) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                for order in (first, second, first):
+                    OrderItem.objects.create(order=order, service=self.services[1], quantity=2, price=Decimal('100.00'))
+        refresh.assert_called_once()
+        self.assertLessEqual({first.pk, second.pk}, set(refresh.call_args.args[0].values_list('pk', flat=True)))
+        first.refresh_from_db()
+        self.assertEqual(first.total_price, Decimal('500.00'))
+
+    def test_deleting_order_with_items(self):
+        order = self.make_orders(1)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertFalse(Order.objects.exists())
+
+
+class AnalyticsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = UserAccount.objects.create_user(
+            email='staff@example.com', password='pass', first_name='S', last_name='Taff', is_staff=True
+        )
+        self.client.force_authenticate(self.customer)
+        payload = {
+            'telephone': '0712345678', 'location': 'Nairobi', 'date': '2025-01-01',
+            'items': [{'service': self.services[0].id, 'quantity': 1, 'price': '100.00'}],
+        }
+        response = self.client.post(
+            '/orders/', [dict(payload, event_type='Wedding')] * 2 + [dict(payload, event_type='Birthday')], format='json'
+        )
+        self.orders = [row['id'] for row in response.data]
+
+    def test_revenue_by_event_type(self):
+        self.client.force_authenticate(self.staff)
+        with self.assertNumQueries(1):
+            response = self.client.get('/analytics/revenue_by_event_type/')
+        self.assertEqual(
+            [(row['event_type'], row['orders'], row['revenue']) for row in response.data],
+            [('Wedding', 2, Decimal('200.00')), ('Birthday', 1, Decimal('100.00'))],
+        )
+
+    def test_orders_by_status_follows_claims(self):
+        self.client.force_authenticate(self.provider)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/orders/{self.orders[0]}/claim_order/')
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/analytics/orders_by_status/?interval=month')
+        self.assertEqual(
+            sorted((row['status'], row['orders']) for row in response.data),
+            [('PENDING', 2), ('PROCESSING', 1)],
+        )
+
+    def test_provider_earnings(self):
+        self.client.force_authenticate(self.provider)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/orders/{self.orders[2]}/claim_order/')
+        response = self.client.get('/analytics/provider_earnings/')
+        self.assertEqual(response.data['totals']['orders'], 1)
+        self.assertEqual(response.data['totals']['revenue'], Decimal('100.00'))
+
+    def test_permissions_and_validation(self):
+        self.assertEqual(self.client.get('/analytics/revenue_by_event_type/').status_code, 403)
+        self.assertEqual(self.client.get('/analytics/provider_earnings/').status_code, 403)
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.get('/analytics/orders_by_status/?start=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/analytics/orders_by_status/?interval=week').status_code, 400)
+        self.assertEqual(self.client.get('/analytics/orders_by_status/?start=2024-02-30').status_code, 400)
+        self.assertEqual(self.client.get('/analytics/provider_earnings/?provider=abc').status_code, 400)
+        self.assertEqual(self.client.get(f'/analytics/provider_earnings/?provider={self.provider.id}').status_code, 200)
+
+    def test_one_row_per_group(self):
+        day = timezone.localdate()
+        OrderDailyStat.rebuild([day])
+        OrderDailyStat.rebuild([day])
+        rows = list(OrderDailyStat.objects.values_list('status', 'event_type', 'provider', 'order_count'))
+        self.assertEqual(sorted(rows), [('PENDING', 'Birthday', None, 1), ('PENDING', 'Wedding', None, 2)])
+        stat = OrderDailyStat.objects.filter(event_type='Wedding').values(
+            'day', 'status', 'event_type', 'order_count', 'revenue', 'paid_revenue'
+        ).get()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderDailyStat.objects.create(**stat)
+        OrderDailyStat.objects.create(**dict(stat, provider=self.provider))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderDailyStat.objects.create(**dict(stat, provider=self.provider))
+
+    def test_rebuild_command_matches_incremental_rollup(self):
+        before = sorted(OrderDailyStat.objects.values_list('status', 'event_type', 'order_count', 'revenue'))
+        call_command('rebuild_order_stats', stdout=StringIO())
+        after = sorted(OrderDailyStat.objects.values_list('status', 'event_type', 'order_count', 'revenue'))
+        self.assertEqual(before, after)
+
+    def test_rebuild_command_clears_days_without_orders(self):
+        day = date(2024, 3, 1)
+        OrderDailyStat.objects.create(day=day, status='PENDING', event_type='Others', order_count=3, revenue=Decimal('1'), paid_revenue=Decimal('0'))
+        kept = OrderDailyStat.objects.exclude(day=day).count()
+        call_command('rebuild_order_stats', since=day, stdout=StringIO())
+        self.assertFalse(OrderDailyStat.objects.filter(day=day).exists())
+        self.assertEqual(OrderDailyStat.objects.count(), kept)
+
+
+class CachedAuthenticationTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        response = self.client.post(
+            '/auth/jwt/create/', {'email': 'provider@example.com', 'password': 'pass'}, format='json'
+        )
+        self.token = response.data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {self.token}')
+
+    def test_token_carries_role(self):
+        self.assertEqual(AccessToken(self.token)['role'], 'PROVIDER')
+
+    def test_warm_cache_needs_no_user_query(self):
+        self.make_orders(2)
+        cold = self.count_queries('/orders/')
+        warm = self.count_queries('/orders/')
+        self.assertEqual(warm, cold - 1)
+
+        self.client.credentials()
+        self.client.force_authenticate(self.provider)
+        self.assertEqual(self.count_queries('/orders/'), warm)
+
+    def test_saving_user_invalidates(self):
+        self.count_queries('/users/')
+        UserAccount.objects.get(pk=self.provider.pk).save()
+        self.assertIsNone(user_cache.get(self.provider.pk))
+
+        self.provider.is_active = False
+        self.provider.save()
+        self.assertEqual(self.client.get('/users/').status_code, 401)
+
+
+class CatalogTransferTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = UserAccount.objects.create_user(
+            email='staff@example.com', password='pass', first_name='S', last_name='Taff', is_staff=True
+        )
+        self.client.force_authenticate(self.staff)
+
+    def upload(self, name, content):
+        return self.client.post(
+            '/services/bulk_import/', {'file': SimpleUploadedFile(name, content.encode())}, format='multipart'
+        )
+
+    def test_csv_import_upserts_and_reports_bad_rows(self):
+        existing = self.services[0]
+        content = (
+            'id,name,description,price,category\n'
+            f'{existing.id},Renamed,desc,150.00,{self.category.id}\n'
+            ',Brand new,desc,20.00,Catering\n'
+            ',Orphan,desc,20.00,Nope\n'
+            ',Bad price,desc,lots,Catering\n'
+        )
+        response = self.upload('services.csv', content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual([row['row'] for row in response.data['errors']], [3, 4])
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.price), ('Renamed', Decimal('150.00')))
+        self.assertTrue(Service.objects.filter(name='Brand new', category=self.category).exists())
+
+    def test_import_validates_prices_ids_and_duplicates(self):
+        existing = self.services[0]
+        content = (
+            'id,name,description,price,category\n'
+            f'{existing.id},First,desc,10.00,Catering\n'
+            ',Infinite,desc,Infinity,Catering\n'
+            ',Too big,desc,123456789012,Catering\n'
+            ',Too precise,desc,1.005,Catering\n'
+            '99999999999999999999,Huge id,desc,1.00,Catering\n'
+            f'{existing.id},Second,desc,20.00,Catering\n'
+        )
+        response = self.upload('services.csv', content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual([row['row'] for row in response.data['errors']], [1, 2, 3, 4, 5])
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.price), ('Second', Decimal('20.00')))
+
+    def test_unparseable_rows_are_reported_after_earlier_chunks(self):
+        cache.clear()
+        self.assertEqual(self.client.get('/services/')['X-Cache'], 'MISS')
+        lines = [
+            json.dumps({'name': f'S{i}', 'description': '', 'price': '1.00', 'category': self.category.id})
+            for i in range(600)
+        ]
+        lines[549] = '{"name": broken'
+        lines[550] = '5'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload('services.jsonl', '\n'.join(lines) + '\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['imported'], 598)
+        self.assertEqual([row['row'] for row in response.data['errors']], [550, 551])
+        # The catalog cache was invalidated for the committed rows
+        self.assertEqual(self.client.get('/services/')['X-Cache'], 'MISS')
+
+        response = self.client.post('/services/bulk_import/', {
+            'file': SimpleUploadedFile('services.csv', b'id,name,description,price,category\n,Ok,d,1.00,Catering\n,\xff\xfe,d,1.00,Catering\n')
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['imported'], response.data['errors']), (1, [{'row': 2, 'error': 'not UTF-8'}]))
+
+    def test_database_errors_skip_rows(self):
+        upsert = catalog_io.upsert
+
+        def refuse_boom(model, objects, update_fields):
+            if any(obj.name == 'Boom' for obj in objects):
+                raise IntegrityError('boom')
+            upsert(model, objects, update_fields)
+
+        with mock.patch('api.catalog_io.upsert', side_effect=refuse_boom):
+            response = self.upload('services.csv', (
+                'id,name,description,price,category\n'
+                ',Fine,desc,1.00,Catering\n'
+                ',Boom,desc,1.00,Catering\n'
+            ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual([row['row'] for row in response.data['errors']], [2])
+        self.assertTrue(Service.objects.filter(name='Fine').exists())
+
+    def test_jsonl_import_uses_constant_queries(self):
+        def lines(count):
+            return ''.join(
+                json.dumps({'name': f'S{i}', 'description': '', 'price': '1.00', 'category': self.category.id}) + '\n'
+                for i in range(count)
+            )
+        with CaptureQueriesContext(connection) as small:
+            self.upload('services.jsonl', lines(2))
+        with CaptureQueriesContext(connection) as large:
+            response = self.upload('services.jsonl', lines(150))
+        self.assertEqual(response.data['imported'], 150)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_export_round_trip(self):
+        response = self.client.get('/services/export/?file_format=jsonl')
+        self.assertEqual(response['Content-Type'], 'application/jsonl')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [s.id for s in self.services])
+        self.assertEqual(rows[0]['category'], self.category.id)
+
+        out = StringIO()
+        call_command('export_catalog', 'categories', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['id,name,description', f'{self.category.id},Catering,'])
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/services/export/').status_code, 403)
+        self.assertEqual(self.upload('services.csv', 'id,name\n').status_code, 403)
+
+
+class OrderExportTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = UserAccount.objects.create_user(
+            email='staff@example.com', password='pass', first_name='S', last_name='Taff', is_staff=True
+        )
+        self.client.force_authenticate(self.staff)
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_one_row_per_item(self):
+        first, second = self.make_orders(2, items_per_order=2)
+        Order.objects.filter(pk=second.pk).update(paid=True, mpesa_code='QWE123RTY', status='COMPLETED')
+        empty = Order.objects.create(
+            user=self.customer, total_price=Decimal('0'), telephone='0712345678', location='Nairobi', date=date(2025, 1, 1),
+        )
+        rows = self.export('/orders/export/?file_format=jsonl')
+        self.assertEqual([row['order_id'] for row in rows], [first.id, first.id, second.id, second.id, empty.id])
+        self.assertEqual(rows[2]['mpesa_code'], 'QWE123RTY')
+        self.assertEqual(rows[0]['client_email'], 'client@example.com')
+        self.assertIsNone(rows[4]['item_id'])
+
+        rows = self.export('/orders/export/?file_format=jsonl&status=COMPLETED')
+        self.assertEqual({row['order_id'] for row in rows}, {second.id})
+        self.assertEqual(self.export('/orders/export/?file_format=jsonl&end=2000-01-01'), [])
+
+    def test_command_csv(self):
+        self.make_orders(1, items_per_order=1)
+        out = StringIO()
+        call_command('export_orders', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('order_id,created_at,event_date,status'))
+        self.assertEqual(len(lines), 2)
+
+    def test_staff_only_and_validation(self):
+        self.assertEqual(self.client.get('/orders/export/?start=soon').status_code, 400)
+        self.assertEqual(self.client.get('/orders/export/?start=2024-02-30').status_code, 400)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/orders/export/').status_code, 403)
+
+
+class AdminChangelistTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        admin_user = UserAccount.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='A', last_name='Dmin'
+        )
+        self.client.force_login(admin_user)
+
+    def assertConstantQueries(self, url):
+        self.make_orders(1, items_per_order=1)
+        baseline = self.count_queries(url)
+        self.make_orders(10, items_per_order=3)
+        self.assertEqual(self.count_queries(url), baseline)
+
+    def test_order_changelist(self):
+        self.assertConstantQueries('/admin/api/order/')
+
+    def test_order_item_changelist(self):
+        self.assertConstantQueries('/admin/api/orderitem/')
+
+    def test_order_change_page_does_not_list_every_service(self):
+        order = self.make_orders(1, items_per_order=1)[0]
+        Service.objects.create(name='Unrelated service', description='desc', price=Decimal('1.00'), category=self.category)
+        response = self.client.get(f'/admin/api/order/{order.id}/change/')
+        self.assertContains(response, 'Service 0')
+        self.assertNotContains(response, 'Unrelated service')
+
+
+@override_settings(MPESA_CALLBACK_TOKEN='secret', MPESA_ALLOWED_IPS=[])
+class PaymentCallbackTests(ApiTestCase):
+    url = '/payments/mpesa/callback/?token=secret'
+
+    def test_retried_callbacks_are_stored_once(self):
+        payload = stk_callback_payload('QWE123RTY0', '200.00')
+        for _ in range(3):
+            response = self.client.post(self.url, payload, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['ResultCode'], 0)
+        self.assertEqual(PaymentCallback.objects.count(), 1)
+
+    def push(self, order, **data):
+        self.client.force_authenticate(order.user)
+        with self.settings(MPESA_STK_BACKEND='api.mpesa.StubBackend'):
+            response = self.client.post(f'/orders/{order.id}/pay/', data, format='json')
+        self.client.force_authenticate(None)
+        return response
+
+    def test_matches_by_checkout_request_and_account_reference(self):
+        by_push, by_reference, underpaid = self.make_orders(3, items_per_order=2)
+        checkout_request_id = self.push(by_push).data['checkout_request_id']
+        self.client.post(
+            self.url, stk_callback_payload('QWE123RTY0', '200.00', checkout_request_id=checkout_request_id), format='json'
+        )
+        self.client.post(self.url, c2b_confirmation_payload('ASD456FGH0', '200.00', by_reference.id), format='json')
+        self.client.post(self.url, c2b_confirmation_payload('ZXC789VBN0', '50.00', underpaid.id), format='json')
+        self.client.post(self.url, stk_callback_payload('', '200.00', result_code=1032), format='json')
+
+        # claim, order lookup, two bulk updates and the daily stats rebuild, whatever the batch size
+        with self.assertNumQueries(12):
+            counts = process_payment_callbacks()
+        self.assertEqual(counts, {'MATCHED': 2, 'UNMATCHED': 1, 'FAILED': 1})
+        self.assertEqual(
+            set(Order.objects.filter(paid=True).values_list('id', 'mpesa_code')),
+            {(by_push.id, 'QWE123RTY0'), (by_reference.id, 'ASD456FGH0')},
+        )
+        self.assertEqual(OrderDailyStat.objects.get().paid_revenue, Decimal('400.00'))
+        self.assertEqual(process_payment_callbacks(), {})
+
+    def test_stk_push_stores_checkout_request_id(self):
+        order = self.make_orders(1)[0]
+        token = mock.Mock(**{'json.return_value': {'access_token': 'abc'}})
+        push = mock.Mock(**{'json.return_value': {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1'}})
+        with mock.patch('api.mpesa.requests.get', return_value=token), \
+                mock.patch('api.mpesa.requests.post', return_value=push) as post, \
+                self.settings(MPESA_STK_BACKEND='api.mpesa.DarajaBackend'):
+            self.client.force_authenticate(self.customer)
+            response = self.client.post(f'/orders/{order.id}/pay/', {'phone': '+254 700 000 001'}, format='json')
+        self.assertEqual(response.data, {'checkout_request_id': 'ws_CO_1'})
+        sent = post.call_args.kwargs['json']
+        self.assertEqual((sent['PhoneNumber'], sent['Amount'], sent['AccountReference']), ('254700000001', 200, str(order.id)))
+        order.refresh_from_db()
+        self.assertEqual(order.checkout_request_id, 'ws_CO_1')
+
+        push.json.return_value = {'ResponseCode': '1', 'ResponseDescription': 'Rejected'}
+        with mock.patch('api.mpesa.requests.get', return_value=token), \
+                mock.patch('api.mpesa.requests.post', return_value=push), \
+                self.settings(MPESA_STK_BACKEND='api.mpesa.DarajaBackend'):
+            self.assertEqual(self.client.post(f'/orders/{order.id}/pay/').status_code, 502)
+
+    def test_pay_refuses_other_users_paid_orders_and_bad_phones(self):
+        order = self.make_orders(1)[0]
+        self.assertEqual(self.push(order, phone='12345').status_code, 400)
+        self.client.force_authenticate(self.provider)
+        self.assertEqual(self.client.post(f'/orders/{order.id}/pay/').status_code, 404)
+        Order.objects.filter(pk=order.pk).update(paid=True)
+        self.assertEqual(self.push(order).status_code, 400)
+
+    def test_second_payment_for_paid_order_is_unmatched(self):
+        order = self.make_orders(1)[0]
+        self.client.post(self.url, c2b_confirmation_payload('ASD456FGH0', '200.00', order.id), format='json')
+        self.client.post(self.url, c2b_confirmation_payload('ZXC789VBN0', '200.00', order.id), format='json')
+        self.assertEqual(process_payment_callbacks(), {'MATCHED': 1, 'UNMATCHED': 1})
+        order.refresh_from_db()
+        self.assertEqual(order.mpesa_code, 'ASD456FGH0')
+
+    def test_rejects_bad_token_and_payload(self):
+        url = '/payments/mpesa/callback/'
+        payload = stk_callback_payload('QWE123RTY0', '200.00')
+        self.assertEqual(self.client.post(url, payload, format='json').status_code, 403)
+        self.assertEqual(self.client.post(url + '?token=wrong', payload, format='json').status_code, 403)
+        self.assertEqual(self.client.post(self.url, payload, format='json').status_code, 200)
+        c2b = c2b_confirmation_payload('ZXC789VBN0', '200.00')
+        bad = [
+            {'foo': 'bar'},
+            {'Body': 'x'},
+            {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_1', 'CallbackMetadata': {'Item': ['x']}}}},
+            {**c2b, 'TransAmount': 'NaN'},
+            {**c2b, 'TransAmount': '1e12'},
+            {**c2b, 'TransAmount': '1.005'},
+            {**c2b, 'TransAmount': {'value': 1}},
+            {**c2b, 'TransID': 'X' * 11},
+            {**c2b, 'BillRefNumber': '1' * 101},
+        ]
+        for body in bad:
+            self.assertEqual(self.client.post(self.url, body, format='json').status_code, 400, body)
+        self.assertEqual(PaymentCallback.objects.count(), 1)
+
+    def test_refused_when_unconfigured_and_allowlist_checked(self):
+        url = '/payments/mpesa/callback/'
+        payload = stk_callback_payload('QWE123RTY0', '200.00')
+        with self.settings(MPESA_CALLBACK_TOKEN=''):
+            self.assertEqual(self.client.post(url, payload, format='json').status_code, 403)
+            self.assertEqual([e.id for e in check_mpesa_callback(None)], ['api.W001'])
+            self.assertEqual([e.id for e in check_mpesa_callback_deploy(None)], ['api.E001'])
+            with self.settings(MPESA_ALLOWED_IPS=['196.201.214.0/24']):
+                self.assertEqual(check_mpesa_callback(None) + check_mpesa_callback_deploy(None), [])
+                self.assertEqual(self.client.post(url, payload, format='json').status_code, 403)
+                response = self.client.post(url, payload, format='json', REMOTE_ADDR='196.201.214.200')
+                self.assertEqual(response.status_code, 200)
+                # Only trusted proxies may name the client
+                spoofed = self.client.post(url, payload, format='json', HTTP_X_FORWARDED_FOR='196.201.214.200')
+                self.assertEqual(spoofed.status_code, 403)
+
+
+class ReadSerializerTests(ApiTestCase):
+    def test_order_output_matches_model_serializer(self):
+        self.make_orders(2, items_per_order=3, provider=self.provider)
+        self.make_orders(1)
+        orders = list(Order.objects.with_related())
+        self.assertEqual(OrderReadSerializer(orders, many=True).data, OrderSerializer(orders, many=True).data)
+
+    def test_service_output_matches_model_serializer(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.get('/services/')
+        context = {'request': response.renderer_context['request']}
+        services = list(Service.objects.order_by('id'))
+        self.assertEqual(response.data['results'], ServiceSerializer(services, many=True, context=context).data)
+        self.assertEqual(response.data['results'], ServiceReadSerializer(services, many=True, context=context).data)
+
+    def test_sparse_fieldsets(self):
+        self.client.force_authenticate(self.customer)
+        order = self.make_orders(1)[0]
+        response = self.client.get('/orders/?fields=id,status')
+        self.assertEqual(response.data['results'], [{'id': order.id, 'status': 'PENDING'}])
+        response = self.client.get(f'/orders/{order.id}/?fields=total_price')
+        self.assertEqual(response.data, {'total_price': '200.00'})
+        response = self.client.get('/services/?fields=name')
+        self.assertEqual(response.data['results'][0], {'name': 'Service 0'})
+        self.assertEqual(self.client.get('/orders/?fields=id,secret').status_code, 400)
+
+
+class CompressionTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.customer)
+        self.make_orders(50, items_per_order=3)
+
+    def get(self, url, encoding):
+        return self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+
+    def test_gzip_saves_bytes_on_order_list(self):
+        plain = self.get('/orders/?page_size=50', '')
+        compressed = self.get('/orders/?page_size=50', 'gzip, deflate')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertLess(len(compressed.content), len(plain.content) / 10)
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_brotli_is_preferred(self):
+        plain = self.get('/orders/?page_size=50', '')
+        compressed = self.get('/orders/?page_size=50', 'gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(compressed.content), plain.content)
+        self.assertEqual(self.get('/orders/?page_size=50', 'br;q=0.5, gzip')['Content-Encoding'], 'gzip')
+
+    def test_negotiation_and_threshold(self):
+        self.assertFalse(self.get('/orders/?page_size=50', 'gzip;q=0').has_header('Content-Encoding'))
+        self.assertFalse(self.get('/orders/?page_size=1&fields=id', 'gzip').has_header('Content-Encoding'))
+
+    def test_streaming_export_is_compressed(self):
+        staff = UserAccount.objects.create_superuser(email='staff@example.com', password='pass', first_name='S', last_name='Taff')
+        self.client.force_authenticate(staff)
+        plain = b''.join(self.get('/orders/export/', '').streaming_content)
+        response = self.get('/orders/export/', 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        compressed = b''.join(response.streaming_content)
+        self.assertEqual(gzip.decompress(compressed), plain)
+        self.assertLess(len(compressed), len(plain) / 5)
+
+    def test_event_stream_is_left_alone(self):
+        response = StreamingHttpResponse(iter([b'data: {}\n\n']), content_type='text/event-stream')
+        request = RequestFactory().get('/orders/stream/', HTTP_ACCEPT_ENCODING='gzip')
+        response = CompressionMiddleware(lambda request: response)(request)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ConditionalGetTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.force_authenticate(self.customer)
+        self.order = self.make_orders(1)[0]
+
+    def test_order_etag_survives_compression(self):
+        self.make_orders(20, items_per_order=3)
+        response = self.client.get('/orders/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('private', response['Cache-Control'])
+        # Only the freshness aggregate runs; no page query, no serialization
+        with self.assertNumQueries(1):
+            response = self.client.get('/orders/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_order_changes_invalidate(self):
+        url = f'/orders/{self.order.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertTrue(Order.objects.claim(self.order.id, self.provider))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        list_etag = self.client.get('/orders/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.filter(pk=self.services[0].pk).first().save()
+        self.assertEqual(self.client.get('/orders/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_last_modified(self):
+        response = self.client.get(f'/orders/{self.order.id}/')
+        last_modified = response['Last-Modified']
+        response = self.client.get(f'/orders/{self.order.id}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_lists_send_no_last_modified(self):
+        response = self.client.get('/orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        # The newest order leaving the list must not make an older date look current
+        since = http_date(time.time() + 60)
+        self.assertEqual(self.client.get('/orders/', HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+    def test_catalog_revalidates_weak_etag(self):
+        response = self.client.get('/categories/')
+        self.assertIn('public', response['Cache-Control'])
+        response = self.client.get('/categories/', HTTP_IF_NONE_MATCH=f"W/{response['ETag']}")
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_media_cache_control(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        os.makedirs(os.path.join(media_root, 'service_images', 'variants'))
+        for name in ('service_images/photo.png', 'service_images/variants/abc-320.webp'):
+            with open(os.path.join(media_root, name), 'wb') as f:
+                f.write(b'image')
+        request = RequestFactory().get('/media/')
+        response = serve_media(request, 'service_images/photo.png', document_root=media_root)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}')
+        response = serve_media(request, 'service_images/variants/abc-320.webp', document_root=media_root)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+
+class MatchingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_category = Category.objects.create(name='Decor')
+        self.decor = Service.objects.create(name='Flowers', description='desc', price=Decimal('50.00'), category=self.other_category)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.location = 'Westlands, Nairobi'
+            self.provider.save()
+
+    def post_orders(self, *orders):
+        self.client.force_authenticate(self.customer)
+        payload = [
+            {
+                'telephone': '0712345678', 'location': location, 'date': str(date.today() + timedelta(days=days)),
+                'items': [{'service': service.id, 'quantity': 1, 'price': str(service.price)}],
+            }
+            for location, days, service in orders
+        ]
+        response = self.client.post('/orders/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        return [order['id'] for order in response.data]
+
+    def matches(self, url='/orders/matches/'):
+        self.client.force_authenticate(self.provider)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [order['id'] for order in response.data['results']]
+
+    def test_region_keys(self):
+        self.assertEqual(region_key('Westlands, Nairobi'), 'nairobi')
+        self.assertEqual(region_key('Thika Road, Nairobi'), 'nairobi')
+        self.assertEqual(region_key('Kitengela town'), 'kajiado')
+        self.assertEqual(region_key('Timbuktu, Mali'), 'timbuktu')
+        self.assertEqual(region_key(''), '')
+        self.assertEqual(self.provider.region, 'nairobi')
+
+    def test_ranks_by_proximity_and_date(self):
+        nearby_later, nearby_soon, neighbour, far = self.post_orders(
+            ('Karen', 60, self.services[0]), ('Nairobi CBD', 2, self.services[0]),
+            ('Ruiru, Kiambu', 2, self.services[0]), ('Nyali, Mombasa', 2, self.services[0]),
+        )
+        self.assertEqual(self.matches(), [nearby_soon, nearby_later, neighbour])
+        self.assertEqual(self.matches('/orders/matches/?date_after=2000-01-01&fields=id')[0], nearby_soon)
+        self.assertEqual(self.matches('/orders/matches/?ordering=date'), [nearby_soon, nearby_later, neighbour])
+        self.assertEqual(self.matches('/orders/matches/?ordering=-created_at')[0], nearby_soon)
+
+    def test_category_history_breaks_ties(self):
+        catering, decor = self.post_orders(('Nairobi', 5, self.services[0]), ('Nairobi', 5, self.decor))
+        past = self.make_orders(1, items_per_order=1)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=past, service=self.decor, quantity=1, price=Decimal('50.00'))
+        Order.objects.filter(pk=past.pk).update(provider=self.provider)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.save()
+        self.assertEqual(self.matches(), [decor, catering])
+
+    def test_claim_and_release_update_candidates(self):
+        order_id, = self.post_orders(('Nairobi', 3, self.services[0]))
+        self.assertEqual(self.matches(), [order_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.claim(order_id, self.provider)
+        self.assertFalse(OrderMatch.objects.filter(order_id=order_id).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.release(order_id, self.provider)
+        self.assertEqual(self.matches(), [order_id])
+
+    def test_moving_provider_rebuilds_candidates(self):
+        self.post_orders(('Nairobi', 3, self.services[0]))
+        mombasa, = self.post_orders(('Mombasa', 3, self.services[0]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.location = 'Diani'
+            self.provider.save()
+        self.assertEqual(self.matches(), [mombasa])
+
+    def test_requires_located_provider(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/orders/matches/').status_code, 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.location = ''
+            self.provider.save()
+        self.client.force_authenticate(self.provider)
+        self.assertEqual(self.client.get('/orders/matches/').status_code, 400)
+
+
+class CalendarTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.provider)
+
+    def make_order(self, day):
+        return Order.objects.create(user=self.customer, telephone='0712345678', location='Nairobi', date=day)
+
+    def claim(self, order):
+        return self.client.post(f'/orders/{order.id}/claim_order/')
+
+    def test_claim_books_the_day(self):
+        first, same_day, next_day = self.make_order(date(2026, 12, 5)), self.make_order(date(2026, 12, 5)), self.make_order(date(2026, 12, 6))
+        self.assertEqual(self.claim(first).status_code, 200)
+        booking = CalendarEntry.objects.get(provider=self.provider)
+        self.assertEqual((booking.kind, booking.order_id, booking.start, booking.end), ('BOOKING', first.id, first.date, first.date))
+
+        response = self.claim(same_day)
+        self.assertEqual(response.status_code, 409)
+        same_day.refresh_from_db()
+        self.assertIsNone(same_day.provider_id)
+        self.assertEqual(self.claim(next_day).status_code, 200)
+
+        self.client.post(f'/orders/{first.id}/release_order/')
+        self.assertEqual(self.claim(same_day).status_code, 200)
+
+    def test_blackouts(self):
+        response = self.client.post('/calendar/', {'start': '2026-12-24', 'end': '2026-12-26', 'note': 'Holiday'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['kind'], 'BLACKOUT')
+        self.assertEqual(self.claim(self.make_order(date(2026, 12, 25))).status_code, 409)
+        self.assertEqual(self.client.post('/calendar/', {'start': '2026-12-26', 'end': '2026-12-28'}).status_code, 400)
+        self.assertEqual(self.client.post('/calendar/', {'start': '2026-12-28', 'end': '2026-12-27'}).status_code, 400)
+
+        self.client.delete(f"/calendar/{response.data['id']}/")
+        self.assertEqual(self.claim(self.make_order(date(2026, 12, 25))).status_code, 200)
+        booking = CalendarEntry.objects.get()
+        self.assertEqual(self.client.delete(f'/calendar/{booking.id}/').status_code, 404)
+
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.post('/calendar/', {'start': '2026-12-24', 'end': '2026-12-26'}).status_code, 403)
+
+    def test_update_races_are_400s(self):
+        blackout = self.client.post('/calendar/', {'start': '2026-12-24', 'end': '2026-12-26'}).data
+        # What the exclusion constraint raises on PostgreSQL when a claim books the day first
+        with mock.patch('api.serializers.CalendarEntrySerializer.save', side_effect=IntegrityError):
+            response = self.client.patch(f"/calendar/{blackout['id']}/", {'end': '2026-12-27'})
+        self.assertEqual(response.status_code, 400)
+
+        order = self.make_order(date(2026, 12, 5))
+        self.claim(order)
+        self.client.force_authenticate(self.customer)
+        with mock.patch('api.serializers.OrderSerializer.save', side_effect=IntegrityError):
+            response = self.client.patch(f'/orders/{order.id}/', {'date': '2026-12-06'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_moving_a_claimed_order_onto_a_blackout(self):
+        order = self.make_order(date(2026, 12, 5))
+        self.claim(order)
+        self.client.post('/calendar/', {'start': '2026-12-24', 'end': '2026-12-26'})
+        self.client.force_authenticate(self.customer)
+        response = self.client.patch(f'/orders/{order.id}/', {'date': '2026-12-25'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date', response.data)
+        response = self.client.patch(f'/orders/{order.id}/', {'date': '2026-12-06'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CalendarEntry.objects.get(order=order).start, date(2026, 12, 6))
+        order.refresh_from_db()
+        order.date = date(2026, 12, 24)
+        with self.assertRaises(ValidationError):
+            order.full_clean()
+
+    def test_cancelling_frees_the_day(self):
+        order = self.make_order(date(2026, 12, 5))
+        self.claim(order)
+        order.refresh_from_db()
+        order.status = 'CANCELLED'
+        order.save()
+        self.assertFalse(CalendarEntry.objects.exists())
+
+    def test_claim_cost_does_not_grow_with_calendar(self):
+        self.claim(self.make_order(date(2026, 1, 1)))
+        with CaptureQueriesContext(connection) as small:
+            self.claim(self.make_order(date(2026, 1, 2)))
+        CalendarEntry.objects.bulk_create([
+            CalendarEntry(provider=self.provider, start=date(2027, 1, 1) + timedelta(days=i), end=date(2027, 1, 1) + timedelta(days=i))
+            for i in range(200)
+        ])
+        with CaptureQueriesContext(connection) as large:
+            self.claim(self.make_order(date(2026, 1, 3)))
+        self.assertEqual(len(large), len(small))
+
+    def test_freebusy_in_one_query(self):
+        other = UserAccount.objects.create_user(
+            email='other@example.com', password='pass', first_name='O', last_name='Ther', role='PROVIDER'
+        )
+        CalendarEntry.objects.create(provider=self.provider, start=date(2026, 11, 28), end=date(2026, 12, 2))
+        CalendarEntry.objects.create(provider=self.provider, start=date(2026, 12, 5), end=date(2026, 12, 5), kind='BOOKING')
+        self.client.force_authenticate(self.customer)
+        url = f'/calendar/freebusy/?providers={self.provider.id},{other.id}&start=2026-12-01&end=2026-12-10'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        days = response.data['providers']
+        self.assertEqual(days[self.provider.id]['busy'], [
+            {'start': date(2026, 12, 1), 'end': date(2026, 12, 2), 'kind': 'BLACKOUT'},
+            {'start': date(2026, 12, 5), 'end': date(2026, 12, 5), 'kind': 'BOOKING'},
+        ])
+        self.assertEqual(days[self.provider.id]['free'], [
+            {'start': date(2026, 12, 3), 'end': date(2026, 12, 4)},
+            {'start': date(2026, 12, 6), 'end': date(2026, 12, 10)},
+        ])
+        self.assertEqual(days[other.id], {'busy': [], 'free': [{'start': date(2026, 12, 1), 'end': date(2026, 12, 10)}]})
+        self.assertEqual(self.client.get('/calendar/freebusy/?providers=x&start=2026-12-01&end=2026-12-10').status_code, 400)
+        self.assertEqual(self.client.get('/calendar/freebusy/?providers=1&start=2026-12-10&end=2026-12-01').status_code, 400)
+
+
+class AsyncViewTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.async_client = AsyncClient()
+
+    def auth(self, user):
+        return {'headers': {'Authorization': f'JWT {AccessToken.for_user(user)}'}}
+
+    async def test_service_list_matches_sync_view(self):
+        expected = (await sync_to_async(self.client.get)('/services/')).data['results']
+        response = await self.async_client.get('/async/services/?page_size=2')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        first = response.json()
+        second = (await self.async_client.get(first['next'])).json()
+        self.assertIsNone(second['next'])
+        self.assertEqual(first['results'] + second['results'], json.loads(json.dumps(expected)))
+        self.assertEqual((await self.async_client.get('/async/services/?page_size=2'))['X-Cache'], 'HIT')
+        self.assertEqual((await self.async_client.get('/async/services/?fields=nope')).status_code, 400)
+
+    async def test_service_list_uses_service_filter(self):
+        cheap = await Service.objects.acreate(
+            name='Cheap', description='desc', price=Decimal('10.00'), category=self.category
+        )
+        response = await self.async_client.get('/async/services/?max_price=50')
+        self.assertEqual([service['id'] for service in response.json()['results']], [cheap.id])
+        response = await self.async_client.get('/async/services/?min_price=50')
+        self.assertEqual(len(response.json()['results']), 3)
+        response = await self.async_client.get('/async/services/?category=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('category', response.json())
+
+    async def test_order_detail_matches_sync_view(self):
+        order, = await sync_to_async(self.make_orders)(1, items_per_order=3)
+        await sync_to_async(self.client.force_authenticate)(self.customer)
+        expected = (await sync_to_async(self.client.get)(f'/orders/{order.id}/')).data
+        response = await self.async_client.get(f'/async/orders/{order.id}/', **self.auth(self.customer))
+        self.assertEqual(response.json(), json.loads(json.dumps(expected)))
+        self.assertEqual((await self.async_client.get(f'/async/orders/{order.id}/')).status_code, 401)
+        other = await sync_to_async(UserAccount.objects.create_user)(
+            email='other@example.com', password='pass', first_name='O', last_name='Ther'
+        )
+        self.assertEqual((await self.async_client.get(f'/async/orders/{order.id}/', **self.auth(other))).status_code, 404)
+
+    async def test_my_gigs_pages_match_sync_view(self):
+        await sync_to_async(self.make_orders)(5, provider=self.provider)
+        await sync_to_async(self.client.force_authenticate)(self.provider)
+        expected = (await sync_to_async(self.client.get)('/orders/my_gigs/')).data['results']
+        results, url = [], '/async/orders/my_gigs/?page_size=2'
+        while url:
+            page = (await self.async_client.get(url, **self.auth(self.provider))).json()
+            results += page['results']
+            url = page['next']
+        self.assertEqual(results, json.loads(json.dumps(expected)))
+        response = await self.async_client.get('/async/orders/my_gigs/?status=COMPLETED', **self.auth(self.provider))
+        self.assertEqual(response.json()['results'], [])
+        response = await self.async_client.get('/async/orders/my_gigs/', **self.auth(self.customer))
+        self.assertEqual(response.status_code, 403)
+
+
+class ThrottleTests(ApiTestCase):
+    def rates(self, **rates):
+        rest_framework = dict(settings.REST_FRAMEWORK)
+        rest_framework['DEFAULT_THROTTLE_RATES'] = {**rest_framework['DEFAULT_THROTTLE_RATES'], **rates}
+        return self.settings(REST_FRAMEWORK=rest_framework)
+
+    def test_claim_order_has_its_own_budget(self):
+        orders = self.make_orders(3)
+        for day, order in enumerate(orders):
+            Order.objects.filter(pk=order.pk).update(date=date(2025, 1, 1) + timedelta(days=day))
+        self.client.force_authenticate(self.provider)
+        with self.rates(claim='2/min'):
+            for order in orders[:2]:
+                self.assertEqual(self.client.post(f'/orders/{order.id}/claim_order/').status_code, 200)
+            response = self.client.post(f'/orders/{orders[2].id}/claim_order/')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            # Other endpoints and other providers are not affected
+            self.assertEqual(self.client.get('/orders/my_gigs/').status_code, 200)
+            other = UserAccount.objects.create_user(
+                email='other@example.com', password='pass', first_name='O', last_name='Ther', role='PROVIDER'
+            )
+            self.client.force_authenticate(other)
+            self.assertEqual(self.client.post(f'/orders/{orders[2].id}/claim_order/').status_code, 200)
+
+    def test_login_and_register_are_throttled_per_ip(self):
+        credentials = {'email': 'provider@example.com', 'password': 'wrong'}
+        with self.rates(login='2/min', register='1/min'):
+            for _ in range(2):
+                self.assertEqual(self.client.post('/auth/jwt/create/', credentials, format='json').status_code, 401)
+            self.assertEqual(self.client.post('/auth/jwt/create/', credentials, format='json').status_code, 429)
+            self.assertEqual(self.client.post('/auth/token/login/', credentials, format='json').status_code, 429)
+            # Registration is a separate budget
+            self.assertEqual(self.client.post('/auth/register/', {}, format='json').status_code, 400)
+            self.assertEqual(self.client.post('/auth/register/', {}, format='json').status_code, 429)
+            other_ip = self.client.post('/auth/jwt/create/', credentials, format='json', REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(other_ip.status_code, 401)
+
+    def test_spoofed_forwarded_for_shares_the_bucket(self):
+        credentials = {'email': 'provider@example.com', 'password': 'wrong'}
+        with self.rates(login='2/min'):
+            codes = [
+                self.client.post('/auth/jwt/create/', credentials, format='json', HTTP_X_FORWARDED_FOR=f'10.9.0.{i}').status_code
+                for i in range(4)
+            ]
+        self.assertEqual(codes, [401, 401, 429, 429])
+
+    def test_forwarded_for_is_trusted_behind_proxies(self):
+        credentials = {'email': 'provider@example.com', 'password': 'wrong'}
+        rest_framework = dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)
+        rest_framework['DEFAULT_THROTTLE_RATES'] = {**rest_framework['DEFAULT_THROTTLE_RATES'], 'login': '1/min'}
+        with self.settings(REST_FRAMEWORK=rest_framework):
+            for address in ('10.9.0.1', '10.9.0.2'):
+                response = self.client.post('/auth/jwt/create/', credentials, format='json', HTTP_X_FORWARDED_FOR=address)
+                self.assertEqual(response.status_code, 401)
+
+    def test_mpesa_callback_is_not_throttled(self):
+        payload = c2b_confirmation_payload(receipt='QWE123', amount=200, account_reference='1')
+        with self.rates(anon='1/min'), self.settings(MPESA_CALLBACK_TOKEN='secret'):
+            self.assertEqual(self.client.get('/services/').status_code, 200)
+            self.assertEqual(self.client.get('/services/').status_code, 429)
+            for _ in range(3):
+                self.assertEqual(self.client.post('/payments/mpesa/callback/?token=secret', payload, format='json').status_code, 200)
+
+    def test_memory_store_refills_tokens(self):
+        store = MemoryBucketStore()
+        self.assertEqual([store.consume('k', 2, 60, now=0)[0] for _ in range(3)], [True, True, False])
+        self.assertEqual(store.consume('k', 2, 60, now=0), (False, 30))
+        self.assertTrue(store.consume('k', 2, 60, now=30)[0])
+        self.assertFalse(store.consume('k', 2, 60, now=30)[0])
+        self.assertTrue(store.consume('other', 2, 60, now=30)[0])
+
+    def test_cache_store_drains_previous_window(self):
+        store = CacheBucketStore()
+        self.assertEqual([store.consume('k', 2, 60, now=600)[0] for _ in range(3)], [True, True, False])
+        # Halfway through the next window half of the previous count (3) has drained
+        self.assertFalse(store.consume('k', 2, 60, now=690)[0])
+        self.assertTrue(store.consume('k', 2, 60, now=750)[0])
+        self.assertTrue(store.consume('other', 2, 60, now=750)[0])
+
+    def test_memory_store_prunes_by_each_buckets_period(self):
+        store = MemoryBucketStore(max_keys=3)
+        store.consume('register', 1, 3600, now=0)
+        store.consume('claim', 1, 60, now=0)
+        store.consume('a', 1, 60, now=120)
+        store.consume('b', 1, 60, now=120)
+        # The idle claim bucket is gone, the hour long register bucket is still empty
+        self.assertNotIn('claim', store.buckets)
+        self.assertFalse(store.consume('register', 1, 3600, now=120)[0])
+        for i in range(50):
+            self.assertTrue(store.consume(f'client{i}', 5, 60, now=200)[0])
+        self.assertLessEqual(len(store.buckets), 3)
+
+    def test_djoser_password_endpoints_use_their_scopes(self):
+        with self.rates(register='1/min', login='1/min'):
+            self.assertEqual(self.client.post('/auth/users/', {}, format='json').status_code, 400)
+            self.assertEqual(self.client.post('/auth/users/', {}, format='json').status_code, 429)
+            self.client.force_authenticate(self.customer)
+            payload = {'current_password': 'wrong', 'new_password': 'N3w-passw0rd!'}
+            self.assertEqual(self.client.post('/auth/users/set_password/', payload, format='json').status_code, 400)
+            self.assertEqual(self.client.post('/auth/users/set_password/', payload, format='json').status_code, 429)
+            # Reading your own account is not a password endpoint
+            self.assertEqual(self.client.get('/auth/users/me/').status_code, 200)
+
+    async def test_async_views_are_throttled(self):
+        with self.rates(anon='1/min', user='1/min'):
+            self.assertEqual((await self.async_client.get('/async/services/')).status_code, 200)
+            response = await self.async_client.get('/async/services/')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            token = {'Authorization': f'JWT {AccessToken.for_user(self.provider)}'}
+            self.assertEqual((await self.async_client.get('/async/orders/my_gigs/', headers=token)).status_code, 200)
+            self.assertEqual((await self.async_client.get('/async/orders/my_gigs/', headers=token)).status_code, 429)
+
+    def test_overhead_is_small(self):
+        # The requirement is under 1 ms; measured it is tens of microseconds, and the bound is
+        # loose so a loaded CI machine does not fail it
+        request = RequestFactory().get('/services/')
+        request.user = self.customer
+        throttle = UserBucketThrottle()
+        for store in (CacheBucketStore(), MemoryBucketStore()):
+            with mock.patch('api.throttling.get_store', return_value=store), self.rates(user='1000000/min'):
+                start = time.perf_counter()
+                for _ in range(1000):
+                    self.assertTrue(throttle.allow_request(request, None))
+                self.assertLess((time.perf_counter() - start) / 1000, 0.01)
+
+
+class BenchmarkTests(TestCase):
+    options = {'clients': 5, 'providers': 2, 'categories': 2, 'services': 6, 'orders': 10, 'requests': 2, 'warmup': 0}
+
+    def test_seed_is_deterministic(self):
+        fixtures = seed_fixtures(clients=5, providers=2, categories=2, services=6, orders=10)
+        self.assertEqual(len(fixtures['services']), 6)
+        self.assertEqual(Order.objects.filter(provider__isnull=False).count(), 2)
+        self.assertEqual(CalendarEntry.objects.count(), 2)
+        self.assertFalse(Order.objects.filter(total_price=0).exists())
+        first = list(Order.objects.order_by('id').values_list('location', 'date', 'total_price'))
+        Order.objects.all().delete()
+        UserAccount.objects.filter(email__startswith='bench-').delete()
+        Category.objects.all().delete()
+        seed_fixtures(clients=5, providers=2, categories=2, services=6, orders=10)
+        self.assertEqual(list(Order.objects.order_by('id').values_list('location', 'date', 'total_price')), first)
+
+    def test_run_saves_results_and_fails_on_regression(self):
+        path = os.path.join(tempfile.mkdtemp(), 'results.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('benchmark_api', save=path, stdout=StringIO(), **self.options)
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEqual(
+            set(results['endpoints']), {'register', 'login', 'catalog', 'order_create', 'claim', 'my_gigs'}
+        )
+        self.assertEqual(results['endpoints']['catalog']['requests'], 2)
+        # Nothing the run wrote is kept
+        self.assertFalse(UserAccount.objects.filter(email__startswith='bench-').exists())
+
+        self.assertEqual(compare(results, results, tolerance=0), [])
+        baseline = json.loads(json.dumps(results))
+        baseline['endpoints']['claim']['queries'] -= 1
+        baseline['endpoints']['login']['p50'] = results['endpoints']['login']['p50'] / 2
+        regressions = compare(results, baseline, tolerance=0.25)
+        self.assertEqual([message.split(':')[0] for message in regressions], ['login', 'claim'])
+        with open(path, 'w') as f:
+            json.dump(baseline, f)
+        with self.assertRaisesMessage(CommandError, 'claim'):
+            call_command('benchmark_api', baseline=path, tolerance=100, stdout=StringIO(), **self.options)
+        with self.assertRaisesMessage(CommandError, 'different options'):
+            call_command('benchmark_api', baseline=path, stdout=StringIO(), **{**self.options, 'orders': 11})
@@ -0,0 +1,192 @@
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Cache backends whose incr() is atomic across processes; Django's file and database caches
+# implement it as get + set, so two workers can both read the same count
+ATOMIC_CACHES = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    # Atomic, but per process: fine for one worker and tests
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def parse_rate(rate):
+    # Same format as DRF's rates ('5/min', '1000/day'): a bucket of `num` tokens refilled over the period
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class MemoryBucketStore:
+    """Exact token buckets in a dict; per process, so only for a single worker (or tests)."""
+
+    def __init__(self, max_keys=100000):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def consume(self, key, capacity, period, now=None):
+        now = time.monotonic() if now is None else now
+        rate = capacity / period
+        with self.lock:
+            # Popped and reinserted, so the dict stays in least recently used order
+            tokens, updated, _ = self.buckets.pop(key, (capacity, now, period))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now, period)
+            if len(self.buckets) > self.max_keys:
+                self.prune(now)
+        return (True, 0) if allowed else (False, (1 - tokens) / rate)
+
+    def prune(self, now):
+        # A bucket idle for its whole period is full again, the same as having no entry
+        self.buckets = {key: value for key, value in self.buckets.items() if now - value[1] < value[2]}
+        if len(self.buckets) > self.max_keys:
+            # Still too many active clients: forget the least recently used tenth
+            for key in list(self.buckets)[:len(self.buckets) - self.max_keys * 9 // 10]:
+                del self.buckets[key]
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Shared buckets on the Django cache, so every worker sees the same budget. Only redis and
+    memcached are shared and atomic (api.checks rejects the file and database caches); the
+    default locmem cache is per process like MemoryBucketStore.
+
+    A cache can only increment atomically, not read-modify-write a (tokens, timestamp) pair, so
+    the bucket is approximated with a counter per period: the previous period's count is drained
+    linearly, like tokens refilling, and added to the current one.
+    """
+
+    prefix = 'throttle'
+
+    def consume(self, key, capacity, period, now=None):
+        now = time.time() if now is None else now
+        window = int(now // period)
+        current = f'{self.prefix}:{key}:{window}'
+        try:
+            count = cache.incr(current)
+        except ValueError:
+            cache.add(current, 0, timeout=period * 2)
+            count = cache.incr(current)
+        previous = cache.get(f'{self.prefix}:{key}:{window - 1}', 0)
+        remaining = 1 - (now % period) / period
+        used = previous * remaining + count
+        if used <= capacity:
+            return True, 0
+        # Rejected requests are counted too, so a client has to slow down to get through again
+        excess = used - capacity
+        if previous and excess <= previous * remaining:
+            return False, excess * period / previous
+        return False, period * remaining
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    return import_string(settings.THROTTLE_STORE)()
+
+
+class BucketThrottle(BaseThrottle):
+    """Token bucket per (scope, user) for authenticated requests, per (scope, IP) otherwise."""
+
+    scope = None
+
+    def get_scope(self, view):
+        return self.scope
+
+    def get_ident_key(self, request, user):
+        if user and user.is_authenticated:
+            return f'user:{user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        return self.check(request, request.user, self.get_scope(view))
+
+    def check(self, request, user, scope=None):
+        # Also the entry point for the plain Django views (see athrottle), which have no DRF request
+        self.retry_after = None
+        scope = scope or self.scope
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if not settings.THROTTLE_ENABLED or rate is None:
+            return True
+        key = self.get_ident_key(request, user)
+        if key is None:
+            return True
+        allowed, self.retry_after = get_store().consume(f'{scope}:{key}', *parse_rate(rate))
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class AnonBucketThrottle(BucketThrottle):
+    scope = 'anon'
+
+    def get_ident_key(self, request, user):
+        if user and user.is_authenticated:
+            return None
+        return super().get_ident_key(request, user)
+
+
+class UserBucketThrottle(BucketThrottle):
+    scope = 'user'
+
+    def get_ident_key(self, request, user):
+        if user and user.is_authenticated:
+            return super().get_ident_key(request, user)
+        return None
+
+
+# Separate budgets for endpoints that hash passwords or take row locks
+class RegisterThrottle(BucketThrottle):
+    scope = 'register'
+
+
+class LoginThrottle(BucketThrottle):
+    scope = 'login'
+
+
+class ClaimThrottle(BucketThrottle):
+    scope = 'claim'
+
+
+class ActionBucketThrottle(BucketThrottle):
+    # Scope per viewset action from the view's `throttle_scopes`; other actions are not limited here
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scopes', {}).get(getattr(view, 'action', None))
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        return scope is None or self.check(request, request.user, scope)
+
+
+async def athrottle(request, user, throttle_classes=None):
+    """
+    DRF throttling for the plain (async) Django views: the seconds to wait when a bucket is
+    empty, None otherwise. Defaults to DEFAULT_THROTTLE_CLASSES, like the DRF views.
+    """
+    throttles = [throttle_class() for throttle_class in throttle_classes or api_settings.DEFAULT_THROTTLE_CLASSES]
+
+    def check():
+        for throttle in throttles:
+            if not throttle.check(request, user):
+                return throttle.wait() or 0
+        return None
+
+    # The store may be a network round trip (redis), so not in the event loop
+    return await sync_to_async(check, thread_sensitive=False)()
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ServiceViewSet, OrderViewSet, UserAccountViewSet, register_user
+from .views import CategoryViewSet, ServiceViewSet, OrderViewSet, UserAccountViewSet, AnalyticsViewSet, CalendarViewSet, register_user, order_stream, mpesa_callback
+from .views import async_service_list, async_order_detail, async_my_gigs
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
@@ -21,10 +22,17 @@ router.register(r'users', UserAccountViewSet)
 router.register(r'categories', CategoryViewSet)
 router.register(r'services', ServiceViewSet)
 router.register(r'orders', OrderViewSet)
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
+router.register(r'calendar', CalendarViewSet, basename='calendar')
 # router.register(r'carts', CartViewSet, basename='cart')
 
 urlpatterns = [
     path('auth/register/', register_user, name='register-user'),
+    path('orders/stream/', order_stream, name='order-stream'),
+    path('payments/mpesa/callback/', mpesa_callback, name='mpesa-callback'),
+    path('async/services/', async_service_list, name='async-service-list'),
+    path('async/orders/my_gigs/', async_my_gigs, name='async-my-gigs'),
+    path('async/orders/<int:pk>/', async_order_detail, name='async-order-detail'),
     path('', include(router.urls)),
 ]
 urlpatterns += [
@@ -1,76 +1,150 @@
 from rest_framework import viewsets, permissions, status
-from .models import Category, Service, Order, UserAccount, OrderItem
+from .models import Category, Service, Order, UserAccount, OrderItem, OrderDailyStat, OrderMatch, CalendarEntry
 from .serializers import CategorySerializer, ServiceSerializer, OrderSerializer, UserCreateSerializer, UserSerializer
-from rest_framework.permissions import IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .serializers import OrderReadSerializer, ServiceReadSerializer, CalendarEntrySerializer
+from .pagination import IdCursorPagination, OrderCursorPagination, MatchCursorPagination
+from .routers import ReplicaReadMixin
+from .cache import CatalogCacheMixin, OrderConditionalMixin, acatalog_generation
+from .filters import ServiceFilter, OrderFilter, TiebreakOrderingFilter
+from .authentication import CachedJWTAuthentication, endpoint_authentication_classes
+from .catalog_io import CONTENT_TYPES, CatalogTransferMixin
+from .order_export import export_orders
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly, IsAdminUser
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.filters import SearchFilter
+from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import translate_validation
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.cache import patch_cache_control
+from django.utils import timezone
+from django.views.static import serve
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from .events import get_backend
+from .mpesa import StkPushError, callback_allowed, ingest_callback, start_stk_push
+from .availability import free_busy
+from .throttling import ActionBucketThrottle, AnonBucketThrottle, ClaimThrottle, RegisterThrottle, UserBucketThrottle, athrottle
+from djoser.views import UserViewSet as DjoserUserViewSet
+import asyncio
+import hashlib
+import math
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AnonBucketThrottle, UserBucketThrottle, RegisterThrottle])
 def register_user(request):
     serializer = UserCreateSerializer(data=request.data)
     if serializer.is_valid():
-        print("Valid data received:", serializer.validated_data)  # Debug print
         user = serializer.save()
         return Response({
             'user': UserCreateSerializer(user).data,
             'message': 'User created successfully'
         }, status=status.HTTP_201_CREATED)
-    print("Validation errors:", serializer.errors)  # Debug print
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class AuthUserViewSet(DjoserUserViewSet):
+    # djoser's /auth/users/, with the register and login budgets on the actions that hash
+    # or check passwords or send mail
+    throttle_classes = [AnonBucketThrottle, UserBucketThrottle, ActionBucketThrottle]
+    throttle_scopes = {
+        'create': 'register', 'resend_activation': 'register', 'reset_password': 'register',
+        'reset_username': 'register', 'set_password': 'login', 'set_username': 'login',
+        'reset_password_confirm': 'login', 'reset_username_confirm': 'login', 'destroy': 'login',
+    }
+
 class UserAccountViewSet(viewsets.ModelViewSet):
     queryset = UserAccount.objects.all()
     serializer_class = UserSerializer
+    authentication_classes = endpoint_authentication_classes('users')
     permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         if self.request.user.is_staff:
             return UserAccount.objects.all()
         return UserAccount.objects.filter(id=self.request.user.id)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CatalogCacheMixin, CatalogTransferMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    transfer_kind = 'categories'
+    pagination_class = IdCursorPagination
 
-class ServiceViewSet(viewsets.ModelViewSet):
+class ServiceViewSet(CatalogCacheMixin, CatalogTransferMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    transfer_kind = 'services'
+    pagination_class = IdCursorPagination
+    filter_backends = [DjangoFilterBackend, SearchFilter, TiebreakOrderingFilter]
+    filterset_class = ServiceFilter
+    # icontains; backed by trigram indexes on PostgreSQL (migration 0014)
+    search_fields = ['name', 'description']
+    ordering_fields = ['id', 'price', 'name']
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve'):
+            return ServiceReadSerializer
+        return ServiceSerializer
 
     # def perform_create(self, serializer):
     #     serializer.save(provider=self.request.user)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(OrderConditionalMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    authentication_classes = endpoint_authentication_classes('orders')
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
+    lookup_value_regex = r'\d+'
+    filter_backends = [DjangoFilterBackend, TiebreakOrderingFilter]
+    filterset_class = OrderFilter
+    ordering_fields = ['created_at', 'date', 'total_price']
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'CLIENT':
-            return Order.objects.filter(user=user)
-        elif user.role == 'PROVIDER':
-            # Providers can see unclaimed orders and their own claimed orders
-            return Order.objects.filter(
-                Q(provider__isnull=True) 
-                # |  # Unclaimed orders
-                # Q(provider=user)  # Orders claimed by this provider
-            )
-        return Order.objects.none()
+        return Order.objects.with_related().visible_to(self.request.user)
+
+    def get_serializer_class(self):
+        # Reads skip DRF's per-field overhead and honour ?fields=
+        if self.action in ('list', 'retrieve', 'my_gigs', 'matches'):
+            return OrderReadSerializer
+        return OrderSerializer
+
+    def get_serializer(self, *args, **kwargs):
+        # A JSON array creates a batch of orders in one request
+        if isinstance(kwargs.get('data'), list):
+            kwargs.update(many=True, allow_empty=False)
+        return super().get_serializer(*args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-    @action(detail=True, methods=['POST'])
+    def perform_update(self, serializer):
+        # Moving a claimed order moves its booking (sync_order_booking), which the exclusion
+        # constraint refuses on PostgreSQL when the provider blacked out the new day meanwhile
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            raise ValidationError({'date': "The provider is not available on this day."})
+
+    @action(detail=True, methods=['POST'], throttle_classes=[UserBucketThrottle, ClaimThrottle])
     def claim_order(self, request, pk=None):
-        order = self.get_object()
         user = request.user
 
         # Check if user is a provider
@@ -80,50 +154,78 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Check if order is already claimed
-        if order.provider is not None:
-            return Response(
-                {"error": "This order has already been claimed"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Check if order is in PENDING status
-        if order.status != 'PENDING':
+        # Claim the order, unless another provider got there first
+        if not Order.objects.claim(pk, user):
+            order = get_object_or_404(Order, pk=pk)
+            if order.provider is not None:
+                return Response(
+                    {"error": "This order has already been claimed"}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if order.status == 'PENDING':
+                return Response(
+                    {"error": f"You are not available on {order.date}"}, 
+                    status=status.HTTP_409_CONFLICT
+                )
             return Response(
                 {"error": "Only pending orders can be claimed"}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Claim the order
-        order.provider = user
-        order.taken_by_provider = True
-        order.status = 'PROCESSING'
-        order.save()
-
+        order = Order.objects.with_related().get(pk=pk)
         serializer = self.get_serializer(order)
         return Response(serializer.data)
 
     @action(detail=True, methods=['POST'])
     def release_order(self, request, pk=None):
-        order = self.get_object()
         user = request.user
 
-        # Check if this provider owns the order
-        if order.provider != user:
+        # Release the order, provided this provider owns it
+        if not Order.objects.release(pk, user):
+            get_object_or_404(Order, pk=pk)
             return Response(
                 {"error": "You can only release orders you have claimed"}, 
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Release the order
-        order.provider = None
-        order.taken_by_provider = False
-        order.status = 'PENDING'
-        order.save()
-
+        order = Order.objects.with_related().get(pk=pk)
         serializer = self.get_serializer(order)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['POST'])
+    def pay(self, request, pk=None):
+        # Starts an STK push to the posted `phone`, or the order's telephone; the callback marks the order paid
+        order = get_object_or_404(Order, pk=pk, user=request.user)
+        if order.paid:
+            return Response({"error": "This order is already paid"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            checkout_request_id = start_stk_push(order, request.data.get('phone'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except StkPushError as e:
+            return Response({"error": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({'checkout_request_id': checkout_request_id})
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        # Accounting export: ?start=, ?end= (YYYY-MM-DD, by creation day), ?status=, ?file_format=csv|jsonl
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in CONTENT_TYPES:
+            raise ValidationError({'file_format': f"Choose one of {', '.join(CONTENT_TYPES)}."})
+        filters = {'status': request.query_params.get('status')}
+        for param in ('start', 'end'):
+            value = request.query_params.get(param)
+            try:
+                filters[param] = parse_date(value) if value else None
+            except ValueError:
+                filters[param] = None
+            if value and filters[param] is None:
+                raise ValidationError({param: "Use the YYYY-MM-DD format."})
+
+        response = StreamingHttpResponse(export_orders(file_format, **filters), content_type=CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{file_format}"'
+        return response
+
     @action(detail=False, methods=['GET'])
     def my_gigs(self, request):
         user = request.user
@@ -133,10 +235,399 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         else:
-            orders = Order.objects.filter(provider=user)
-            serializer = self.get_serializer(orders, many=True)
-            return Response(serializer.data)
+            orders = self.filter_queryset(Order.objects.with_related().filter(provider=user))
+            return self.conditional_response(request, orders, self.render_gigs, orders)
+
+    @action(detail=False, methods=['GET'])
+    def matches(self, request):
+        # Open orders near the provider, best match first (api.matching keeps the candidates current)
+        user = request.user
+        if user.role != 'PROVIDER':
+            return Response(
+                {"error": "You need to be a provider to view this page"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        if not user.region:
+            return Response(
+                {"error": "Set your location to be matched with orders"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        orders = self.filter_queryset(Order.objects.filter(provider__isnull=True, status='PENDING'))
+        candidates = OrderMatch.objects.filter(
+            provider=user, order__in=orders, order__date__gte=timezone.localdate()
+        ).exclude(
+            # Days the provider is booked or blacked out
+            Exists(CalendarEntry.objects.filter(provider=user).covering(OuterRef('order__date')))
+        ).only('order_id', 'score')
+        paginator = MatchCursorPagination()
+        # No view: the view's OrderingFilter names Order fields, and the candidates are always ranked by score
+        page = paginator.paginate_queryset(candidates, request)
+        by_id = Order.objects.with_related().in_bulk([match.order_id for match in page])
+        # An order deleted since the page was read is skipped
+        page = [match for match in page if match.order_id in by_id]
+        results = self.get_serializer([by_id[match.order_id] for match in page], many=True).data
+        for data, match in zip(results, page):
+            data['match_score'] = match.score
+        return paginator.get_paginated_response(results)
+
+    def render_gigs(self, request, orders):
+        page = self.paginate_queryset(orders)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+
+class CalendarViewSet(viewsets.ModelViewSet):
+    # The provider's own calendar; free/busy of any providers for clients planning an event
+    serializer_class = CalendarEntrySerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
+
+    def get_queryset(self):
+        entries = CalendarEntry.objects.filter(provider=self.request.user)
+        if self.action in ('update', 'partial_update', 'destroy'):
+            # Bookings follow their order: release the order to free the day
+            entries = entries.filter(kind='BLACKOUT')
+        return entries
+
+    def perform_create(self, serializer):
+        if self.request.user.role != 'PROVIDER':
+            raise PermissionDenied("Only providers have a calendar")
+        self.save_entry(serializer, provider=self.request.user, kind='BLACKOUT')
+
+    def perform_update(self, serializer):
+        self.save_entry(serializer)
+
+    def save_entry(self, serializer, **kwargs):
+        try:
+            with transaction.atomic():
+                serializer.save(**kwargs)
+        except IntegrityError:
+            # Lost a race with a claim for the same day (exclusion constraint on PostgreSQL)
+            raise ValidationError("This overlaps a booking or blackout already in your calendar.")
+
+    @action(detail=False, methods=['GET'])
+    def freebusy(self, request):
+        # ?providers=1,2,3&start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive)
+        try:
+            provider_ids = sorted({int(pk) for pk in request.query_params.get('providers', '').split(',') if pk.strip()})
+        except ValueError:
+            raise ValidationError({'providers': "Use a comma separated list of provider ids."})
+        if not provider_ids or len(provider_ids) > settings.CALENDAR_MAX_PROVIDERS:
+            raise ValidationError({'providers': f"Ask for 1 to {settings.CALENDAR_MAX_PROVIDERS} providers."})
+        bounds = {}
+        for param in ('start', 'end'):
+            try:
+                bounds[param] = parse_date(request.query_params.get(param, ''))
+            except ValueError:
+                bounds[param] = None
+            if bounds[param] is None:
+                raise ValidationError({param: "Use the YYYY-MM-DD format."})
+        start, end = bounds['start'], bounds['end']
+        if not 0 <= (end - start).days < settings.CALENDAR_MAX_DAYS:
+            raise ValidationError({'end': f"End must be within {settings.CALENDAR_MAX_DAYS} days after start."})
+        calendar = free_busy(provider_ids, start, end)
+        return Response({'start': start, 'end': end, 'providers': calendar})
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    # Reads the OrderDailyStat rollup only; ?start=, ?end= (YYYY-MM-DD) and ?status= narrow every report
+    permission_classes = [IsAuthenticated]
+    intervals = {'day': TruncDay, 'month': TruncMonth}
+
+    def get_stats(self, request):
+        stats = OrderDailyStat.objects.order_by()
+        for param, lookup in (('start', 'day__gte'), ('end', 'day__lte')):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    day = parse_date(value)
+                except ValueError:
+                    day = None
+                if day is None:
+                    raise ValidationError({param: "Use the YYYY-MM-DD format."})
+                stats = stats.filter(**{lookup: day})
+        if request.query_params.get('status'):
+            stats = stats.filter(status=request.query_params['status'])
+        return stats
+
+    def get_interval(self, request):
+        interval = request.query_params.get('interval', 'day')
+        if interval not in self.intervals:
+            raise ValidationError({'interval': f"Choose one of {', '.join(self.intervals)}."})
+        return self.intervals[interval]('day')
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def revenue_by_event_type(self, request):
+        rows = (
+            self.get_stats(request).values('event_type')
+            .annotate(orders=Sum('order_count'), revenue=Sum('revenue'), paid_revenue=Sum('paid_revenue'))
+            .order_by('-revenue')
+        )
+        return Response(list(rows))
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def orders_by_status(self, request):
+        rows = (
+            self.get_stats(request).values('status', period=self.get_interval(request))
+            .annotate(orders=Sum('order_count'), revenue=Sum('revenue'))
+            .order_by('period', 'status')
+        )
+        return Response(list(rows))
 
+    @action(detail=False, methods=['GET'])
+    def provider_earnings(self, request):
+        user = request.user
+        provider = user.id
+        if user.is_staff and request.query_params.get('provider'):
+            try:
+                provider = int(request.query_params['provider'])
+            except ValueError:
+                raise ValidationError({'provider': "Use a provider id."})
+        elif user.role != 'PROVIDER':
+            return Response(
+                {"error": "You need to be a provider to view this page"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        stats = self.get_stats(request).filter(provider_id=provider)
+        rows = (
+            stats.values(period=self.get_interval(request))
+            .annotate(orders=Sum('order_count'), revenue=Sum('revenue'), paid_revenue=Sum('paid_revenue'))
+            .order_by('period')
+        )
+        totals = stats.aggregate(orders=Sum('order_count'), revenue=Sum('revenue'), paid_revenue=Sum('paid_revenue'))
+        return Response({'totals': totals, 'periods': list(rows)})
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+@throttle_classes([])  # Safaricom retries in bursts from a few IPs; rejecting them would lose payments
+def mpesa_callback(request):
+    # Only stores the callback; matching to orders happens in `manage.py process_payments`
+    if not callback_allowed(request):
+        return Response({"error": "Callback not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    try:
+        ingest_callback(request.data)
+    except (ValueError, TypeError) as e:
+        return Response({"ResultCode": 1, "ResultDesc": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    # Duplicates are acknowledged too, otherwise Safaricom keeps retrying them
+    return Response({"ResultCode": 0, "ResultDesc": "Accepted"})
+
+def serve_media(request, path, document_root=None):
+    # django.views.static.serve (Last-Modified, If-Modified-Since) plus a Cache-Control policy
+    response = serve(request, path, document_root=document_root)
+    if path.startswith('service_images/variants/'):
+        # Named after a hash of their content (api.images), so a URL never changes meaning
+        patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+async def authenticate_async(request, allow_query_token=False):
+    # JWT header or session for the async views. EventSource cannot send headers,
+    # so the order stream also accepts the JWT as ?token=
+    authenticator = CachedJWTAuthentication()
+    raw_token = request.GET.get('token') if allow_query_token else None
+    header = authenticator.get_header(request)
+    if raw_token is None and header is not None:
+        raw_token = authenticator.get_raw_token(header)
+    if raw_token is None:
+        user = await request.auser()
+        return user if user.is_authenticated else None
+    try:
+        validated_token = authenticator.get_validated_token(raw_token)
+        return await sync_to_async(authenticator.get_user)(validated_token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+async def order_event_stream():
+    events = get_backend().subscribe()
+    # Waiting on a task (instead of wait_for) keeps a timeout from cancelling the subscription
+    next_event = asyncio.ensure_future(anext(events))
+    try:
+        yield ': connected\n\n'
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=settings.ORDER_EVENTS_HEARTBEAT)
+            if not done:
+                yield ': keep-alive\n\n'
+                continue
+            message = next_event.result()
+            next_event = asyncio.ensure_future(anext(events))
+            yield f"event: {message['event']}\ndata: {json.dumps(message)}\n\n"
+    finally:
+        next_event.cancel()
+        try:
+            await next_event
+        except (asyncio.CancelledError, StopAsyncIteration):
+            pass
+        await events.aclose()
+
+
+async def order_stream(request):
+    # Server-Sent Events feed of order created/claimed/released events for providers
+    user = await authenticate_async(request, allow_query_token=True)
+    if user is None:
+        return JsonResponse(
+            {"error": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    wait = await athrottle(request, user)
+    if wait is not None:
+        return throttled(wait)
+    if user.role != 'PROVIDER':
+        return JsonResponse(
+            {"error": "Only providers can follow the order feed"},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    response = StreamingHttpResponse(order_event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Async twins of the hot read endpoints for ASGI servers: they wait on the database in the event
+# loop (aget/aiterator) instead of holding a worker thread. Same JSON and ?fields= as the DRF views,
+# with a simpler ?cursor= keyset pagination.
+
+def encode_cursor(*values):
+    return urlsafe_b64encode('|'.join(str(value) for value in values).encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        return urlsafe_b64decode(token.encode()).decode().split('|')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def async_page_size(request):
+    try:
+        size = int(request.GET.get('page_size', settings.REST_FRAMEWORK['PAGE_SIZE']))
+    except ValueError:
+        size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    return max(1, min(size, IdCursorPagination.max_page_size))
+
+
+def async_page(request, rows, size, serializer_class, cursor_values):
+    # rows holds one extra object when there is a next page
+    next_url = None
+    if len(rows) > size:
+        rows = rows[:size]
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor(*cursor_values(rows[-1]))
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    results = serializer_class(rows, many=True, context={'request': request}).data
+    return {'next': next_url, 'results': results}
+
+
+def bad_request(detail):
+    return JsonResponse(detail, status=status.HTTP_400_BAD_REQUEST)
+
+
+def throttled(wait):
+    # Same body and Retry-After as DRF's Throttled
+    response = JsonResponse(
+        {"detail": f"Request was throttled. Expected available in {math.ceil(wait)} seconds."},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+async def async_service_list(request):
+    # GET /async/services/?category=&min_price=&max_price=&cursor=&page_size=&fields=, cached like CatalogCacheMixin
+    wait = await athrottle(request, await authenticate_async(request))
+    if wait is not None:
+        return throttled(wait)
+    generation = await acatalog_generation()
+    key = f'catalog:{generation}:{hashlib.md5(request.build_absolute_uri().encode()).hexdigest()}'
+    data = await cache.aget(key)
+    if data is not None:
+        response = JsonResponse(data)
+        response['X-Cache'] = 'HIT'
+        return response
+
+    # Same filters and 400s as ServiceViewSet; validating category looks the row up, so not in the event loop
+    filterset = ServiceFilter(request.GET, queryset=Service.objects.order_by('id'))
+    if not await sync_to_async(filterset.is_valid)():
+        return bad_request(translate_validation(filterset.errors).detail)
+    services = filterset.qs
+    if 'cursor' in request.GET:
+        cursor = decode_cursor(request.GET['cursor'])
+        if not cursor or not cursor[0].isdigit():
+            return bad_request({"error": "Invalid cursor"})
+        services = services.filter(id__gt=int(cursor[0]))
+    size = async_page_size(request)
+    rows = [service async for service in services[:size + 1].aiterator()]
+    try:
+        data = async_page(request, rows, size, ServiceReadSerializer, lambda service: (service.id,))
+    except ValidationError as e:
+        return bad_request(e.detail)
+    await cache.aset(key, data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    response = JsonResponse(data)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+async def async_order_detail(request, pk):
+    user = await authenticate_async(request)
+    if user is None:
+        return JsonResponse(
+            {"error": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    wait = await athrottle(request, user)
+    if wait is not None:
+        return throttled(wait)
+    try:
+        order = await Order.objects.with_related().visible_to(user).aget(pk=pk)
+    except Order.DoesNotExist:
+        return JsonResponse({"detail": "No Order matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        return JsonResponse(OrderReadSerializer(order, context={'request': request}).data)
+    except ValidationError as e:
+        return bad_request(e.detail)
+
+
+async def async_my_gigs(request):
+    # GET /async/orders/my_gigs/ with the OrderFilter parameters, newest first
+    user = await authenticate_async(request)
+    if user is None:
+        return JsonResponse(
+            {"error": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    wait = await athrottle(request, user)
+    if wait is not None:
+        return throttled(wait)
+    if user.role != 'PROVIDER':
+        return JsonResponse(
+            {"error": "You need to be a provider to view this page"},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    filterset = OrderFilter(request.GET, queryset=Order.objects.with_related().filter(provider=user))
+    if not filterset.is_valid():
+        return bad_request(filterset.errors)
+    orders = filterset.qs.order_by('-created_at', '-id')
+    if 'cursor' in request.GET:
+        cursor = decode_cursor(request.GET['cursor'])
+        try:
+            created_at = parse_datetime(cursor[0]) if cursor and len(cursor) == 2 else None
+        except ValueError:
+            created_at = None
+        if created_at is None or not cursor[1].isdigit():
+            return bad_request({"error": "Invalid cursor"})
+        orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=int(cursor[1])))
+    size = async_page_size(request)
+    # chunk_size lets aiterator() run the prefetches
+    rows = [order async for order in orders[:size + 1].aiterator(chunk_size=size + 1)]
+    try:
+        return JsonResponse(async_page(request, rows, size, OrderReadSerializer, lambda order: (order.created_at.isoformat(), order.id)))
+    except ValidationError as e:
+        return bad_request(e.detail)
 
         
 # class CartViewSet(viewsets.ModelViewSet):
@@ -45,10 +45,15 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'drf_yasg',
     'corsheaders',
+    'django_filters',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # gzip/brotli for JSON and CSV (api/middleware.py); must wrap everything that touches the body
+    'api.middleware.CompressionMiddleware',
+    # 304s for responses that carry an ETag/Last-Modified but were not short-circuited by a view
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,12 +87,103 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Set DB_ENGINE=postgresql (and the DB_* variables below) in production;
+# local development keeps using SQLite.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    def postgres_database(host):
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'eventeasy'),
+            'USER': os.environ.get('DB_USER', 'eventeasy'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+        }
+        if os.environ.get('DB_POOL', 'true').lower() == 'true':
+            # psycopg's pool hands out connections itself, Django must not keep them open
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS'] = {'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+                'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            }}
+        else:
+            database['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+        return database
+
+    DATABASES = {'default': postgres_database(os.environ.get('DB_HOST', 'localhost'))}
+
+    # Comma separated read replicas, used for catalog reads by api.routers.ReplicaRouter. Tests
+    # read the default test database through them, since only default is migrated
+    for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica_{index}'] = {**postgres_database(host.strip()), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # WAL lets readers run alongside the single writer; IMMEDIATE takes the
+                # write lock up front instead of failing on upgrade with "database is locked"
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    'PRAGMA cache_size=-20000;'
+                    'PRAGMA mmap_size=134217728;'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
     }
-}
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+
+# Cache
+# CACHE_BACKEND=locmem is per process; use file or redis when running several workers
+# so catalog invalidation (api.cache) is seen by all of them. redis needs the redis package.
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+    }}
+elif CACHE_BACKEND == 'file':
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', BASE_DIR / 'cache'),
+    }}
+else:
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }}
+
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+# Seconds browsers and proxies may reuse a catalog response before revalidating its ETag
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', 0))
+
+# Response compression (api.middleware.CompressionMiddleware). Smaller bodies fit in a
+# packet or two and are not worth the CPU; brotli quality 5 keeps dynamic JSON cheap to encode.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+# Cache-Control max-age for uploaded media; content-hashed image variants are cached for a year
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 86400))
+
+# Order events pushed to providers over /orders/stream/ (api/events.py). The local
+# backend only reaches clients of the same process; use RedisBackend with several workers.
+ORDER_EVENTS_BACKEND = os.environ.get('ORDER_EVENTS_BACKEND', 'api.events.LocalBackend')
+ORDER_EVENTS_REDIS_URL = os.environ.get('ORDER_EVENTS_REDIS_URL', 'redis://127.0.0.1:6379')
+ORDER_EVENTS_QUEUE_SIZE = 100
+ORDER_EVENTS_HEARTBEAT = 15  # seconds between keep-alive comments on idle streams
 
 
 # Password validation
@@ -109,24 +205,64 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
+    # JWT first: it is what the frontend sends, and a warm user cache makes it query-free
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.SessionAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
     ],
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', 25)),
+    # Proxies in front of the app that append to X-Forwarded-For. 0 uses REMOTE_ADDR: otherwise every
+    # client could name its own address and get a fresh anon/login/register bucket per request
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+    # Token buckets from api.throttling; claim_order, register_user and the login views add their own scope
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.AnonBucketThrottle',
+        'api.throttling.UserBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': os.environ.get('THROTTLE_ANON_RATE', '120/min'),
+        'user': os.environ.get('THROTTLE_USER_RATE', '600/min'),
+        'register': os.environ.get('THROTTLE_REGISTER_RATE', '10/hour'),
+        'login': os.environ.get('THROTTLE_LOGIN_RATE', '20/min'),
+        'claim': os.environ.get('THROTTLE_CLAIM_RATE', '30/min'),
+    },
     # 'DEFAULT_PERMISSION_CLASSES': [
     #     'rest_framework.permissions.IsAuthenticated',
     #     'res'
     # ],
 }
 
+# CacheBucketStore shares budgets between workers only on a redis (or memcached) cache, the
+# backends with an atomic incr; with locmem it is per process. The file cache's incr is not
+# atomic, so it falls back to MemoryBucketStore, which is exact but per process too.
+THROTTLE_STORE = os.environ.get(
+    'THROTTLE_STORE',
+    'api.throttling.MemoryBucketStore' if CACHE_BACKEND == 'file' else 'api.throttling.CacheBucketStore',
+)
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', 'true').lower() == 'true'
+
+# PAGE_SIZE is shared by the per-viewset cursor paginators in api/pagination.py
+SILENCED_SYSTEM_CHECKS = ['rest_framework.W001']
+
 AUTHENTICATION_BACKENDS = (
 
     'django.contrib.auth.backends.ModelBackend',
 )
 
+# Per-endpoint authenticator order, keyed by the names passed to
+# api.authentication.endpoint_authentication_classes ('orders', 'users'); endpoints
+# not listed use DEFAULT_AUTHENTICATION_CLASSES. For example, JWT-only orders:
+#   'orders': ['api.authentication.CachedJWTAuthentication'],
+API_AUTHENTICATION_CLASSES = {}
+
+# Users loaded by CachedJWTAuthentication are reused for this many seconds per process
+AUTH_USER_CACHE_TTL = 60
+AUTH_USER_CACHE_SIZE = 10000
+
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
+    'TOKEN_OBTAIN_SERIALIZER': 'api.authentication.TokenObtainPairSerializer',
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=120),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_TOKEN_CLASSES': (
@@ -192,6 +328,36 @@ EMAIL_HOST_USER = 'accounts@eventeasykenya.com'
 EMAIL_HOST_PASSWORD = 'foBko!4r'
 
 DEFAULT_FROM_EMAIL = 'accounts@eventeasykenya.com'
+
+# djoser emails are written to the OutboundEmail table and sent by
+# `manage.py send_queued_email`; set EMAIL_QUEUE_ENABLED=false to send inline
+EMAIL_QUEUE_ENABLED = os.environ.get('EMAIL_QUEUE_ENABLED', 'true').lower() == 'true'
+EMAIL_QUEUE_BATCH_SIZE = 50
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+EMAIL_QUEUE_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+EMAIL_QUEUE_LEASE = 300  # seconds a claimed batch stays hidden from other workers
+
+# M-Pesa callbacks are stored as they arrive and matched to orders by
+# `manage.py process_payments`. The callback is refused unless a token or a
+# source allowlist is set: the URL registered with Daraja carries the token as
+# ?token=, and MPESA_ALLOWED_IPS takes comma separated Safaricom addresses or CIDRs
+MPESA_CALLBACK_TOKEN = os.environ.get('MPESA_CALLBACK_TOKEN', '')
+MPESA_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('MPESA_ALLOWED_IPS', '').split(',') if ip.strip()]
+MPESA_BATCH_SIZE = int(os.environ.get('MPESA_BATCH_SIZE', '500'))
+# STK push (POST /orders/<id>/pay/) through Daraja; api.mpesa.StubBackend accepts every push locally
+MPESA_STK_BACKEND = os.environ.get('MPESA_STK_BACKEND', 'api.mpesa.DarajaBackend')
+MPESA_API_URL = os.environ.get('MPESA_API_URL', 'https://sandbox.safaricom.co.ke')
+MPESA_CONSUMER_KEY = os.environ.get('MPESA_CONSUMER_KEY', '')
+MPESA_CONSUMER_SECRET = os.environ.get('MPESA_CONSUMER_SECRET', '')
+MPESA_SHORTCODE = os.environ.get('MPESA_SHORTCODE', '174379')
+MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY', '')
+# The callback URL registered with the push, including ?token=MPESA_CALLBACK_TOKEN
+MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', '')
+
+# Limits of one /calendar/freebusy/ request
+CALENDAR_MAX_PROVIDERS = 100
+CALENDAR_MAX_DAYS = 366
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -214,6 +380,15 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/media/'  # URL to access the media files
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resized Service.image variants (api/images.py), longest edge in pixels
+SERVICE_IMAGE_SIZES = {
+    'thumbnail': 320,
+    'medium': 800,
+    'large': 1600,
+}
+SERVICE_IMAGE_QUALITY = 80
+SERVICE_IMAGE_ASYNC = True  # build variants in a background thread after the upload commits
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -15,16 +15,30 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from djoser.views import TokenCreateView
+from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework.routers import DefaultRouter
+from api.views import AuthUserViewSet, serve_media
+from api.throttling import AnonBucketThrottle, LoginThrottle, UserBucketThrottle
+
+login_throttles = [AnonBucketThrottle, UserBucketThrottle, LoginThrottle]
+
+# Same routes and names as djoser.urls, with the throttled subclass of djoser's UserViewSet
+auth_router = DefaultRouter()
+auth_router.register('users', AuthUserViewSet)
 
 urlpatterns = [
     path('', include("api.urls")),
     path('admin/', admin.site.urls),
-    path('auth/', include('djoser.urls')),
+    # Ahead of the djoser includes so the login views get their own throttle budget
+    re_path(r'^auth/jwt/create/?', TokenObtainPairView.as_view(throttle_classes=login_throttles), name='jwt-create'),
+    re_path(r'^auth/token/login/?$', TokenCreateView.as_view(throttle_classes=login_throttles), name='login'),
+    path('auth/', include(auth_router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
     path('auth/', include('djoser.urls.jwt')),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)